@@ -28,4 +28,12 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=dependencies,
+    extras_require={
+        'dask': ['dask[distributed]'],
+    },
+    entry_points={
+        'console_scripts': [
+            f'cses-evaluate=tethysapp.{app_package}.evaluate:main',
+        ],
+    },
 )
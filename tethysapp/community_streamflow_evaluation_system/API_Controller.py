@@ -0,0 +1,227 @@
+"""
+Headless JSON API, version 1, for pipelines that need station lists and scores without the map.
+
+    api/v1/stations/?state=UT
+    api/v1/stations/?huc=1602,1603
+    api/v1/stations/?reach_ids=10126000,10068500
+    api/v1/metrics/?state=UT&model_id=NWM_v2.1&start-date=2012-01-01&end-date=2014-12-31
+
+Stations are ordered by site id and paged with an opaque cursor: every page has ``next``, the cursor of the next
+page (null on the last one), passed back as ``cursor``. ``limit`` sets the page size and ``fields`` the keys kept
+per row. Responses are gzipped for clients that accept it. The endpoints read through the same storage, caches and
+readers as the map views, and metrics are computed for one page of stations at a time.
+"""
+import base64
+import gzip
+import json
+
+import numpy as np
+
+from tethys_sdk.routing import controller
+from django.http import HttpResponse
+
+from .storage import get_storage
+from .series import usgs_key, model_key, flow_column, USGS_FLOW
+from .alignment import align_many
+from .metrics import batch_skill, batch_fdc, METRICS, FDC_METRICS
+from .overlay import read_all, available_pairs
+from .utils import streamstats, huc_sites
+from .query import QueryError, parse_date, parse_hucs, parse_model, parse_sites
+
+
+API_VERSION = 'v1'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+#responses smaller than this are sent as they are
+GZIP_MIN_BYTES = 1024
+
+#Streamstats.csv columns -> station fields
+STATION_FIELDS = {
+    'NWIS_site_id': 'site_id',
+    'NWIS_sitename': 'name',
+    'state_id': 'state',
+    'NHD_reachcode': 'NHD_id',
+    'dec_lat_va': 'lat',
+    'dec_long_va': 'lon',
+}
+
+
+class APIError(Exception):
+    """
+    Invalid API request, answered with `status` and the message.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def json_response(request, payload, status=200):
+    """
+    JSON response, gzipped when the client accepts it and it is worth it.
+    """
+    body = json.dumps(payload, separators=(',', ':'), allow_nan=False).encode()
+    response_headers = {'Vary': 'Accept-Encoding'}
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        body = gzip.compress(body, compresslevel=5)
+        response_headers['Content-Encoding'] = 'gzip'
+    response = HttpResponse(body, content_type='application/json', status=status)
+    for header, value in response_headers.items():
+        response[header] = value
+    return response
+
+
+def api_view(fn):
+    """
+    Run an API view, answer its APIErrors as JSON errors.
+    """
+    def view(request, *args, **kwargs):
+        try:
+            return json_response(request, fn(request, *args, **kwargs))
+        except APIError as e:
+            return json_response(request, {'error': str(e)}, status=e.status)
+        except QueryError as e:
+            return json_response(request, {'error': e.message, 'field': e.field}, status=e.status)
+    view.__name__ = fn.__name__
+    view.__doc__ = fn.__doc__
+    return view
+
+
+def _split(value):
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+def encode_cursor(site_id):
+    return base64.urlsafe_b64encode(json.dumps({'after': site_id}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return str(json.loads(base64.urlsafe_b64decode(padded))['after'])
+    except (ValueError, KeyError, TypeError):
+        raise APIError('invalid cursor')
+
+
+def select_stations(params, storage):
+    """
+    Station rows of the selection in the request, ordered by site id.
+
+    Args:
+        params (QueryDict): one of state, huc or reach_ids (comma separated).
+
+    Returns:
+        pd.DataFrame: station fields, one row per site.
+    """
+    selectors = [k for k in ('state', 'huc', 'reach_ids') if params.get(k)]
+    if len(selectors) != 1:
+        raise APIError('select stations with exactly one of state, huc or reach_ids')
+    table = streamstats(storage)
+    if selectors[0] == 'state':
+        table = table[table['state_id'].isin(_split(params['state']))]
+    elif selectors[0] == 'huc':
+        table = huc_sites(parse_hucs(params['huc'], 'huc'), storage)
+    else:
+        table = table[table['NWIS_site_id'].isin(parse_sites(params['reach_ids']))]
+    table = table.rename(columns=STATION_FIELDS)
+    return table.sort_values('site_id', kind='stable').reset_index(drop=True)
+
+
+def page(table, params):
+    """
+    The rows of the page the cursor points at, and the cursor of the next page.
+    """
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise APIError('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise APIError(f"limit must be between 1 and {MAX_LIMIT}")
+    start = 0
+    if params.get('cursor'):
+        start = int(table['site_id'].searchsorted(decode_cursor(params['cursor']), side='right'))
+    rows = table.iloc[start:start + limit]
+    more = start + limit < len(table)
+    return rows, encode_cursor(rows['site_id'].iloc[-1]) if more and len(rows) else None
+
+
+def records(rows, params):
+    """
+    Rows as JSON records with the requested fields, NaN as null.
+    """
+    fields = _split(params.get('fields'))
+    unknown = [f for f in fields if f not in rows.columns]
+    if unknown:
+        raise APIError(f"unknown fields {unknown}, available: {list(rows.columns)}")
+    rows = rows[fields] if fields else rows
+    rows = rows.astype(object).where(rows.notna(), None)
+    return [{k: (v.item() if isinstance(v, np.generic) else v) for k, v in row.items()}
+            for row in rows.to_dict('records')]
+
+
+def score(rows, model_id, startdate, enddate, storage):
+    """
+    Metrics columns added to the station rows, null where a station has no data for the model.
+    """
+    keys = {}
+    for site, state, NHD_id in zip(rows['site_id'], rows['state'], rows['NHD_id']):
+        try:
+            keys[site] = ((usgs_key(state, site), USGS_FLOW),
+                          (model_key(model_id, state, NHD_id, site), flow_column(model_id)))
+        except KeyError:
+            continue
+    series = read_all([k for pair in keys.values() for k in pair], storage)
+    aligned = align_many(available_pairs(keys, series), startdate, enddate)
+    sites, pairs = list(aligned), list(aligned.values())
+    columns = batch_skill(pairs)
+    #flow duration curve biases of the whole page, from one sort
+    fdc = batch_fdc(pairs)
+    columns.update({m: fdc[m] for m in FDC_METRICS})
+    position = {site: i for i, site in enumerate(sites)}
+    index = np.array([position.get(site, -1) for site in rows['site_id']], dtype=np.int64)
+    rows = rows.copy()
+    for metric in METRICS + FDC_METRICS:
+        values = np.asarray(columns[metric], dtype=np.float64)
+        picked = np.where(index >= 0, values[np.maximum(index, 0)] if len(values) else np.nan, np.nan)
+        rows[metric] = np.round(picked, 4) if metric != 'n' else np.where(index >= 0, picked, 0).astype(np.int64)
+    rows['model_id'] = model_id
+    return rows
+
+
+def window(params):
+    missing = [k for k in ('start-date', 'end-date') if not params.get(k)]
+    if missing:
+        raise APIError(f"missing parameter {missing[0]}")
+    startdate, enddate = (parse_date(k, params[k]) for k in ('start-date', 'end-date'))
+    if enddate < startdate:
+        raise APIError('end-date ends before start-date')
+    return startdate, enddate
+
+
+@controller(name='api_stations', url=f"api/{API_VERSION}/stations/", login_required=False)
+@api_view
+def api_stations(request):
+    """
+    Stations of a state, HUC or reach list, one page at a time.
+    """
+    storage = get_storage()
+    rows, next_cursor = page(select_stations(request.GET, storage), request.GET)
+    return {'version': API_VERSION, 'count': len(rows), 'next': next_cursor, 'results': records(rows, request.GET)}
+
+
+@controller(name='api_metrics', url=f"api/{API_VERSION}/metrics/", login_required=False)
+@api_view
+def api_metrics(request):
+    """
+    Skill of a model at the stations of a state, HUC or reach list over a window, one page at a time.
+    """
+    params = request.GET
+    if not params.get('model_id'):
+        raise APIError('missing parameter model_id')
+    model_id = parse_model(params['model_id']).value
+    startdate, enddate = window(params)
+    storage = get_storage()
+    rows, next_cursor = page(select_stations(params, storage), params)
+    rows = score(rows, model_id, startdate, enddate, storage)
+    return {'version': API_VERSION, 'model_id': model_id, 'start-date': startdate, 'end-date': enddate,
+            'count': len(rows), 'next': next_cursor, 'results': records(rows, params)}
@@ -0,0 +1,154 @@
+import json
+import os
+import numpy as np
+
+from tethys_sdk.routing import controller
+
+#Text input
+from tethys_sdk.gizmos import SelectInput, TextInput
+
+#utils
+from .utils import reach_json
+from .storage import get_storage, is_missing
+from .timing import span
+from .series import read_series, usgs_key, model_keys, flow_column, USGS_FLOW
+from .alignment import align
+from .metrics import aligned_skill
+from .network import load_network
+from .query import QueryError, defaults
+from .Reach_Controller import Reach_Eval
+
+
+#NextGen hydrofabric shipped with the app
+NEXTGEN_CONFIG = os.path.join('sample_nextgen_data', 'config')
+
+
+def evaluate_stations(stations, model_id, startdate, enddate):
+    """
+    Skill of a model at every station of a subnetwork over the window.
+
+    Args:
+        stations (gpd.GeoDataFrame): stations from reach_json, with state, USGS_id and NHD_id.
+        model_id (str): model to evaluate.
+        startdate (str): first day, 'YYYY-MM-DD'.
+        enddate (str): last day, 'YYYY-MM-DD'.
+
+    Returns:
+        dict: column -> list, KGE, RMSE_cfs and paired_days per station, None where a station has no data.
+    """
+    columns = {'KGE': [], 'RMSE_cfs': [], 'paired_days': []}
+    sites = list(zip(stations['state'], stations['NHD_id'], stations['USGS_id']))
+    for (state, NHD_id, site_id), key in zip(sites, model_keys(model_id, sites)):
+        try:
+            obs = read_series(usgs_key(state, site_id), USGS_FLOW)
+            mod = read_series(key, flow_column(model_id))
+        except Exception as e:
+            if not is_missing(e):
+                raise
+            for values in columns.values():
+                values.append(None)
+            continue
+        with span('metrics'):
+            stats = aligned_skill(align(obs, mod, startdate, enddate))
+        columns['KGE'].append(round(stats['kge'], 2) if np.isfinite(stats['kge']) else None)
+        columns['RMSE_cfs'].append(round(stats['rmse'], 0) if np.isfinite(stats['rmse']) else None)
+        columns['paired_days'].append(stats['n'])
+    return columns
+
+
+#Controller for the Network class
+@controller(
+    name="network_eval",
+    url="network_eval/",
+    app_workspace=True,
+)
+class Network_Eval(Reach_Eval):
+    """
+    Evaluate every gauge of the NextGen subnetwork draining to an outlet, plots as in the Reach class.
+    """
+    map_title = 'Network Evaluation Class'
+    map_subtitle = 'Evaluate hydrological model performance for all gauges upstream of an outlet.'
+    template_name = 'community_streamflow_evaluation_system/network_eval.html'
+    selector = 'outlet_id'
+
+    def get_context(self, request, *args, **kwargs):
+        context = super().get_context(request, *args, **kwargs)
+        context['outlet_id'] = TextInput(display_text='Enter an outlet USGS site or NextGen waterbody/nexus',
+                                         name='outlet_id',
+                                         placeholder='e.g.: 02453000, wb-113061',
+                                         )
+        #runs ingested with nextgen.py are evaluated as the NextGen model
+        context['model_id'] = SelectInput(display_text='Select Model',
+                                          name='model_id',
+                                          multiple=False,
+                                          options=context['model_id'].options + [("NextGen run", "NextGen")],
+                                          initial=['National Water Model v2.1'],
+                                          select2_options={'placeholder': 'Select a model',
+                                                           'allowClear': True})
+        return context
+
+    def compose_layers(self, request, map_view, app_workspace, *args, **kwargs):
+        """
+        Add the gauges of the subnetwork to the MapLayout, with their upstream gauge count and model skill.
+        """
+        network = load_network(os.path.join(app_workspace.path, NEXTGEN_CONFIG))
+
+        #validated user inputs, None without any
+        query = self.query(request)
+        if query is None:
+            print('No inputs, going to defaults')
+            #the whole network of the sample hydrofabric
+            outlet_id = network.outlets()[0]
+            network_defaults = defaults('network')
+            startdate, enddate = network_defaults['startdate'], network_defaults['enddate']
+            model_id = network_defaults['model_id']
+        else:
+            outlet_id = query.selection
+            startdate, enddate, model_id = query.startdate, query.enddate, query.model_id.value
+        try:
+            gauges = network.subnetwork_gauges(outlet_id)
+        except KeyError:
+            raise QueryError('outlet_id', f"'{outlet_id}' is not a gauge or node of the hydrofabric", status=404)
+
+        finaldf = reach_json(gauges, get_storage())
+        if finaldf.empty:
+            raise QueryError('outlet_id', f"No gauge with Streamstats data drains to '{outlet_id}'", status=404)
+
+        #update json with start/end date, modelid to support click, adjustment in the get_plot_for_layer_feature()
+        finaldf['startdate'] = startdate
+        finaldf['enddate'] = enddate
+        finaldf['model_id'] = model_id
+        waterbodies = network.gauge_waterbodies()
+        finaldf['waterbodies'] = [', '.join(waterbodies.get(g, [])) for g in finaldf['USGS_id']]
+        finaldf['upstream_gauges'] = network.upstream_gauge_counts(list(finaldf['USGS_id']))
+        for column, values in evaluate_stations(finaldf, model_id, startdate, enddate).items():
+            finaldf[column] = values
+
+        map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
+        with span('geojson_serialize'):
+            stations_geojson = json.loads(finaldf.to_json())
+        stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})
+
+        stations_layer = self.build_geojson_layer(
+            geojson=stations_geojson,
+            layer_name='USGS Stations',
+            layer_title='USGS Station',
+            layer_variable='stations',
+            visible=True,
+            selectable=True,
+            plottable=True,
+        )
+
+        # Create layer groups
+        layer_groups = [
+            self.build_layer_group(
+                id='nextgen-features',
+                display_name=f"NextGen Features draining to {outlet_id}",
+                layer_control='checkbox',  # 'checkbox' or 'radio'
+                layers=[
+                    stations_layer,
+                ],
+                visible= True
+            )
+        ]
+        return layer_groups
@@ -7,22 +7,6 @@ from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
-
-#Model evaluation metrics
-from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import max_error
-from sklearn.metrics import mean_absolute_percentage_error
-import hydroeval as he
-
-
 #Date picker
 from tethys_sdk.gizmos import DatePicker
 from django.shortcuts import render, reverse, redirect
@@ -38,15 +22,17 @@ from django.http import HttpResponse
 
 #utils
 from .utils import combine_jsons, reach_json
-
-#Set Global Variables
-
-#s3 = boto3.resource('s3')
-
-BUCKET_NAME = 'streamflow-app-data'
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-BUCKET = S3.Bucket(BUCKET_NAME) 
-
+from .storage import get_storage
+from .timing import ServerTimingMixin, span
+from .io_ledger import IOLedgerMixin
+from .prefetch import PrefetchMixin
+from .query import QueryMixin, QueryError, defaults, parse_feature, plot_skill
+from .series import read_series, usgs_key, model_key, flow_column, date_strings, flow_values, USGS_FLOW
+from .alignment import align
+from .pyramids import pyramid_plot, plot_max_points
+from .rolling import add_rolling, daily_sums
+from .fdc import add_fdc
+from .artifacts import default_plot
 
 #Controller base configurations
 BASEMAPS = [
@@ -71,7 +57,7 @@ BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
     url="reach_eval/",
     app_workspace=True,
 )   
-class Reach_Eval(MapLayout): 
+class Reach_Eval(PrefetchMixin, IOLedgerMixin, ServerTimingMixin, QueryMixin, MapLayout): 
     # Define base map options
     app = app
     back_url = BACK_URL
@@ -84,6 +70,7 @@ class Reach_Eval(MapLayout):
     show_properties_popup = True  
     plot_slide_sheet = True
     template_name = 'community_streamflow_evaluation_system/reach_eval.html' 
+    selector = 'reach_ids'
     
      
     def get_context(self, request, *args, **kwargs):
@@ -159,95 +146,60 @@ class Reach_Eval(MapLayout):
         """
         Add layers to the MapLayout and create associated layer group objects.
         """
-       
-     
-        try: 
-             #http request for user inputs
-            startdate = request.GET.get('start-date')
-            startdate = startdate.strip('][').split(', ')
-            enddate = request.GET.get('end-date')
-            enddate = enddate.strip('][').split(', ')
-            model_id = request.GET.get('model_id')
-            model_id = model_id.strip('][').split(', ')
-            reach_ids = request.GET.get('reach_ids')
-            reach_ids = reach_ids.strip('][').split(', ')
-
+        #validated user inputs, None without any
+        query = self.query(request)
+        if query is None:
+            #the default view, when materialized by artifacts.py
+            layer_groups = self.materialized_layers('reach', map_view)
+            if layer_groups is not None:
+                return layer_groups
+
+        if query is None:
+            print('No inputs, going to defaults')
+            finaldf = reach_json(defaults('reach')['reach_ids'], get_storage())
+        else:
             # USGS stations - from AWS s3
-            finaldf = reach_json(reach_ids,BUCKET, BUCKET_NAME, S3)
+            finaldf = reach_json(query.selection, get_storage())
+            if finaldf.empty:
+                raise QueryError('reach_ids', 'none of the sites is a Streamstats station', status=404)
 
             #update json with start/end date, modelid to support click, adjustment in the get_plot_for_layer_feature()
-            finaldf['startdate'] = datetime.strptime(startdate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
-            finaldf['enddate'] = datetime.strptime(enddate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
-            finaldf['model_id'] = model_id[0]
+            finaldf['startdate'] = query.startdate
+            finaldf['enddate'] = query.enddate
+            finaldf['model_id'] = query.model_id.value
             
             '''
             This might be the correct location to determine model performance, this will determine icon color as a part of the geojson file below
             We can also speed up the app by putting all model preds into one csv per state and all obs in one csv per state. - load one file vs multiple.
             '''
 
-            map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
+        map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
+        with span('geojson_serialize'):
             stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})         
-
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
-
-            # Create layer groups
-            layer_groups = [
-                self.build_layer_group(
-                    id='nextgen-features',
-                    display_name='NextGen Features',
-                    layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
-                    visible= True
-                )
-            ]
-
-        except: 
-            print('No inputs, going to defaults')
-            #put in some defaults
-            reach_ids = ['10126000', '10068500']
-            startdate = '01-01-2019' 
-            enddate = '01-02-2019'
-            modelid = 'NWM_v2.1'
-            finaldf = reach_json(reach_ids,BUCKET, BUCKET_NAME, S3)
-            map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
-            stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}}) 
-
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
-            
-            # Create layer groups
-            layer_groups = [
-                self.build_layer_group(
-                    id='nextgen-features',
-                    display_name='NextGen Features',
-                    layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
-                    visible= True
-                )
-            ]
+        stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})         
+
+        stations_layer = self.build_geojson_layer(
+            geojson=stations_geojson,
+            layer_name='USGS Stations',
+            layer_title='USGS Station',
+            layer_variable='stations',
+            visible=True,
+            selectable=True,
+            plottable=True,
+        ) 
+
+        # Create layer groups
+        layer_groups = [
+            self.build_layer_group(
+                id='nextgen-features',
+                display_name='NextGen Features',
+                layer_control='checkbox',  # 'checkbox' or 'radio'
+                layers=[
+                    stations_layer,
+                ],
+                visible= True
+            )
+        ]
 
         return layer_groups
 
@@ -302,12 +254,9 @@ class Reach_Eval(MapLayout):
       """     
 
         # Get the feature ids, add start/end date, and model as features in geojson above to have here.
-        id = feature_props.get('id') #we could connect the hydrofabric in here for NWM v3.0
-        NHD_id = feature_props.get('NHD_id') 
-        state = feature_props.get('state')
-        startdate= feature_props.get('startdate')
-        enddate = feature_props.get('enddate')
-        model_id = feature_props.get('model_id')
+        #validated, the properties come back from the client, QueryError answers 400
+        #we could connect the hydrofabric in here for NWM v3.0
+        id, NHD_id, state, startdate, enddate, model_id = parse_feature(feature_props)
   
         # USGS observed flow
         if layer_name == 'USGS Stations':
@@ -320,46 +269,38 @@ class Reach_Eval(MapLayout):
                 }
             }  
 
+            #the default plots, when materialized by artifacts.py
+            if not model_id:
+                plot = default_plot(id)
+                if plot is not None:
+                    return plot
+
+            #long windows are drawn from the weekly/monthly/water-year pyramids when they have been built
+            pyramid = pyramid_plot(id, NHD_id, state, model_id, startdate, enddate, layout)
+            if pyramid is not None:
+                return pyramid
+
             #USGS observed flow
-            USGS_directory = f"NWIS/NWIS_sites_{state}.h5/NWIS_{id}.csv"
-            obj = BUCKET.Object(USGS_directory)
-            body = obj.get()['Body']
-            USGS_df = pd.read_csv(body)
-            USGS_df.pop('Unnamed: 0')  
+            USGS_df = read_series(usgs_key(state, id), USGS_FLOW)
             
 
             #modeled flow, starting with NWM
-            try:
-                #try to use model/date inputs for plotting
-                model_directory = f"{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv"  
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-                modelcols = model_df.columns.to_list()[-2:]
-                model_df = model_df[modelcols]
+            if model_id:
+                #model/date inputs of the composed layer
+                model_df = read_series(model_key(model_id, state, NHD_id, id), flow_column(model_id))
 
                  #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True, drop = True)
-                model_df.set_index('Datetime', inplace = True, drop = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                #try to select user input dates
-                DF = DF.loc[startdate:enddate]
-                DF.reset_index(inplace=True)
+                with span('align'):
+                    #try to select user input dates
+                    DF = align(USGS_df, model_df, startdate, enddate)
                 
-                time_col = DF.Datetime.to_list()#limited to less than 500 obs/days 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()#limited to less than 500 obs/days 
-                Mod_streamflow_cfs = DF[f"{model_id[:3]}_flow"].to_list()#limited to less than 500 obs/days
+                time_col = date_strings(DF.dates)#limited to less than 500 obs/days 
+                USGS_streamflow_cfs = flow_values(DF.obs)#limited to less than 500 obs/days 
+                Mod_streamflow_cfs = flow_values(DF.mod)#limited to less than 500 obs/days
 
                 #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
+                with span('metrics'):
+                    skill = plot_skill(DF)
  
  
                 data = [
@@ -386,35 +327,33 @@ class Reach_Eval(MapLayout):
                 ]
                 
 
-                return f"{model_id} and Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs", data, layout
+                #rolling skill over the whole record, in panels under the hydrograph
+                with span('rolling'):
+                    add_rolling(data, layout, *daily_sums(align(USGS_df, model_df)), startdate, enddate,
+                                plot_max_points())
+                #flow duration curves of the window, beside the hydrograph
+                with span('fdc'):
+                    add_fdc(data, layout, DF, model_id)
+
+                return f"{model_id} and Observed Streamflow at USGS site: {id} <br> {skill}", data, layout
             
-            except:
+            else:
+                #the default layers carry no model or window
                 print("No user inputs, default configuration.")
-                model = 'NWM_v2.1'
-                model_directory = f"{model}/NHD_segments_{state}.h5/{model}_{NHD_id}.csv"  #put state in geojson file
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
+                plot_defaults = defaults('plot')
+                model = plot_defaults['model_id']
+                model_df = read_series(model_key(model, state, NHD_id, id), flow_column(model))  #put state in geojson file
 
                 #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True)
-                model_df.set_index('Datetime', inplace = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                DF.reset_index(inplace=True)
-                time_col = DF.Datetime.to_list()[:45] 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()[:45] 
-                Mod_streamflow_cfs = DF[f"{model[:3]}_flow"].to_list()[:45]
+                with span('align'):
+                    DF = align(USGS_df, model_df).head(plot_defaults['days'])
+                time_col = date_strings(DF.dates)
+                USGS_streamflow_cfs = flow_values(DF.obs)
+                Mod_streamflow_cfs = flow_values(DF.mod)
 
                 #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
+                with span('metrics'):
+                    skill = plot_skill(DF)
 
                 data = [
                     {
@@ -440,5 +379,5 @@ class Reach_Eval(MapLayout):
                 ]
 
 
-                return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs', data, layout
+                return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> {skill}', data, layout
             
\ No newline at end of file
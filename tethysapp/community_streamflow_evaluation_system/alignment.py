@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+
+class Aligned:
+    """
+    Observed and modeled flows on the days both have a value, within the requested window.
+
+    Args:
+        dates (pd.DatetimeIndex): the paired days, ascending.
+        obs (np.ndarray): observed flow per paired day.
+        mod (np.ndarray): modeled flow per paired day.
+        coverage (dict): day counts of the window, see align.
+    """
+
+    def __init__(self, dates, obs, mod, coverage):
+        self.dates = dates
+        self.obs = obs
+        self.mod = mod
+        self.coverage = coverage
+
+    def __len__(self):
+        return len(self.dates)
+
+    def head(self, n):
+        """
+        The first `n` paired days, the default configuration plots the first 45.
+        """
+        return Aligned(self.dates[:n], self.obs[:n], self.mod[:n], self.coverage)
+
+    def to_frame(self, obs_col='USGS_flow', mod_col='mod_flow'):
+        return pd.DataFrame({obs_col: self.obs, mod_col: self.mod}, index=self.dates)
+
+
+def day_numbers(index):
+    """
+    Days since 1970-01-01 of a datetime index, as int64.
+    """
+    return index.values.astype('datetime64[D]').astype(np.int64)
+
+
+def _day(date):
+    return pd.Timestamp(date).to_datetime64().astype('datetime64[D]').astype(np.int64)
+
+
+def _window(startdate, enddate):
+    """
+    Day numbers of a window's first and last day, None where not given. ValueError when it ends before it starts.
+    """
+    lo = _day(startdate) if startdate else None
+    hi = _day(enddate) if enddate else None
+    if lo is not None and hi is not None and hi < lo:
+        raise ValueError(f"The window ends on {enddate}, before it starts on {startdate}")
+    return lo, hi
+
+
+def _cut(series, lo, hi):
+    """
+    Day numbers and values of the finite flows of a series within [lo, hi].
+    """
+    days = day_numbers(series.index)
+    i, j = days.searchsorted(lo, side='left'), days.searchsorted(hi, side='right')
+    values = np.asarray(series.values[i:max(i, j)])
+    finite = np.isfinite(values)
+    return days[i:max(i, j)][finite], values[finite]
+
+
+def _coverage(lo, hi, n, observed, modeled, paired):
+    return {
+        'start': str(np.datetime64(int(lo), 'D')) if n else None,
+        'end': str(np.datetime64(int(hi), 'D')) if n else None,
+        'days': n,
+        'observed': observed,
+        'modeled': modeled,
+        'paired': paired,
+        'missing_observed': n - observed,
+        'missing_modeled': n - modeled,
+        'missing_paired': n - paired,
+    }
+
+
+def align(obs, mod, startdate=None, enddate=None):
+    """
+    Pair an observed and a modeled daily series on their common days.
+
+    Both series are expected sorted with unique dates, as series.read_series returns them. The window is cut
+    with a binary search on each series, and the common days are found by laying both onto day offsets of the
+    window, so the pairing is linear in the window length instead of a hash join on date strings. NaN and infinite
+    flows count as missing days.
+
+    Args:
+        obs (pd.Series): observed flow on a datetime index.
+        mod (pd.Series): modeled flow on a datetime index.
+        startdate (str): first day, 'YYYY-MM-DD', None for the first day of either series.
+        enddate (str): last day, 'YYYY-MM-DD', None for the last day of either series.
+
+    Returns:
+        Aligned: the paired days and flows, with coverage counts of the window: 'days', 'observed', 'modeled',
+        'paired', 'missing_observed', 'missing_modeled' and 'missing_paired'. ValueError when `enddate` is before
+        `startdate`.
+    """
+    lo, hi = _window(startdate, enddate)
+    obs_days = day_numbers(obs.index)
+    mod_days = day_numbers(mod.index)
+    if lo is None:
+        firsts = [d[0] for d in (obs_days, mod_days) if len(d)]
+        lo = min(firsts) if firsts else 0
+    if hi is None:
+        lasts = [d[-1] for d in (obs_days, mod_days) if len(d)]
+        hi = max(lasts) if lasts else -1
+    n = max(int(hi - lo + 1), 0)
+
+    obs_days, obs_values = _cut(obs, lo, hi)
+    mod_days, mod_values = _cut(mod, lo, hi)
+    obs_pos = np.full(n, -1, dtype=np.int64)
+    obs_pos[obs_days - lo] = np.arange(len(obs_days))
+    mod_pos = np.full(n, -1, dtype=np.int64)
+    mod_pos[mod_days - lo] = np.arange(len(mod_days))
+
+    offsets = np.flatnonzero((obs_pos >= 0) & (mod_pos >= 0))
+    dates = pd.DatetimeIndex((offsets + lo).astype('datetime64[D]'), name='Datetime')
+    coverage = _coverage(lo, hi, n, len(obs_days), len(mod_days), len(offsets))
+    return Aligned(dates, obs_values[obs_pos[offsets]], mod_values[mod_pos[offsets]], coverage)
+
+
+def align_many(pairs, startdate=None, enddate=None):
+    """
+    Align several sites over the same window.
+
+    With both ends of the window given, the sites are laid onto one sites x days grid and paired, counted and cut
+    with array operations over the whole grid; otherwise each site's window depends on its own series and the
+    sites are aligned one by one.
+
+    Args:
+        pairs (dict): site id -> (observed series, modeled series).
+        startdate (str): first day, 'YYYY-MM-DD'.
+        enddate (str): last day, 'YYYY-MM-DD'.
+
+    Returns:
+        dict: site id -> Aligned, as align returns it.
+    """
+    lo, hi = _window(startdate, enddate)
+    if lo is None or hi is None or not pairs:
+        return {site: align(obs, mod, startdate, enddate) for site, (obs, mod) in pairs.items()}
+
+    n = int(hi - lo + 1)
+    sites = list(pairs)
+    cuts = [(_cut(obs, lo, hi), _cut(mod, lo, hi)) for obs, mod in pairs.values()]
+    grids = []
+    for side in (0, 1):
+        days = [c[side][0] for c in cuts]
+        values = [c[side][1] for c in cuts]
+        grid = np.full((len(sites), n), np.nan, dtype=np.result_type(*[v.dtype for v in values]))
+        rows = np.repeat(np.arange(len(sites)), [len(d) for d in days])
+        grid[rows, np.concatenate(days) - lo] = np.concatenate(values)
+        grids.append(grid)
+    obs_grid, mod_grid = grids
+    observed = np.isfinite(obs_grid)
+    modeled = np.isfinite(mod_grid)
+    paired = observed & modeled
+    counts = np.stack([observed.sum(axis=1), modeled.sum(axis=1), paired.sum(axis=1)], axis=1)
+
+    aligned = {}
+    for i, site in enumerate(sites):
+        offsets = np.flatnonzero(paired[i])
+        dates = pd.DatetimeIndex((offsets + lo).astype('datetime64[D]'), name='Datetime')
+        aligned[site] = Aligned(dates, obs_grid[i, offsets], mod_grid[i, offsets],
+                                _coverage(lo, hi, n, *(int(c) for c in counts[i])))
+    return aligned
+
+
+def coverage_frame(aligned):
+    """
+    Coverage counts of align_many's result, one row per site.
+    """
+    return pd.DataFrame.from_dict({site: a.coverage for site, a in aligned.items()}, orient='index')
@@ -1,4 +1,5 @@
 from tethys_sdk.base import TethysAppBase
+from tethys_sdk.app_settings import CustomSetting
 
 class CSES(TethysAppBase):
     """
@@ -17,4 +18,109 @@ class CSES(TethysAppBase):
     tags = '"Hydrology", "WMO", "UA"'
     enable_feedback = False
     feedback_emails = []
-    controller_modules = ["controllers", "State_Controller", "Reach_Controller", "HUC_Controller"]
\ No newline at end of file
+    controller_modules = ["controllers", "State_Controller", "Reach_Controller", "HUC_Controller", "Network_Controller",
+                          "API_Controller"]
+
+    def custom_settings(self):
+        """
+        Custom settings of the app.
+        """
+        return (
+            CustomSetting(
+                name='storage_backend',
+                type=CustomSetting.TYPE_STRING,
+                description='Where the streamflow-app-data layout is read from: s3, local (a mirror directory) or memory.',
+                required=False,
+                default='s3',
+            ),
+            CustomSetting(
+                name='storage_root',
+                type=CustomSetting.TYPE_STRING,
+                description='Directory of the local bucket mirror, used by the local storage backend.',
+                required=False,
+            ),
+            CustomSetting(
+                name='io_budget_bytes',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Bytes a single request may read from storage before it is logged or rejected.',
+                required=False,
+            ),
+            CustomSetting(
+                name='io_budget_gets',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Storage reads a single request may make before it is logged or rejected.',
+                required=False,
+            ),
+            CustomSetting(
+                name='io_budget_action',
+                type=CustomSetting.TYPE_STRING,
+                description='What to do with requests over the I/O budget: log or reject.',
+                required=False,
+                default='log',
+            ),
+            CustomSetting(
+                name='io_debug',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Serve the I/O ledger of recent requests at debug/io-ledger/.',
+                required=False,
+                default=False,
+            ),
+            CustomSetting(
+                name='plot_max_points',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Points per plot trace; longer windows are plotted weekly, monthly or per water year.',
+                required=False,
+                default=500,
+            ),
+            CustomSetting(
+                name='rolling_windows',
+                type=CustomSetting.TYPE_STRING,
+                description='Comma separated days of the rolling RMSE, NSE, KGE and bias plotted under the '
+                            'hydrograph, e.g. 30, 90, 365; empty for none.',
+                required=False,
+                default='30, 90, 365',
+            ),
+            CustomSetting(
+                name='hydrofabric_models',
+                type=CustomSetting.TYPE_STRING,
+                description='Comma separated models whose series are keyed by hydrofabric waterbody id '
+                            '(resolved through crosswalk.json), e.g. NextGen, NWM_v3.0.',
+                required=False,
+                default='NextGen',
+            ),
+            CustomSetting(
+                name='prewarm',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Warm the default views in a background thread from the first request of a worker; ready/ '
+                            'answers 503 until it is done.',
+                required=False,
+                default=True,
+            ),
+            CustomSetting(
+                name='prefetch',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Read the series of the stations of a composed map in the background, before they are '
+                            'clicked.',
+                required=False,
+                default=False,
+            ),
+            CustomSetting(
+                name='prefetch_max_stations',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Stations of a composed map queued for prefetch, most plotted and most central first.',
+                required=False,
+                default=20,
+            ),
+            CustomSetting(
+                name='prewarm_states',
+                type=CustomSetting.TYPE_STRING,
+                description='Comma separated states to warm on top of the defaults, e.g. UT, CO.',
+                required=False,
+            ),
+            CustomSetting(
+                name='prewarm_hucs',
+                type=CustomSetting.TYPE_STRING,
+                description='Comma separated HUCs to warm on top of the defaults, e.g. 1602, 1603.',
+                required=False,
+            ),
+        )
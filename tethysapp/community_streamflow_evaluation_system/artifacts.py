@@ -0,0 +1,292 @@
+"""
+Default views materialized as static, versioned artifacts.
+
+The default layers are fixed: the Reach gauges 10126000 and 10068500, the 19 Jordan River gauges of the HUC view,
+the Alabama stations of the State view, and the 45 day NWM v2.1 plot of each of their stations. They used to be
+recomputed from storage on every visit without parameters. The build composes them once, cold, under an I/O
+ledger, and writes the layer GeoJSONs and the plot payloads into a directory named after a hash of their content,
+with a manifest of the version and of the fingerprints (ETag and size) of every source object read::
+
+    <dir>/manifest.json
+    <dir>/<version>/reach_layer.json, huc_layer.json, state_layer.json, plots.json
+
+    python -m tethysapp.community_streamflow_evaluation_system.artifacts --storage-root <bucket mirror>
+
+A build whose sources all have the fingerprints of the manifest does nothing, so it can run on every deploy or
+from cron. The manifest is replaced last, in one rename, and the views and the defaults/ endpoint, which serves the
+files with a one year immutable cache lifetime, switch to the new version at their next check.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from django.http import QueryDict
+
+
+#artifacts of the app workspace
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'default_views')
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+PLOTS_FILE = 'plots.json'
+#the versioned files never change, clients may keep them
+CACHE_SECONDS = 365 * 24 * 3600
+#seconds between checks for a rebuilt manifest
+RECHECK_SECONDS = 10
+#versions kept on disk, the current one and the one before for requests in flight
+KEEP_VERSIONS = 2
+
+_artifact_dir = None
+_manifest = None
+_files = {}
+_checked = 0.0
+_building = threading.local()
+_lock = threading.Lock()
+
+
+def configure_artifact_dir(path):
+    """
+    Use the artifacts at `path` for this process, e.g. from the benchmark suite, instead of the app workspace. None
+    turns them off.
+    """
+    global _artifact_dir, _manifest, _checked
+    with _lock:
+        _artifact_dir = path if path is not None else ''
+        _manifest = None
+        _files.clear()
+        _checked = 0.0
+
+
+def artifact_dir():
+    return DEFAULT_ARTIFACT_DIR if _artifact_dir is None else _artifact_dir
+
+
+def layer_file(view):
+    return f"{view}_layer.json"
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == FORMAT_VERSION else None
+
+
+def manifest():
+    """
+    The manifest of the current artifacts, None when none were built.
+    """
+    global _manifest, _checked
+    if getattr(_building, 'active', False):
+        return None
+    now = time.monotonic()
+    if now - _checked < RECHECK_SECONDS:
+        return _manifest
+    with _lock:
+        _checked = now
+        path = artifact_dir()
+        current = read_manifest(path) if path else None
+        if current is None or _manifest is None or current['version'] != _manifest['version']:
+            _files.clear()
+        _manifest = current
+        return _manifest
+
+
+def artifact_path(name, version=None):
+    current = manifest()
+    if current is None or name not in current['files']:
+        return None
+    return os.path.join(artifact_dir(), version or current['version'], name)
+
+
+def artifact(name):
+    """
+    A parsed artifact of the current version, None when there is none.
+    """
+    current = manifest()
+    if current is None or name not in current['files']:
+        return None
+    key = (current['version'], name)
+    if key not in _files:
+        with open(artifact_path(name)) as f:
+            _files[key] = json.load(f)
+    return _files[key]
+
+
+def default_layer(view):
+    """
+    GeoJSON and map extent of a default view ('reach', 'huc' or 'state').
+
+    Returns:
+        dict: 'geojson' and 'extent', None when not built.
+    """
+    return artifact(layer_file(view))
+
+
+def default_plot(site_id):
+    """
+    Title, data and layout of the default plot of a station of the default views, None when not built.
+    """
+    plots = artifact(PLOTS_FILE)
+    return tuple(plots[site_id]) if plots is not None and site_id in plots else None
+
+
+@contextmanager
+def building():
+    #the views compose from storage, not from the artifacts being replaced
+    _building.active = True
+    try:
+        yield
+    finally:
+        _building.active = False
+
+
+def _views():
+    from .Reach_Controller import Reach_Eval
+    from .HUC_Controller import HUC_Eval
+    from .State_Controller import State_Eval
+    return {'reach': Reach_Eval, 'huc': HUC_Eval, 'state': State_Eval}
+
+
+def render_defaults():
+    """
+    Compose the default views and plot each of their stations, from storage with cold caches.
+
+    Returns:
+        dict, set: file name -> payload, and the storage keys read.
+    """
+    from .cache import clear_caches
+    from .io_ledger import IOLedger, tracking
+    from .series_store import configure_series_store, series_store_dir
+
+    files, plots = {}, {}
+    ledger = IOLedger('artifacts')
+    #every source has to be read from storage to be fingerprinted
+    store = series_store_dir()
+    configure_series_store(None)
+    clear_caches()
+    try:
+        with building(), tracking(ledger):
+            for name, view_class in _views().items():
+                request = SimpleNamespace(GET=QueryDict())
+                map_view = {'view': {}}
+                view = view_class()
+                layer = view.compose_layers(request, map_view, None)[0]['layers'][0]
+                files[layer_file(name)] = {'geojson': layer['options'], 'extent': map_view['view']['extent']}
+                for feature in layer['options']['features']:
+                    props = feature['properties']
+                    if props['id'] not in plots:
+                        plots[props['id']] = list(view.get_plot_for_layer_feature(
+                            request, 'USGS Stations', props['id'], {}, props, None))
+    finally:
+        configure_series_store(store)
+    files[PLOTS_FILE] = plots
+    return files, {key for key, _, _, _ in ledger.reads}
+
+
+def changed_sources(sources, storage):
+    """
+    Keys of `sources` (key -> fingerprint) whose fingerprint is no longer the one recorded, or that no longer exist.
+    Other errors, e.g. of credentials or the network, are raised rather than taken for a change.
+    """
+    from .storage import is_missing
+
+    changed = []
+    for key, fingerprint in sources.items():
+        try:
+            if storage.fingerprint(key) != fingerprint:
+                changed.append(key)
+        except Exception as e:
+            if not is_missing(e):
+                raise
+            changed.append(key)
+    return changed
+
+
+def build_defaults(output=None, storage=None, force=False):
+    """
+    Build the default view artifacts at `output`, unless its sources are unchanged since the last build.
+
+    Returns:
+        dict, bool: the manifest, and whether a new version was written.
+    """
+    from .storage import get_storage
+
+    output = output or artifact_dir()
+    storage = storage or get_storage()
+    current = read_manifest(output)
+    if current is not None and not force and not changed_sources(current['sources'], storage):
+        return current, False
+
+    files, keys = render_defaults()
+    bodies = {name: json.dumps(payload, separators=(',', ':'), allow_nan=False).encode()
+              for name, payload in files.items()}
+    digest = hashlib.sha256()
+    for name in sorted(bodies):
+        digest.update(name.encode() + b'\0' + bodies[name])
+    version = digest.hexdigest()[:16]
+
+    os.makedirs(output, exist_ok=True)
+    folder = os.path.join(output, version)
+    if not os.path.isdir(folder):
+        tmp = f"{folder}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, body in bodies.items():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(body)
+        os.replace(tmp, folder)
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'version': version,
+        'built': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'files': sorted(bodies),
+        'sources': {key: storage.fingerprint(key) for key in sorted(keys)},
+    }
+    tmp = os.path.join(output, f"{MANIFEST_FILE}.tmp-{os.getpid()}")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(output, MANIFEST_FILE))
+
+    #older versions, past the one before, are no longer referenced
+    versions = sorted((d for d in os.listdir(output) if os.path.isdir(os.path.join(output, d)) and '.tmp-' not in d),
+                      key=lambda d: os.stat(os.path.join(output, d)).st_mtime, reverse=True)
+    for old in [d for d in versions if d != version][KEEP_VERSIONS - 1:]:
+        shutil.rmtree(os.path.join(output, old), ignore_errors=True)
+    return manifest, True
+
+
+def main(argv=None):
+    import django
+    django.setup()
+    from .storage import configure_storage, create_storage
+    from .pyramids import configure_plot_max_points
+    from .series import configure_hydrofabric_models
+
+    parser = argparse.ArgumentParser(description='Build the default view artifacts when their sources changed.')
+    parser.add_argument('--output', default=DEFAULT_ARTIFACT_DIR, help='artifact directory')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--force', action='store_true', help='rebuild even when no source changed')
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    configure_storage(storage)
+    configure_hydrofabric_models(args.hydrofabric_models)
+    configure_plot_max_points(500)
+    manifest, built = build_defaults(args.output, storage, args.force)
+    print(f"{'built' if built else 'unchanged'}: version {manifest['version']} of {len(manifest['sources'])} sources "
+          f"in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
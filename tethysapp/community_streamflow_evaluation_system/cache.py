@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache of parsed objects, shared by the views of a worker.
+
+    A key is loaded once even when several threads ask for it at the same time (e.g. the warmup thread and a
+    request): the first caller loads it, the others wait for its result.
+
+    Args:
+        maxsize (int): entries kept.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, loader):
+        """
+        The cached value of `key`, loaded with `loader()` on a miss. Loader errors are raised and not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+                self.misses += 1
+        if not owner:
+            event.wait()
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key]
+            #the owner failed, load it here
+            return self.get(key, loader)
+        try:
+            value = loader()
+            with self._lock:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+#parsed tables and geojson, and flow series, per storage backend and key
+TABLES = LRUCache(maxsize=64)
+SERIES = LRUCache(maxsize=1024)
+
+
+def clear_caches():
+    """
+    Empty every cache, e.g. between benchmark runs or after the bucket changed.
+    """
+    TABLES.clear()
+    SERIES.clear()
@@ -1,4 +1,6 @@
 import json
+import os
+import re
 from pathlib import Path
 import pandas as pd
 import geopandas as gpd
@@ -7,15 +9,6 @@ from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
-
-
 #Date picker
 from tethys_sdk.gizmos import DatePicker
 from django.shortcuts import render, reverse, redirect
@@ -27,20 +20,19 @@ from datetime import datetime
 from datetime import date, timedelta
 
 #Connect web pages
-from django.http import HttpResponse 
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified, FileResponse
 
 #utils
 from .utils import combine_jsons, reach_json
+from .timing import render_metrics
+from .io_ledger import budget_settings, recent_ledgers
+from .pyramids import read_pyramid, pyramid_key, skill_summary, SUMMARY_LEVELS
+from .warmup import start_warmup, warm_on_first_request, readiness
+from .overlay import batch_plot, MAX_STATIONS
+from .query import QueryError, parse_date, parse_model, parse_sites
+from .artifacts import manifest, artifact_path, CACHE_SECONDS
 
 
-#Set Global Variables
-
-s3 = boto3.resource('s3')
-
-BUCKET_NAME = 'streamflow-app-data'
-BUCKET = s3.Bucket(BUCKET_NAME) 
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-
 #Controller base configurations
 BASEMAPS = [
         {'ESRI': {'layer':'NatGeo_World_Map'}},
@@ -54,6 +46,9 @@ MAX_ZOOM = 16
 MIN_ZOOM = 1
 BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
 
+#warm the default views in the background once the worker serves requests, not when a command imports the urls
+warm_on_first_request()
+
 @controller
 def home(request):
 
@@ -75,4 +70,113 @@ def home(request):
         }
 
 
-        return render(request, 'community_streamflow_evaluation_system/home.html', context)
\ No newline at end of file
+        return render(request, 'community_streamflow_evaluation_system/home.html', context)
+
+
+@controller(name='metrics', url='metrics/', login_required=False)
+def metrics(request):
+    """
+    Stage and request latency histograms of this worker process in the Prometheus text format.
+    """
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@controller(name='io_ledger', url='debug/io-ledger/')
+def io_ledger(request):
+    """
+    Storage reads of the last requests of this worker process, with duplicate keys and budget overruns flagged.
+    Only served when the io_debug app setting is on.
+    """
+    if not budget_settings()[3]:
+        return HttpResponseNotFound()
+    ledgers = recent_ledgers()
+    if request.GET.get('duplicates'):
+        ledgers = [ledger for ledger in ledgers if ledger['duplicates']]
+    return JsonResponse({'ledgers': ledgers})
+
+
+@controller(name='skill_summary', url='skill-summary/')
+def skill_summary_view(request):
+    """
+    Monthly or water-year skill of a model at a station, from its pyramid.
+    GET parameters: state, site_id, NHD_id, model_id, level (month or water_year), start-date and end-date
+    (YYYY-MM-DD, optional).
+    """
+    params = request.GET
+    level = params.get('level', 'water_year')
+    missing = [k for k in ('state', 'site_id', 'NHD_id', 'model_id') if not params.get(k)]
+    if missing or level not in SUMMARY_LEVELS:
+        return JsonResponse({'error': f"missing parameters {missing}" if missing else f"unknown level '{level}'"},
+                            status=400)
+    pyramid = read_pyramid(pyramid_key(params['model_id'], params['state'], params['NHD_id'], params['site_id']))
+    if pyramid is None:
+        return JsonResponse({'error': 'no pyramid has been built for this station and model'}, status=404)
+    periods = skill_summary(pyramid, level, params.get('start-date'), params.get('end-date'))
+    return JsonResponse({'level': level, 'periods': periods})
+
+
+@controller(name='batch_plot', url='batch-plot/')
+def batch_plot_view(request):
+    """
+    Hydrographs of several stations overlaid, with a table of their skill, in one response.
+    Parameters (GET or POST): site_ids (comma separated USGS ids), model_id, start-date and end-date (YYYY-MM-DD).
+    """
+    params = request.POST if request.method == 'POST' else request.GET
+    missing = [k for k in ('site_ids', 'model_id', 'start-date', 'end-date') if not params.get(k)]
+    if missing:
+        return JsonResponse({'error': f"missing parameters {missing}", 'field': missing[0]}, status=400)
+    try:
+        site_ids = parse_sites(params['site_ids'], 'site_ids')
+        if len(site_ids) > MAX_STATIONS:
+            raise QueryError('site_ids', f"at most {MAX_STATIONS} site_ids per request")
+        model_id = parse_model(params['model_id']).value
+        startdate = parse_date('start-date', params['start-date'])
+        enddate = parse_date('end-date', params['end-date'])
+        if enddate < startdate:
+            raise QueryError('end-date', 'ends before start-date')
+    except QueryError as e:
+        return e.response()
+    return JsonResponse(batch_plot(site_ids, model_id, startdate, enddate))
+
+
+@controller(name='ready', url='ready/', login_required=False)
+def ready(request):
+    """
+    Readiness of this worker for the load balancer: 200 once the default views are warm, 503 while warming or
+    after a failed warmup.
+    """
+    start_warmup()
+    status = readiness()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
+
+
+@controller(name='default_views', url='defaults/', login_required=False)
+def default_views(request):
+    """
+    Manifest of the materialized default views: their version and files, to be fetched from defaults/{version}/.
+    """
+    current = manifest()
+    if current is None:
+        return JsonResponse({'error': 'the default views have not been built'}, status=404)
+    response = JsonResponse({'version': current['version'], 'built': current['built'], 'files': current['files']})
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@controller(name='default_view_file', url='defaults/{version}/{name}/', login_required=False)
+def default_view_file(request, version, name):
+    """
+    A file of a version of the default views. Versions are named after their content and never change, so they are
+    served with an immutable, one year cache lifetime.
+    """
+    path = artifact_path(name, version) if re.fullmatch('[0-9a-f]{16}', version) else None
+    if path is None or not os.path.isfile(path):
+        return HttpResponseNotFound()
+    etag = f'"{version}-{name}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = f"public, max-age={CACHE_SECONDS}, immutable"
+    return response
@@ -0,0 +1,118 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+
+#NextGen hydrofabric shipped with the app
+DEFAULT_CONFIG_DIR = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'sample_nextgen_data',
+                                  'config')
+
+
+class Crosswalk:
+    """
+    USGS gage <-> hydrofabric waterbody index, both directions as sorted key arrays with offsets into their values.
+
+    A gage can sit on several waterbodies (02453000 is crosswalked to wb-114271 and wb-114272) and a waterbody can
+    hold several gages. Lookups of many ids at once are one binary search over the keys.
+
+    Args:
+        mapping (dict): waterbody id -> {'Gage_no': [USGS ids]}, as in crosswalk.json.
+    """
+
+    def __init__(self, mapping):
+        pairs = [(wb, str(gage)) for wb, v in mapping.items() for gage in v.get('Gage_no', [])]
+        wbs = np.array([wb for wb, _ in pairs], dtype=object)
+        gages = np.array([gage for _, gage in pairs], dtype=object)
+        self.gage_keys, self.gage_indptr, self.gage_values = _index(gages, wbs)
+        self.wb_keys, self.wb_indptr, self.wb_values = _index(wbs, gages)
+
+    def __len__(self):
+        return len(self.gage_values)
+
+    def pairs(self):
+        """
+        (waterbody ids, gage ids) arrays of every crosswalk entry.
+        """
+        counts = np.diff(self.gage_indptr)
+        return self.gage_values, np.repeat(self.gage_keys, counts)
+
+    def waterbodies(self, gages):
+        """
+        Batch lookup of the waterbodies of many gages.
+
+        Returns:
+            np.ndarray, np.ndarray: position in `gages` of every match and the matched waterbody id.
+        """
+        return _lookup(self.gage_keys, self.gage_indptr, self.gage_values, gages)
+
+    def gages(self, waterbodies):
+        """
+        Batch lookup of the gages of many waterbodies, see waterbodies.
+        """
+        return _lookup(self.wb_keys, self.wb_indptr, self.wb_values, waterbodies)
+
+    def waterbody_lists(self, gages):
+        """
+        gage -> list of waterbody ids, for the gages in the crosswalk.
+        """
+        positions, wbs = self.waterbodies(gages)
+        lists = {}
+        for i, wb in zip(positions, wbs):
+            lists.setdefault(gages[i], []).append(wb)
+        return lists
+
+    def outlet_waterbodies(self, gages, network=None):
+        """
+        One waterbody per gage, the most downstream of its waterbodies in `network` (the first listed without one).
+
+        Returns:
+            list: waterbody id per gage, None for gages not in the crosswalk.
+        """
+        positions, wbs = self.waterbodies(gages)
+        if network is not None:
+            nodes, found = network.lookup(wbs)
+            rank = np.where(found, network.rank[nodes], -1)
+        else:
+            rank = -np.arange(len(wbs))
+        #last row per position after sorting by (position, rank) is the most downstream
+        order = np.lexsort((rank, positions))
+        positions, wbs = positions[order], wbs[order]
+        last = np.r_[positions[1:] != positions[:-1], True] if len(positions) else np.empty(0, dtype=bool)
+        result = [None] * len(gages)
+        for i, wb in zip(positions[last], wbs[last]):
+            result[i] = wb
+        return result
+
+
+def _index(keys, values):
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    unique, counts = np.unique(keys, return_counts=True) if len(keys) else (keys, np.empty(0, dtype=np.int64))
+    indptr = np.zeros(len(unique) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return unique, indptr, values
+
+
+def _lookup(keys, indptr, values, queries):
+    queries = np.asarray(queries, dtype=object)
+    if not len(keys) or not len(queries):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+    i = np.searchsorted(keys, queries)
+    found = i < len(keys)
+    found[found] = keys[i[found]] == queries[found]
+    hits = np.flatnonzero(found)
+    starts = indptr[i[hits]]
+    counts = indptr[i[hits] + 1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(hits, counts), values[np.repeat(starts, counts) + offsets]
+
+
+@lru_cache(maxsize=4)
+def load_crosswalk(path=os.path.join(DEFAULT_CONFIG_DIR, 'crosswalk.json')):
+    """
+    The crosswalk of a crosswalk.json file, built once per process.
+    """
+    with open(path) as f:
+        return Crosswalk(json.load(f))
@@ -0,0 +1,324 @@
+"""
+Offline batch evaluation of many stations, models and windows, installed as the ``cses-evaluate`` command.
+
+Stations (states, HUCs or site ids) are split per state into chunks, and every chunk is evaluated by a process of a
+pool sized to the machine: the observed series of a station is read once, each model series once, and every
+(model, window) of the chunk is scored with metrics.batch_skill on the pairs from alignment.align, the readers and
+metrics of the map views and the JSON API, so the scores are the same numbers. Results are written as a
+partitioned Parquet dataset, the model, window and state kept in the paths only::
+
+    <output>/model_id=NWM_v2.1/window=20100101_20141231/state=UT/part-3f2a9c0b1d4e.parquet
+
+A part is named after a hash of its chunk's site ids, so a part on disk always holds the stations it is named for.
+A chunk only computes the partitions it is missing, so an interrupted run picks up where it stopped when started
+again with the same stations, and a run with another selection writes its own parts instead of taking the parts
+of other stations for its own::
+
+    cses-evaluate --states UT AL --models NWM_v2.1 NWM_v3.0 --windows 2010-01-01:2014-12-31 \
+        --output scores --storage-root <bucket mirror>
+
+For national runs, ``--scheduler dask`` splits the chunks per model as well and runs them on a Dask cluster,
+the one at ``--scheduler-address`` or a LocalCluster of ``--workers`` processes. The workers only read and score,
+the client writes the partitions they return, so the workers need no access to the output directory. dask is an
+optional dependency, ``pip install dask[distributed]``. Either way read_scores reduces the dataset to one table of
+per-site metrics.
+"""
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .storage import create_storage, is_missing
+from .series import read_series, usgs_key, model_key, flow_column, configure_hydrofabric_models, USGS_FLOW
+from .alignment import align_many
+from .metrics import batch_skill, METRICS
+from .utils import streamstats, huc_sites
+
+
+MODELS = ['NWM_v2.1', 'NWM_v3.0', 'MLP', 'XGBoost', 'CNN', 'LSTM']
+CHUNK_SIZE = 200
+
+#per worker process, set by _init_worker
+_storage = None
+
+
+def parse_window(text):
+    """
+    'YYYY-MM-DD:YYYY-MM-DD' -> ('YYYY-MM-DD', 'YYYY-MM-DD').
+    """
+    try:
+        start, end = text.split(':')
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"window '{text}' is not YYYY-MM-DD:YYYY-MM-DD")
+    if end < start:
+        raise argparse.ArgumentTypeError(f"window '{text}' ends before it starts")
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def part_name(stations):
+    """
+    Name of the part of a chunk of stations, a hash of their site ids.
+    """
+    return hashlib.sha1(','.join(site for site, _, _ in stations).encode()).hexdigest()[:12]
+
+
+def partition_path(output, model_id, window, state, part):
+    start, end = (d.replace('-', '') for d in window)
+    return os.path.join(output, f"model_id={model_id}", f"window={start}_{end}", f"state={state}",
+                        f"part-{part}.parquet")
+
+
+def select_stations(storage, states=None, hucs=None, sites=None):
+    """
+    (site id, state, NHD id) of the selected stations, ordered by state and site id.
+    """
+    table = streamstats(storage)
+    selected = []
+    if states:
+        selected.append(table[table['state_id'].isin(states)])
+    if hucs:
+        #one level per call, as in the HUC view
+        for digits in sorted({len(h) for h in hucs}):
+            selected.append(huc_sites([h for h in hucs if len(h) == digits], storage))
+    if sites:
+        selected.append(table[table['NWIS_site_id'].isin(sites)])
+    if not selected:
+        selected = [table]
+    table = pd.concat(selected).drop_duplicates('NWIS_site_id')
+    table = table.sort_values(['state_id', 'NWIS_site_id'], kind='stable')
+    return list(zip(table['NWIS_site_id'], table['state_id'], table['NHD_reachcode']))
+
+
+def plan(stations, models, windows, output, chunk_size=CHUNK_SIZE):
+    """
+    Units of work: the stations of a state chunk and the (model, window) partitions it has not written yet.
+
+    Returns:
+        list<dict>: state, chunk, stations and todo [(model, window, path)], chunks already complete left out.
+    """
+    by_state = {}
+    for station in stations:
+        by_state.setdefault(station[1], []).append(station)
+    units = []
+    for state, members in by_state.items():
+        for chunk, i in enumerate(range(0, len(members), chunk_size)):
+            part = part_name(members[i:i + chunk_size])
+            todo = [(m, w, partition_path(output, m, w, state, part)) for m in models for w in windows]
+            todo = [t for t in todo if not os.path.exists(t[2])]
+            if todo:
+                units.append({'state': state, 'chunk': chunk, 'stations': members[i:i + chunk_size], 'todo': todo})
+    return units
+
+
+def _init_worker(backend, root, hydrofabric_models):
+    global _storage
+    _storage = create_storage(backend, root)
+    configure_hydrofabric_models(hydrofabric_models)
+
+
+def score_unit(unit, storage=None):
+    """
+    Score the stations of a unit for each of its missing partitions.
+
+    Returns:
+        list: (partition path, pd.DataFrame of per-site metrics) pairs.
+    """
+    storage = storage or _storage
+    #stations without a series are scored with n = 0, any other error fails the unit
+    observed = {}
+    for site, state, _ in unit['stations']:
+        try:
+            observed[site] = read_series(usgs_key(state, site), USGS_FLOW, storage)
+        except Exception as e:
+            if not is_missing(e):
+                raise
+
+    partitions = []
+    for model_id in dict.fromkeys(m for m, _, _ in unit['todo']):
+        modeled = {}
+        for site, state, NHD_id in unit['stations']:
+            if site not in observed:
+                continue
+            try:
+                modeled[site] = read_series(model_key(model_id, state, NHD_id, site), flow_column(model_id), storage)
+            except Exception as e:
+                if not is_missing(e):
+                    raise
+        sites = list(modeled)
+        for _, window, path in [t for t in unit['todo'] if t[0] == model_id]:
+            columns = batch_skill(list(align_many({s: (observed[s], modeled[s]) for s in sites}, *window).values()))
+            scored = pd.DataFrame({'site_id': sites, **{m: columns[m] for m in METRICS}})
+            #stations without data for the model stay in the partition with n = 0
+            frame = pd.DataFrame({'site_id': [s for s, _, _ in unit['stations']]}).merge(scored, how='left')
+            frame['n'] = frame['n'].fillna(0).astype(np.int64)
+            frame.insert(1, 'start', window[0])
+            frame.insert(2, 'end', window[1])
+            partitions.append((path, frame))
+    return partitions
+
+
+def write_partition(path, frame):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    frame.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def evaluate_unit(unit, storage=None):
+    """
+    Score the stations of a unit for each of its missing partitions and write them.
+
+    Returns:
+        int: partitions written.
+    """
+    partitions = score_unit(unit, storage)
+    for path, frame in partitions:
+        write_partition(path, frame)
+    return len(partitions)
+
+
+def split_models(units):
+    """
+    One unit per (state chunk, model), the partitioning of the Dask runs.
+    """
+    split = []
+    for unit in units:
+        for model_id in dict.fromkeys(m for m, _, _ in unit['todo']):
+            split.append({**unit, 'model_id': model_id, 'todo': [t for t in unit['todo'] if t[0] == model_id]})
+    return split
+
+
+def _dask_unit(unit, backend, root, hydrofabric_models):
+    #workers may join the cluster at any time, each sets itself up on its first unit
+    if _storage is None:
+        _init_worker(backend, root, hydrofabric_models)
+    return score_unit(unit)
+
+
+def _progress(done, total, unit, written, t0):
+    name = f"{unit['state']} chunk {unit['chunk']}" + (f" {unit['model_id']}" if 'model_id' in unit else '')
+    print(f"[{done}/{total}] {name}, {written} partitions written, {time.perf_counter() - t0:.0f} s")
+
+
+def run(units, backend, root, hydrofabric_models, workers=None):
+    """
+    Evaluate the units on a process pool, printing progress.
+
+    Returns:
+        int: partitions written.
+    """
+    workers = workers or os.cpu_count() or 1
+    written = 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(backend, root, hydrofabric_models)) as pool:
+        futures = {pool.submit(evaluate_unit, unit): unit for unit in units}
+        for done, future in enumerate(as_completed(futures), 1):
+            unit = futures[future]
+            try:
+                written += future.result()
+            except Exception as e:
+                print(f"{unit['state']} chunk {unit['chunk']} failed: {type(e).__name__}: {e}")
+            _progress(done, len(units), unit, written, t0)
+    return written
+
+
+def run_dask(units, backend, root, hydrofabric_models, address=None, workers=None):
+    """
+    Evaluate the units per (state chunk, model) on a Dask cluster, writing the partitions the workers return.
+
+    Args:
+        address (str): scheduler of a running cluster, a LocalCluster of `workers` processes when None.
+
+    Returns:
+        int: partitions written.
+    """
+    try:
+        from dask.distributed import Client, LocalCluster, as_completed as dask_completed
+    except ImportError:
+        raise SystemExit('the dask scheduler needs dask.distributed, pip install dask[distributed]')
+
+    units = split_models(units)
+    cluster = None
+    if address is None:
+        cluster = LocalCluster(n_workers=workers or os.cpu_count() or 1, threads_per_worker=1, processes=True,
+                               dashboard_address=None)
+    written = 0
+    t0 = time.perf_counter()
+    try:
+        with Client(address or cluster) as client:
+            futures = client.map(_dask_unit, units, backend=backend, root=root,
+                                 hydrofabric_models=hydrofabric_models, pure=False)
+            unit_of = {future.key: unit for future, unit in zip(futures, units)}
+            for done, future in enumerate(dask_completed(futures), 1):
+                unit = unit_of[future.key]
+                try:
+                    for path, frame in future.result():
+                        write_partition(path, frame)
+                        written += 1
+                except Exception as e:
+                    print(f"{unit['state']} chunk {unit['chunk']} {unit['model_id']} failed: "
+                          f"{type(e).__name__}: {e}")
+                future.release()
+                _progress(done, len(units), unit, written, t0)
+    finally:
+        if cluster is not None:
+            cluster.close()
+    return written
+
+
+def read_scores(output):
+    """
+    The per-site metrics of a dataset written by cses-evaluate, one row per (site, model, window). A station of the
+    parts of several selections is kept once.
+    """
+    frame = pd.read_parquet(output)
+    for column in ('model_id', 'window', 'state'):
+        frame[column] = frame[column].astype(str)
+    frame = frame.drop_duplicates(['model_id', 'window', 'site_id'])
+    return frame.sort_values(['model_id', 'window', 'state', 'site_id'], kind='stable').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate models at many stations and windows into partitioned '
+                                                 'Parquet.')
+    parser.add_argument('--states', nargs='+', help='state ids, e.g. UT AL')
+    parser.add_argument('--hucs', nargs='+', help='HUC codes, e.g. 1602 1603')
+    parser.add_argument('--sites', nargs='+', help='USGS site ids')
+    parser.add_argument('--models', nargs='+', default=MODELS)
+    parser.add_argument('--windows', nargs='+', type=parse_window, required=True,
+                        help='YYYY-MM-DD:YYYY-MM-DD windows')
+    parser.add_argument('--output', required=True, help='directory of the Parquet dataset')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--workers', type=int, help='processes, defaults to the CPU count')
+    parser.add_argument('--scheduler', choices=['processes', 'dask'], default='processes',
+                        help='a local process pool, or a Dask cluster')
+    parser.add_argument('--scheduler-address', help='Dask scheduler, e.g. tcp://10.0.0.1:8786, a LocalCluster '
+                                                    'when not given')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='stations per unit of work')
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+
+    backend, root = ('local', args.storage_root) if args.storage_root else ('s3', None)
+    configure_hydrofabric_models(args.hydrofabric_models)
+    stations = select_stations(create_storage(backend, root), args.states, args.hucs, args.sites)
+    units = plan(stations, args.models, args.windows, args.output, args.chunk_size)
+    partitions = sum(len(u['todo']) for u in units)
+    print(f"{len(stations)} stations, {len(units)} units with {partitions} partitions to write")
+    written = 0
+    if units and args.scheduler == 'dask':
+        written = run_dask(units, backend, root, args.hydrofabric_models, args.scheduler_address, args.workers)
+    elif units:
+        written = run(units, backend, root, args.hydrofabric_models, args.workers)
+    print(f"{written} partitions written to {args.output}")
+    return 0 if written == partitions else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+"""
+Flow duration curves beside the hydrograph.
+
+The station plots add the observed and modeled flow duration curves of the plotted window on a log flow axis to the
+right of the hydrograph, with the high flow, mid-segment slope and low flow biases of Yilmaz et al. (2008) in the
+modeled curve's name. The curves come from metrics.batch_fdc, the computation the JSON API and the batch plots use
+for whole pages of stations.
+"""
+import numpy as np
+
+from .metrics import batch_fdc, EXCEEDANCE, FDC_METRICS
+
+
+#share of the plot width kept by the hydrograph and its panels
+HYDROGRAPH_WIDTH = 0.64
+PANEL_GAP = 0.08
+
+
+def _axis_number(layout, prefix):
+    used = [int(k[len(prefix):]) for k in layout if k.startswith(prefix) and k[len(prefix):].isdigit()]
+    return max(used + [1]) + 1
+
+
+def _round(v, digits):
+    return round(float(v), digits) if np.isfinite(v) else None
+
+
+def add_fdc(data, layout, aligned, model_id):
+    """
+    Add the flow duration curves of an aligned pair to a plot.
+
+    Args:
+        data (list): traces of the hydrograph, extended in place.
+        layout (dict): layout of the hydrograph, given an x and y axis for the curves in place.
+        aligned (alignment.Aligned): the plotted paired days.
+        model_id (str): model of the modeled flows.
+    """
+    columns = batch_fdc([aligned])
+    biases = {m: _round(columns[m][0], 1) for m in FDC_METRICS}
+    if not np.isfinite(columns['obs'][0]).any():
+        return
+
+    x_axis, y_axis = _axis_number(layout, 'xaxis'), _axis_number(layout, 'yaxis')
+    layout.setdefault('xaxis', {})['domain'] = [0.0, HYDROGRAPH_WIDTH]
+    layout[f"xaxis{x_axis}"] = {'title': 'Exceedance (%)', 'domain': [HYDROGRAPH_WIDTH + PANEL_GAP, 1.0],
+                                'anchor': f"y{y_axis}"}
+    layout[f"yaxis{y_axis}"] = {'title': 'Streamflow (cfs)', 'type': 'log', 'anchor': f"x{x_axis}",
+                                'domain': layout.get('yaxis', {}).get('domain', [0.0, 1.0])}
+
+    x = [round(100.0 * p, 2) for p in EXCEEDANCE]
+    bias = ', '.join(f"{name} {biases[m]}%" for m, name in (('fhv', 'high'), ('fms', 'mid'), ('flv', 'low'))
+                     if biases[m] is not None)
+    for name, flows, color in (('USGS Observed FDC', columns['obs'][0], 'blue'),
+                               (f"{model_id} FDC (bias {bias})", columns['mod'][0], 'red')):
+        data.append({
+            'name': name,
+            'mode': 'lines',
+            'x': x,
+            'y': [_round(v, 4) for v in flows],
+            'xaxis': f"x{x_axis}",
+            'yaxis': f"y{y_axis}",
+            'line': {'width': 2, 'color': color},
+        })
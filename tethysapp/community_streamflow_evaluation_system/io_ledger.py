@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+log = logging.getLogger(f"tethys.{__name__}")
+
+#ledgers of the last requests kept for the debug view
+RECENT = deque(maxlen=50)
+
+_current = ContextVar('cses_io_ledger', default=None)
+
+
+class IOBudgetExceeded(Exception):
+    """
+    Raised by a storage read that takes a request over its byte or GET budget when the budget action is 'reject'.
+    """
+
+
+class IOLedger:
+    """
+    Every storage read of one request: key, bytes, latency and backend.
+
+    Args:
+        label (str): what the request was, shown in the debug view.
+        max_bytes (int): byte budget, None for no limit.
+        max_gets (int): read count budget, None for no limit.
+        reject (bool): raise IOBudgetExceeded when a read goes over budget instead of only logging it.
+    """
+
+    def __init__(self, label='', max_bytes=None, max_gets=None, reject=False):
+        self.label = label
+        self.max_bytes = max_bytes
+        self.max_gets = max_gets
+        self.reject = reject
+        self.created = time.time()
+        self.reads = []
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, key, nbytes, seconds, backend):
+        with self._lock:
+            self.reads.append((key, nbytes, seconds, backend))
+            self.total_bytes += nbytes
+        if self.reject and self.over_budget():
+            raise IOBudgetExceeded(f"{self.label}: {len(self.reads)} reads / {self.total_bytes} bytes, budget "
+                                   f"{self.max_gets} reads / {self.max_bytes} bytes (last key {key})")
+
+    def over_budget(self):
+        return (self.max_bytes is not None and self.total_bytes > self.max_bytes) or \
+               (self.max_gets is not None and len(self.reads) > self.max_gets)
+
+    def duplicates(self):
+        """
+        Keys read more than once in this request, key -> number of reads.
+        """
+        counts = Counter(key for key, _, _, _ in self.reads)
+        return {key: n for key, n in counts.items() if n > 1}
+
+    def to_dict(self):
+        return {
+            'label': self.label,
+            'created': self.created,
+            'gets': len(self.reads),
+            'bytes': self.total_bytes,
+            'seconds': round(sum(r[2] for r in self.reads), 6),
+            'over_budget': self.over_budget(),
+            'duplicates': self.duplicates(),
+            'reads': [{'key': k, 'bytes': b, 'ms': round(s * 1000.0, 3), 'backend': be} for k, b, s, be in self.reads],
+        }
+
+
+def record_read(key, nbytes, seconds, backend):
+    """
+    Add a storage read to the current request's ledger, if there is one.
+    """
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.record(key, nbytes, seconds, backend)
+
+
+@contextmanager
+def tracking(ledger):
+    """
+    Record the storage reads made inside the block into `ledger`.
+    """
+    token = _current.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current.reset(token)
+
+
+_settings = None
+
+
+def budget_settings():
+    """
+    (max_bytes, max_gets, reject, debug) from the io_budget_* and io_debug app settings, read once per process.
+    """
+    global _settings
+    if _settings is None:
+        from .app import CSES as app
+        _settings = (
+            app.get_custom_setting('io_budget_bytes'),
+            app.get_custom_setting('io_budget_gets'),
+            (app.get_custom_setting('io_budget_action') or 'log') == 'reject',
+            bool(app.get_custom_setting('io_debug')),
+        )
+    return _settings
+
+
+class IOLedgerMixin:
+    """
+    Mixin for the MapLayout views, keeps an I/O ledger per request, logs duplicate fetches and budget overruns,
+    and answers 503 when a request is rejected for going over budget.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        from django.http import JsonResponse
+
+        max_bytes, max_gets, reject, _ = budget_settings()
+        method = (request.POST.get('method') if request.method == 'POST' else request.GET.get('method')) or 'page'
+        ledger = IOLedger(f"{type(self).__name__}.{method} {request.get_full_path()}", max_bytes, max_gets, reject)
+        try:
+            with tracking(ledger):
+                response = super().dispatch(request, *args, **kwargs)
+        except IOBudgetExceeded as e:
+            log.warning(str(e))
+            response = JsonResponse({'error': 'I/O budget exceeded', 'detail': str(e)}, status=503)
+        finally:
+            RECENT.append(ledger)
+
+        duplicates = ledger.duplicates()
+        if duplicates:
+            log.warning(f"{ledger.label}: keys fetched more than once {duplicates}")
+        if ledger.over_budget() and not reject:
+            log.warning(f"{ledger.label}: over I/O budget, {len(ledger.reads)} reads / {ledger.total_bytes} bytes")
+        return response
+
+
+def recent_ledgers():
+    return [ledger.to_dict() for ledger in reversed(RECENT)]
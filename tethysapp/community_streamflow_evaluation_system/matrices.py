@@ -0,0 +1,200 @@
+"""
+Dense site x day matrices of the observed and modeled flows, for scoring every station of a window at once.
+
+The builder lays the NWIS series and the series of each model onto one date axis, a float32 matrix per source with
+a row per site and NaN where a series has no value, next to the site and date axes::
+
+    <output>/sites.npy   USGS ids, sorted
+    <output>/dates.npy   datetime64[D], one per column
+    <output>/NWIS.npy    observed flows
+    <output>/NWM_v2.1.npy, <output>/MLP.npy, ...
+
+    python -m tethysapp.community_streamflow_evaluation_system.matrices --states UT AL --models NWM_v2.1 MLP \\
+        --storage-root <bucket mirror>
+
+The matrices are opened with np.load(mmap_mode='r'), so a window of every site is a column slice of the mapped
+files that goes straight to metrics.matrix_skill, without a per-site series, alignment or DataFrame.
+"""
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .metrics import matrix_skill, matrix_fdc, METRICS, FDC_METRICS
+from .overlay import read_all
+from .series import usgs_key, model_keys, flow_column, USGS_FLOW
+from .series_store import swap_dir
+from .storage import is_missing
+
+
+#matrices of the app workspace
+DEFAULT_MATRIX_DIR = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'matrices')
+OBSERVED = 'NWIS'
+SITES_FILE = 'sites.npy'
+DATES_FILE = 'dates.npy'
+#the NWM retrospective the models are evaluated over
+DEFAULT_START = '1980-01-01'
+DEFAULT_END = '2020-12-31'
+#sites read and scored at a time
+BLOCK_SIZE = 256
+
+
+def matrix_path(root, source):
+    return os.path.join(root, f"{source}.npy")
+
+
+def _fill(matrix, rows, keys, lo, storage):
+    """
+    Lay the series of `keys` onto rows `rows` of `matrix`, its first column day `lo`.
+    """
+    series = read_all(keys, storage)
+    for row, key in zip(rows, keys):
+        flows = series[key]
+        if isinstance(flows, Exception):
+            #sites without the series keep a row of NaN
+            if not is_missing(flows):
+                raise flows
+            continue
+        columns = flows.index.values.astype('datetime64[D]').astype(np.int64) - lo
+        inside = (columns >= 0) & (columns < matrix.shape[1])
+        matrix[row, columns[inside]] = flows.to_numpy()[inside]
+
+
+def build_matrices(output, stations, models, storage, start=DEFAULT_START, end=DEFAULT_END):
+    """
+    Write the observed matrix and one matrix per model for the stations, replacing the matrices at `output`.
+
+    Args:
+        stations (list): (site id, state, NHD id) per station.
+        models (list): model ids.
+        start (str): first day, 'YYYY-MM-DD'.
+        end (str): last day, 'YYYY-MM-DD'.
+
+    Returns:
+        tuple: (sites, days) of the matrices.
+    """
+    stations = sorted(dict((s[0], s) for s in stations).values())
+    sites = np.array([site for site, _, _ in stations], dtype=str)
+    dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    lo = dates[0].astype(np.int64)
+
+    tmp = f"{output.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, SITES_FILE), sites)
+    np.save(os.path.join(tmp, DATES_FILE), dates)
+
+    sources = [(OBSERVED, USGS_FLOW, [usgs_key(state, site) for site, state, _ in stations])]
+    for model_id in models:
+        keys = model_keys(model_id, [(state, NHD_id, site) for site, state, NHD_id in stations])
+        sources.append((model_id, flow_column(model_id), keys))
+    for source, flow_col, keys in sources:
+        matrix = np.lib.format.open_memmap(matrix_path(tmp, source), mode='w+', dtype=np.float32,
+                                           shape=(len(sites), len(dates)))
+        matrix[:] = np.nan
+        for i in range(0, len(sites), BLOCK_SIZE):
+            block = [(row, key) for row, key in enumerate(keys[i:i + BLOCK_SIZE], i) if key is not None]
+            _fill(matrix, [row for row, _ in block], [(key, flow_col) for _, key in block], lo, storage)
+        matrix.flush()
+        del matrix
+    swap_dir(tmp, output)
+    return len(sites), len(dates)
+
+
+class Matrices:
+    """
+    Read-only, memory-mapped matrices written by build_matrices.
+
+    Args:
+        path (str): matrix directory.
+    """
+
+    def __init__(self, path=DEFAULT_MATRIX_DIR):
+        self.path = path
+        self.sites = np.load(os.path.join(path, SITES_FILE))
+        self.dates = np.load(os.path.join(path, DATES_FILE))
+        self._rows = {site: i for i, site in enumerate(self.sites)}
+        self._matrices = {}
+
+    def sources(self):
+        return sorted(f[:-4] for f in os.listdir(self.path) if f.endswith('.npy') and f not in (SITES_FILE, DATES_FILE))
+
+    def matrix(self, source):
+        """
+        The mapped matrix of OBSERVED or a model id.
+        """
+        if source not in self._matrices:
+            self._matrices[source] = np.load(matrix_path(self.path, source), mmap_mode='r')
+        return self._matrices[source]
+
+    def columns(self, startdate=None, enddate=None):
+        """
+        Column slice of the days of a window, 'YYYY-MM-DD' bounds included.
+        """
+        lo = self.dates.searchsorted(np.datetime64(startdate, 'D')) if startdate else 0
+        hi = self.dates.searchsorted(np.datetime64(enddate, 'D'), side='right') if enddate else len(self.dates)
+        return slice(int(lo), int(hi))
+
+    def rows(self, site_ids):
+        """
+        Row of each site id, -1 for sites without a row.
+        """
+        return np.array([self._rows.get(site, -1) for site in site_ids], dtype=np.int64)
+
+    def score(self, model_id, startdate=None, enddate=None, site_ids=None):
+        """
+        Skill of a model at every site, or at `site_ids`, over a window.
+
+        Returns:
+            pd.DataFrame: site_id, the METRICS and the FDC_METRICS, n = 0 for sites without paired days.
+        """
+        site_ids = self.sites if site_ids is None else np.asarray(site_ids, dtype=str)
+        rows = self.rows(site_ids)
+        window = self.columns(startdate, enddate)
+        obs, mod = self.matrix(OBSERVED), self.matrix(model_id)
+        found = np.flatnonzero(rows >= 0)
+        scores = {m: np.full(len(site_ids), np.nan) for m in METRICS + FDC_METRICS}
+        scores['n'] = np.zeros(len(site_ids), dtype=np.int64)
+        #blocks of rows keep the float64 working copies small
+        for i in range(0, len(found), BLOCK_SIZE):
+            block = found[i:i + BLOCK_SIZE]
+            take = rows[block]
+            if np.all(np.diff(take) == 1):
+                take = slice(take[0], take[-1] + 1)
+            block_obs, block_mod = obs[take, window], mod[take, window]
+            columns = matrix_skill(block_obs, block_mod)
+            columns.update(matrix_fdc(block_obs, block_mod))
+            for m in METRICS + FDC_METRICS:
+                scores[m][block] = columns[m]
+        return pd.DataFrame({'site_id': site_ids, **scores})
+
+
+def main(argv=None):
+    from .storage import create_storage
+    from .series import configure_hydrofabric_models
+    from .evaluate import select_stations, MODELS
+
+    parser = argparse.ArgumentParser(description='Build the site x day flow matrices of the app workspace.')
+    parser.add_argument('--states', nargs='+', help='state ids, e.g. UT AL')
+    parser.add_argument('--hucs', nargs='+', help='HUC codes, e.g. 1602 1603')
+    parser.add_argument('--sites', nargs='+', help='USGS site ids')
+    parser.add_argument('--models', nargs='*', default=MODELS)
+    parser.add_argument('--start', default=DEFAULT_START, help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', default=DEFAULT_END, help='last day, YYYY-MM-DD')
+    parser.add_argument('--output', default=DEFAULT_MATRIX_DIR, help='matrix directory')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    configure_hydrofabric_models(args.hydrofabric_models)
+    stations = select_stations(storage, args.states, args.hucs, args.sites)
+    sites, days = build_matrices(args.output, stations, args.models, storage, args.start, args.end)
+    print(f"{len(args.models) + 1} matrices of {sites} sites x {days} days written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Skill of modeled against observed flows, computed from paired sums, and their flow duration curves.
+
+n, the sums of both series, of their squares, of their product and of the squared error are enough for RMSE, r2,
+r, KGE and percent bias, so skill can be merged over pyramid periods (pyramids.py), computed for many stations
+in one pass (batch_skill, matrix_skill) and over every trailing window of a record (rolling_skill) with the same
+formulas as sklearn's r2_score (the NSE), mean_squared_error and max_error and hydroeval's kge.
+
+Flow duration curves and their segment biases are computed for many stations at once as well, from one sort along
+the rows of a station x day matrix of their flows (batch_fdc, matrix_fdc).
+"""
+import numpy as np
+
+
+SUMS = ['n', 'obs_sum', 'mod_sum', 'obs_sq', 'mod_sq', 'obs_mod', 'err_sq']
+METRICS = ['n', 'r2', 'rmse', 'maxerror', 'r', 'kge', 'pbias']
+#flow duration curve biases of Yilmaz et al. (2008), high flows, mid-segment slope and low flows, in %
+FDC_METRICS = ['fhv', 'fms', 'flv']
+#exceedance probabilities of the flow duration curves sent to the plots
+EXCEEDANCE = np.linspace(0.0, 1.0, 101)
+#the highest 2 % of flows, the slope between 20 and 70 % exceedance, the flows beyond 70 %
+FDC_HIGH = 0.02
+FDC_MID = (0.2, 0.7)
+FDC_LOW = 0.7
+#gauges report zero flows, floored before taking logs
+LOG_FLOOR = 0.01
+
+
+def skill_from_sums(n, obs_sum, mod_sum, obs_sq, mod_sq, obs_mod, err_sq):
+    """
+    r2, rmse, r, kge and pbias (%) from paired sums, scalars or arrays of sums alike.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        obs_mean = obs_sum / n
+        mod_mean = mod_sum / n
+        obs_var = np.maximum(obs_sq / n - obs_mean ** 2, 0.0)
+        mod_var = np.maximum(mod_sq / n - mod_mean ** 2, 0.0)
+        r = (obs_mod / n - obs_mean * mod_mean) / np.sqrt(obs_var * mod_var)
+        alpha = np.sqrt(mod_var / obs_var)
+        beta = mod_mean / obs_mean
+        return {
+            'r2': 1.0 - err_sq / (obs_var * n),
+            'rmse': np.sqrt(err_sq / n),
+            'r': r,
+            'kge': 1.0 - np.sqrt((r - 1.0) ** 2 + (alpha - 1.0) ** 2 + (beta - 1.0) ** 2),
+            'pbias': 100.0 * (mod_mean - obs_mean) / obs_mean,
+        }
+
+
+def stats_from_sums(sums, maxerror):
+    """
+    Skill of one set of sums as floats, with n and maxerror.
+    """
+    stats = {k: float(v) for k, v in skill_from_sums(*sums).items()}
+    stats['n'] = int(sums[0])
+    stats['maxerror'] = float(maxerror)
+    return stats
+
+
+def skill_title(stats):
+    """
+    RMSE, KGE and MaxError of `stats` as the plot titles show them.
+    """
+    return (f"RMSE: {round(stats['rmse'], 0)} cfs <br> KGE: {round(stats['kge'], 2)} <br> "
+            f"MaxError: {round(stats['maxerror'], 0)} cfs")
+
+
+def aligned_skill(aligned):
+    """
+    Skill of an aligned pair over its paired days.
+
+    Returns:
+        dict: n, r2, rmse, maxerror, r, kge and pbias (%).
+    """
+    obs = np.asarray(aligned.obs, dtype=np.float64)
+    mod = np.asarray(aligned.mod, dtype=np.float64)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    obs, mod = obs[ok], mod[ok]
+    sums = [len(obs), obs.sum(), mod.sum(), obs @ obs, mod @ mod, obs @ mod, ((mod - obs) ** 2).sum()]
+    return stats_from_sums(sums, np.abs(mod - obs).max() if len(obs) else np.nan)
+
+
+def batch_skill(pairs):
+    """
+    Skill of many aligned pairs in one pass: their flows are concatenated and the sums of every pair taken with
+    bincount over the pair number.
+
+    Args:
+        pairs (list<alignment.Aligned>): one aligned pair per station.
+
+    Returns:
+        dict: metric -> np.ndarray with one value per pair, n, r2, rmse, maxerror, r, kge and pbias (%).
+    """
+    k = len(pairs)
+    lengths = np.array([len(p) for p in pairs], dtype=np.int64)
+    segment = np.repeat(np.arange(k), lengths)
+    obs = np.concatenate([np.asarray(p.obs, dtype=np.float64) for p in pairs]) if k else np.empty(0)
+    mod = np.concatenate([np.asarray(p.mod, dtype=np.float64) for p in pairs]) if k else np.empty(0)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    segment, obs, mod = segment[ok], obs[ok], mod[ok]
+    err = mod - obs
+
+    total = lambda weights: np.bincount(segment, weights=weights, minlength=k)
+    n = np.bincount(segment, minlength=k).astype(np.float64)
+    columns = skill_from_sums(n, total(obs), total(mod), total(obs * obs), total(mod * mod), total(obs * mod),
+                              total(err * err))
+    maxerror = np.full(k, -np.inf)
+    np.maximum.at(maxerror, segment, np.abs(err))
+    columns['maxerror'] = np.where(n > 0, maxerror, np.nan)
+    columns['n'] = n.astype(np.int64)
+    return columns
+
+
+def matrix_skill(obs, mod):
+    """
+    Skill of every row of two site x day matrices, e.g. a window of the matrices of matrices.py. Days where
+    either is NaN are left out, like the unpaired days of align.
+
+    Args:
+        obs (np.ndarray): observed flows, one row per site.
+        mod (np.ndarray): modeled flows of the same sites and days.
+
+    Returns:
+        dict: metric -> np.ndarray with one value per row, n, r2, rmse, maxerror, r, kge and pbias (%).
+    """
+    obs = np.asarray(obs, dtype=np.float64)
+    mod = np.asarray(mod, dtype=np.float64)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    obs = np.where(ok, obs, 0.0)
+    mod = np.where(ok, mod, 0.0)
+    err = mod - obs
+
+    n = ok.sum(axis=1).astype(np.float64)
+    columns = skill_from_sums(n, obs.sum(axis=1), mod.sum(axis=1), (obs * obs).sum(axis=1),
+                              (mod * mod).sum(axis=1), (obs * mod).sum(axis=1), (err * err).sum(axis=1))
+    #unpaired days have an error of 0, below any paired one
+    columns['maxerror'] = np.where(n > 0, np.abs(err).max(axis=1, initial=0.0), np.nan)
+    columns['n'] = n.astype(np.int64)
+    return columns
+
+
+def paired_sums(obs, mod):
+    """
+    The SUMS of each paired day, days where either flow is NaN left out.
+
+    Returns:
+        np.ndarray, np.ndarray: mask of the paired days, and a (len(SUMS), paired days) array.
+    """
+    obs = np.asarray(obs, dtype=np.float64)
+    mod = np.asarray(mod, dtype=np.float64)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    obs, mod = obs[ok], mod[ok]
+    return ok, np.vstack([np.ones(len(obs)), obs, mod, obs * obs, mod * mod, obs * mod, (mod - obs) ** 2])
+
+
+def rolling_skill(days, sums, window, min_days=None):
+    """
+    Skill over the trailing `window` days ending at each row, in time linear in the length of the record.
+
+    The sums of the rows are laid onto a dense day axis and accumulated once; the sums of any window are then the
+    difference of two cumulative sums, so each row costs the same whatever the window, instead of a pass over the
+    window's days.
+
+    Args:
+        days (np.ndarray): day number of each row, ascending, see alignment.day_numbers. Rows are paired days, or
+            periods of a pyramid dated by their start.
+        sums (np.ndarray): (len(SUMS), rows) array of the rows' paired sums.
+        window (int): days per window, the row's day included.
+        min_days (int): paired days a window needs, half the window by default.
+
+    Returns:
+        dict: metric -> np.ndarray with one value per row, n, nse, rmse, kge and pbias (%), NaN where a window has
+        fewer than `min_days` paired days.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    sums = np.asarray(sums, dtype=np.float64)
+    min_days = (window + 1) // 2 if min_days is None else min_days
+    if not len(days):
+        return {m: np.empty(0) for m in ('n', 'nse', 'rmse', 'kge', 'pbias')}
+    offsets = days - days[0]
+    span = int(offsets[-1]) + 1
+    dense = np.zeros((len(sums), span + 1))
+    for i in range(len(sums)):
+        dense[i, 1:] = np.bincount(offsets, weights=sums[i], minlength=span)
+    np.cumsum(dense, axis=1, out=dense)
+    hi = offsets + 1
+    lo = np.maximum(hi - window, 0)
+    windowed = dense[:, hi] - dense[:, lo]
+
+    n = windowed[0]
+    columns = skill_from_sums(*windowed)
+    full = n >= max(min_days, 1)
+    return {
+        'n': n.astype(np.int64),
+        'nse': np.where(full, columns['r2'], np.nan),
+        'rmse': np.where(full, columns['rmse'], np.nan),
+        'kge': np.where(full, columns['kge'], np.nan),
+        'pbias': np.where(full, columns['pbias'], np.nan),
+    }
+
+
+def _exceeded(desc, starts, counts, exceedance):
+    """
+    Flow of each segment exceeded with each probability, linear between ranks, NaN for empty segments.
+    """
+    last = np.maximum(counts - 1, 0)[:, None]
+    position = np.asarray(exceedance, dtype=np.float64)[None, :] * last
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, last)
+    if not len(desc):
+        return np.full(position.shape, np.nan)
+    top = len(desc) - 1
+    lo_flow = desc[np.minimum(starts[:, None] + lo, top)]
+    hi_flow = desc[np.minimum(starts[:, None] + hi, top)]
+    flows = lo_flow + (hi_flow - lo_flow) * (position - lo)
+    flows[counts == 0] = np.nan
+    return flows
+
+
+def _rank_sums(desc, starts, counts, first, stop):
+    """
+    Sum over ranks [first, stop) of each segment, from one cumulative sum of the sorted values.
+    """
+    total = np.concatenate(([0.0], np.cumsum(np.where(np.isfinite(desc), desc, 0.0))))
+    return total[starts + stop] - total[starts + first]
+
+
+def _segment_biases(obs, mod, starts, counts):
+    """
+    FHV, FMS and FLV (%) of the segments of two descending sorted flow arrays of the same segment layout.
+    """
+    n = counts.astype(np.int64)
+    high = np.where(n > 0, np.maximum(np.ceil(FDC_HIGH * n).astype(np.int64), 1), 0)
+    low = np.floor(FDC_LOW * n).astype(np.int64)
+    log_obs, log_mod = np.log(np.maximum(obs, LOG_FLOOR)), np.log(np.maximum(mod, LOG_FLOOR))
+    zero = np.zeros_like(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        obs_high = _rank_sums(obs, starts, counts, zero, high)
+        fhv = 100.0 * (_rank_sums(mod, starts, counts, zero, high) - obs_high) / obs_high
+
+        mid_obs = np.log(np.maximum(_exceeded(obs, starts, counts, FDC_MID), LOG_FLOOR))
+        mid_mod = np.log(np.maximum(_exceeded(mod, starts, counts, FDC_MID), LOG_FLOOR))
+        obs_slope = mid_obs[:, 0] - mid_obs[:, 1]
+        fms = 100.0 * ((mid_mod[:, 0] - mid_mod[:, 1]) - obs_slope) / obs_slope
+
+        #log flows of the low segment above the segment's minimum
+        last = starts + np.maximum(n - 1, 0)
+        size = n - low
+        obs_low = _rank_sums(log_obs, starts, counts, low, n) - size * log_obs[np.minimum(last, len(obs) - 1)] \
+            if len(obs) else np.zeros(len(n))
+        mod_low = _rank_sums(log_mod, starts, counts, low, n) - size * log_mod[np.minimum(last, len(mod) - 1)] \
+            if len(mod) else np.zeros(len(n))
+        flv = -100.0 * (mod_low - obs_low) / obs_low
+    empty = n == 0
+    return {
+        'fhv': np.where(empty, np.nan, fhv),
+        'fms': np.where(empty, np.nan, fms),
+        'flv': np.where(empty, np.nan, flv),
+    }
+
+
+def _row_fdc(obs, mod, ok, exceedance):
+    """
+    Curves and segment biases of every row of two flow matrices, the days of `ok` paired. Each row is sorted from
+    high to low with one sort along the rows, unpaired days sorting past the row's count.
+    """
+    obs = -np.sort(-np.where(ok, obs, np.nan), axis=1)
+    mod = -np.sort(-np.where(ok, mod, np.nan), axis=1)
+    counts = ok.sum(axis=1)
+    starts = np.arange(obs.shape[0], dtype=np.int64) * obs.shape[1]
+    obs, mod = obs.ravel(), mod.ravel()
+    columns = _segment_biases(obs, mod, starts, counts)
+    columns['obs'] = _exceeded(obs, starts, counts, exceedance)
+    columns['mod'] = _exceeded(mod, starts, counts, exceedance)
+    return columns
+
+
+def batch_fdc(pairs, exceedance=EXCEEDANCE):
+    """
+    Flow duration curves and FDC segment biases of many aligned pairs in one pass: the flows of the pairs are laid
+    into the rows of a station x day matrix, padded with NaN, and every row is sorted at once; the curves and the
+    segment sums are then read off the sorted rows by rank.
+
+    Args:
+        pairs (list<alignment.Aligned>): one aligned pair per station.
+        exceedance (np.ndarray): exceedance probabilities of the curves, 0 to 1.
+
+    Returns:
+        dict: 'obs' and 'mod', pairs x exceedance arrays of the flows exceeded, and fhv, fms and flv (%) per pair.
+    """
+    k = len(pairs)
+    lengths = np.array([len(p) for p in pairs], dtype=np.int64)
+    width = int(lengths.max()) if k else 0
+    row = np.repeat(np.arange(k), lengths)
+    column = np.arange(len(row)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    obs, mod = np.full((k, width), np.nan), np.full((k, width), np.nan)
+    if k:
+        obs[row, column] = np.concatenate([np.asarray(p.obs, dtype=np.float64) for p in pairs])
+        mod[row, column] = np.concatenate([np.asarray(p.mod, dtype=np.float64) for p in pairs])
+    return _row_fdc(obs, mod, np.isfinite(obs) & np.isfinite(mod), exceedance)
+
+
+def matrix_fdc(obs, mod, exceedance=EXCEEDANCE):
+    """
+    Flow duration curves and FDC segment biases of every row of two site x day matrices, see matrix_skill. Days
+    where either is NaN are left out.
+
+    Returns:
+        dict: 'obs' and 'mod', rows x exceedance arrays of the flows exceeded, and fhv, fms and flv (%) per row.
+    """
+    obs = np.asarray(obs, dtype=np.float64)
+    mod = np.asarray(mod, dtype=np.float64)
+    return _row_fdc(obs, mod, np.isfinite(obs) & np.isfinite(mod), exceedance)
@@ -0,0 +1,259 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from .crosswalk import Crosswalk
+
+
+class Network:
+    """
+    Flowpath network of a NextGen hydrofabric (nexus -> waterbody -> nexus) held as compressed sparse rows.
+
+    Nodes are numbered 0..n-1 in sorted id order. The downstream and upstream adjacency are each an indptr/indices
+    pair, so the neighbours of a whole frontier of nodes are gathered with a few array operations, and traversals
+    are a loop over frontiers rather than over nodes.
+
+    Args:
+        edges (list<dict>): {'id': from node, 'toid': to node}, as in flowpath_edge_list.json.
+        crosswalk (dict): waterbody id -> {'Gage_no': [USGS ids]}, as in crosswalk.json.
+    """
+
+    def __init__(self, edges, crosswalk=None):
+        src_ids = np.array([e['id'] for e in edges])
+        dst_ids = np.array([e['toid'] for e in edges])
+        self.ids = np.unique(np.concatenate([src_ids, dst_ids]))
+        n = len(self.ids)
+        src = np.searchsorted(self.ids, src_ids)
+        dst = np.searchsorted(self.ids, dst_ids)
+        self.down_indptr, self.down_indices = _csr(src, dst, n)
+        self.up_indptr, self.up_indices = _csr(dst, src, n)
+        self.order, self.levels = self._topological_order()
+        self.rank = np.empty(n, dtype=np.int64)
+        self.rank[self.order] = np.arange(n)
+
+        #gauge i sits on node gauge_nodes[i], a gauge crosswalked to several waterbodies has several entries
+        self.crosswalk = Crosswalk(crosswalk or {})
+        wbs, gages = self.crosswalk.pairs()
+        nodes, found = self.lookup(wbs)
+        self.gauge_nodes = nodes[found]
+        self.gauge_ids = gages[found]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node_id):
+        i = np.searchsorted(self.ids, node_id)
+        return i < len(self.ids) and self.ids[i] == node_id
+
+    def lookup(self, node_ids):
+        """
+        Batch lookup of node ids.
+
+        Returns:
+            np.ndarray, np.ndarray: node index of every id (0 where missing) and whether it was found.
+        """
+        node_ids = np.asarray(node_ids, dtype=str)
+        if not len(self.ids) or not len(node_ids):
+            return np.zeros(len(node_ids), dtype=np.int64), np.zeros(len(node_ids), dtype=bool)
+        i = np.searchsorted(self.ids, node_ids)
+        found = i < len(self.ids)
+        found[found] = self.ids[i[found]] == node_ids[found]
+        return np.where(found, i, 0).astype(np.int64), found
+
+    def node(self, node_id):
+        """
+        Index of a node id, KeyError if it is not in the network.
+        """
+        if node_id not in self:
+            raise KeyError(node_id)
+        return int(np.searchsorted(self.ids, node_id))
+
+    def _topological_order(self):
+        #Kahn's algorithm, one frontier of headwater-most remaining nodes at a time
+        n = len(self.ids)
+        indegree = np.diff(self.up_indptr).copy()
+        frontier = np.flatnonzero(indegree == 0)
+        order = []
+        while len(frontier):
+            order.append(frontier)
+            targets = _gather(self.down_indptr, self.down_indices, frontier)
+            np.subtract.at(indegree, targets, 1)
+            targets = np.unique(targets)
+            frontier = targets[indegree[targets] == 0]
+        levels = order
+        order = np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+        if len(order) != n:
+            raise ValueError(f"The flowpath network has a cycle through {n - len(order)} nodes")
+        return order, levels
+
+    def _reach(self, indptr, indices, sources):
+        seen = np.zeros(len(self.ids), dtype=bool)
+        seen[sources] = True
+        frontier = np.asarray(sources, dtype=np.int64)
+        while len(frontier):
+            targets = _gather(indptr, indices, frontier)
+            frontier = np.unique(targets[~seen[targets]])
+            seen[frontier] = True
+        return seen
+
+    def upstream_mask(self, nodes):
+        """
+        Boolean mask of the nodes draining to any of `nodes` (node indices), the nodes themselves included.
+        """
+        return self._reach(self.up_indptr, self.up_indices, nodes)
+
+    def downstream_mask(self, nodes):
+        return self._reach(self.down_indptr, self.down_indices, nodes)
+
+    def _sorted(self, mask):
+        nodes = np.flatnonzero(mask)
+        return nodes[np.argsort(self.rank[nodes])]
+
+    def upstream(self, node_id):
+        """
+        Ids of the nodes draining to `node_id`, itself included, headwaters first.
+        """
+        return self.ids[self._sorted(self.upstream_mask([self.node(node_id)]))].tolist()
+
+    def downstream(self, node_id):
+        """
+        Ids of the nodes `node_id` drains through down to the outlet, itself first.
+        """
+        return self.ids[self._sorted(self.downstream_mask([self.node(node_id)]))].tolist()
+
+    def outlets(self):
+        """
+        Ids of the nodes with nothing downstream.
+        """
+        return self.ids[np.diff(self.down_indptr) == 0].tolist()
+
+    def nodes_of(self, location):
+        """
+        Node indices of a gauge (USGS id) or a node id.
+        """
+        if location in self:
+            return np.array([self.node(location)])
+        nodes = self.gauge_nodes[self.gauge_ids == location]
+        if not len(nodes):
+            raise KeyError(location)
+        return nodes
+
+    def _gauges_in(self, mask):
+        gauges = np.flatnonzero(mask[self.gauge_nodes])
+        gauges = gauges[np.argsort(self.rank[self.gauge_nodes[gauges]], kind='stable')]
+        return list(dict.fromkeys(self.gauge_ids[gauges]))
+
+    def subnetwork_gauges(self, outlet):
+        """
+        Every gauge in the subnetwork draining to `outlet`, the outlet's own gauges included, headwaters first.
+
+        Args:
+            outlet (str): USGS id of a crosswalked gauge, or a nexus/waterbody id.
+        """
+        return self._gauges_in(self.upstream_mask(self.nodes_of(outlet)))
+
+    def upstream_gauges(self, gage_id):
+        """
+        The gauges upstream of a gauge, not counting itself.
+        """
+        return [g for g in self.subnetwork_gauges(gage_id) if g != gage_id]
+
+    def nearest_downstream(self, targets):
+        """
+        For every node, the position in `targets` (unique node indices) of the first of them met going downstream
+        from the node, itself included, -1 where it drains to none. Labels are handed down one frontier of the
+        reversed topological order at a time, which needs every node to drain to a single node, as in a
+        hydrofabric; ValueError otherwise.
+        """
+        n = len(self.ids)
+        outdegree = np.diff(self.down_indptr)
+        if n and outdegree.max() > 1:
+            raise ValueError(f"The flowpath network splits at {int((outdegree > 1).sum())} nodes")
+        down = np.full(n, -1, dtype=np.int64)
+        down[outdegree > 0] = self.down_indices[self.down_indptr[:-1][outdegree > 0]]
+        label = np.full(n, -1, dtype=np.int64)
+        label[targets] = np.arange(len(targets))
+        is_target = label >= 0
+        for frontier in reversed(self.levels):
+            frontier = frontier[~is_target[frontier] & (down[frontier] >= 0)]
+            label[frontier] = label[down[frontier]]
+        return label
+
+    def upstream_gauge_counts(self, gage_ids):
+        """
+        Number of gauges upstream of each of `gage_ids`, not counting itself, as len(upstream_gauges(g)).
+
+        The gauges on every node are accumulated downstream one frontier of the topological order at a time, which
+        counts each gauge once where every node drains to a single node, as in a hydrofabric. Gauges crosswalked to
+        several waterbodies add their downstream mask instead, and a network that splits falls back to a traversal
+        per gauge.
+        """
+        n = len(self.ids)
+        if n and np.diff(self.down_indptr).max() > 1:
+            return [len(self.upstream_gauges(g)) if g in self.gauge_ids else 0 for g in gage_ids]
+
+        names, entries = np.unique(self.gauge_ids, return_counts=True)
+        single = np.isin(self.gauge_ids, names[entries == 1])
+        counts = np.bincount(self.gauge_nodes[single], minlength=n).astype(np.int64)
+        for frontier in self.levels:
+            frontier = frontier[np.diff(self.down_indptr)[frontier] > 0]
+            np.add.at(counts, self.down_indices[self.down_indptr[frontier]], counts[frontier])
+        for gage in names[entries > 1]:
+            counts[self.downstream_mask(self.gauge_nodes[self.gauge_ids == gage])] += 1
+
+        nodes = dict(zip(self.gauge_ids[single].tolist(), self.gauge_nodes[single].tolist()))
+        result = []
+        for g in gage_ids:
+            if g in nodes:
+                result.append(int(counts[nodes[g]]) - 1)
+            else:
+                result.append(len(self.upstream_gauges(g)) if g in self.gauge_ids else 0)
+        return result
+
+    def gauge_waterbodies(self):
+        """
+        USGS id -> waterbody ids it is crosswalked to.
+        """
+        waterbodies = {}
+        for node, gage in zip(self.gauge_nodes, self.gauge_ids):
+            waterbodies.setdefault(gage, []).append(str(self.ids[node]))
+        return waterbodies
+
+
+def _csr(rows, cols, n):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order].astype(np.int64)
+
+
+def _gather(indptr, indices, frontier):
+    """
+    Concatenated neighbours of every node in `frontier`.
+    """
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    #position of every neighbour: its row start plus its offset within the row
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
+
+
+@lru_cache(maxsize=4)
+def load_network(config_dir):
+    """
+    The network of a NextGen config directory with flowpath_edge_list.json and crosswalk.json, built once
+    per process.
+    """
+    with open(os.path.join(config_dir, 'flowpath_edge_list.json')) as f:
+        edges = json.load(f)
+    crosswalk_path = os.path.join(config_dir, 'crosswalk.json')
+    crosswalk = None
+    if os.path.exists(crosswalk_path):
+        with open(crosswalk_path) as f:
+            crosswalk = json.load(f)
+    return Network(edges, crosswalk)
@@ -0,0 +1,242 @@
+"""
+Ingest the outputs of a NextGen run and score them against NWIS.
+
+ngen writes one nexus output per nexus (``nex-<id>_output.csv``: step, time, flow in m3/s), the lateral inflows
+t-route routes downstream. For every crosswalked gauge the nexus outputs upstream of its waterbody (found with the
+CSR network) are read, reduced to daily means in cfs and summed into the gauge's daily series, an unrouted
+estimate of the flow at the gauge. Each nexus is summed into the nearest gauge downstream of it only, and the
+gauges' sums are then added down the gauge tree, so memory is one label per node plus one daily array per gauge
+rather than a gauge x node mask. Only the nexus files upstream of a gauge are opened, they are parsed on a thread
+pool a window at a time, so runs with thousands of output files are ingested in bounded memory.
+
+The daily series are scored against the NWIS observations with the metrics of the plots, and can be written as
+NextGen hydrofabric series (see the hydrofabric_models setting) so the Network view can plot and evaluate them::
+
+    python -m tethysapp.community_streamflow_evaluation_system.nextgen --outputs <run output dir> \
+        --write <bucket mirror> --scores scores.csv
+"""
+import argparse
+import fnmatch
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .crosswalk import DEFAULT_CONFIG_DIR
+from .network import load_network
+from .storage import get_storage, create_storage, is_missing
+from .series import read_series, usgs_key, flow_column, hydrofabric_key, USGS_FLOW
+from .alignment import align
+from .metrics import aligned_skill
+from .utils import streamstats
+
+
+MODEL_ID = 'NextGen'
+M3S_TO_CFS = 35.3147
+
+
+def run_settings(config_dir=DEFAULT_CONFIG_DIR, realization='awi_simplified_realization.json', troute='ngen.yaml'):
+    """
+    Start and end time of the run from the realization, and the nexus file pattern from the t-route config.
+
+    Returns:
+        pd.Timestamp, pd.Timestamp, str: start, end and the nexus output file pattern.
+    """
+    with open(os.path.join(config_dir, realization)) as f:
+        time = json.load(f)['time']
+    pattern = 'nex-*'
+    troute_path = os.path.join(config_dir, troute)
+    if os.path.exists(troute_path):
+        import yaml
+        with open(troute_path) as f:
+            config = yaml.safe_load(f) or {}
+        forcing = config.get('compute_parameters', {}).get('forcing_parameters', {})
+        pattern = forcing.get('nexus_file_pattern_filter') or pattern
+    return pd.Timestamp(time['start_time']), pd.Timestamp(time['end_time']), pattern
+
+
+def nexus_files(output_dir, pattern='nex-*'):
+    """
+    nexus id -> path of every nexus csv output in `output_dir`.
+    """
+    files = {}
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.csv') and fnmatch.fnmatch(entry.name, pattern):
+                #nex-113061_output.csv -> nex-113061
+                files[entry.name[:-4].split('_')[0]] = entry.path
+    return files
+
+
+def read_nexus_daily(path, first_day, days):
+    """
+    Daily mean flow (cfs) of one nexus output, NaN on days without output.
+
+    Args:
+        path (str): nexus output csv, no header: step, time, flow (m3/s).
+        first_day (np.datetime64): first day of the run.
+        days (int): days of the run.
+    """
+    df = pd.read_csv(path, header=None, usecols=[1, 2], names=['step', 'time', 'flow'], skipinitialspace=True,
+                     dtype={'flow': np.float64})
+    day = (pd.to_datetime(df['time'], format='%Y-%m-%d %H:%M:%S').to_numpy().astype('datetime64[D]')
+           - first_day).astype(np.int64)
+    ok = (day >= 0) & (day < days)
+    counts = np.bincount(day[ok], minlength=days)
+    sums = np.bincount(day[ok], weights=df['flow'].to_numpy()[ok], minlength=days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts * M3S_TO_CFS
+
+
+def _bounded_map(pool, fn, items, window):
+    #at most `window` files parsed or waiting to be summed at once
+    pending = deque()
+    for item in items:
+        pending.append((item, pool.submit(fn, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def ingest_run(output_dir, config_dir=DEFAULT_CONFIG_DIR, gages=None, workers=8):
+    """
+    Daily flow at every gauge from a run's nexus outputs.
+
+    Args:
+        output_dir (str): directory of the nexus outputs.
+        config_dir (str): directory of the realization, ngen.yaml, flowpath_edge_list.json and crosswalk.json.
+        gages (list): USGS ids, defaults to every gauge of the crosswalk.
+        workers (int): parser threads.
+
+    Returns:
+        dict: USGS id -> (waterbody id, pd.Series of daily cfs), for gauges with nexus outputs upstream.
+    """
+    network = load_network(config_dir)
+    start, end, pattern = run_settings(config_dir)
+    first_day = start.to_datetime64().astype('datetime64[D]')
+    days = int((end.to_datetime64().astype('datetime64[D]') - first_day).astype(np.int64)) + 1
+    dates = pd.DatetimeIndex(np.arange(days) + first_day, name='Datetime')
+
+    if gages is None:
+        gages = list(dict.fromkeys(network.crosswalk.pairs()[1]))
+    waterbodies = network.crosswalk.outlet_waterbodies(gages, network)
+    gauged = [(g, wb) for g, wb in zip(gages, waterbodies) if wb is not None and wb in network]
+    if not gauged:
+        return {}
+    #one slot per gauged waterbody, every node labelled with the slot it first drains to
+    targets, slots = np.unique([network.node(wb) for _, wb in gauged], return_inverse=True)
+    label = network.nearest_downstream(targets)
+    outdegree = np.diff(network.down_indptr)[targets]
+    parents = np.full(len(targets), -1, dtype=np.int64)
+    parents[outdegree > 0] = label[network.down_indices[network.down_indptr[targets[outdegree > 0]]]]
+
+    files = nexus_files(output_dir, pattern)
+    nodes, found = network.lookup(list(files))
+    paths = np.array(list(files.values()), dtype=object)
+    needed = found.copy()
+    needed[found] = label[nodes[found]] >= 0
+    work = list(zip(nodes[needed], paths[needed]))
+
+    totals = np.zeros((len(targets), days))
+    seen = np.zeros((len(targets), days), dtype=bool)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (node, _), daily in _bounded_map(pool, lambda item: read_nexus_daily(item[1], first_day, days), work,
+                                             window=workers * 4):
+            slot = label[node]
+            present = np.isfinite(daily)
+            totals[slot] += np.where(present, daily, 0.0)
+            seen[slot] |= present
+    #headwater gauges first, each slot's sums added to the next gauge downstream
+    for slot in np.argsort(network.rank[targets], kind='stable'):
+        if parents[slot] >= 0:
+            totals[parents[slot]] += totals[slot]
+            seen[parents[slot]] |= seen[slot]
+
+    result = {}
+    for (gage, wb), slot in zip(gauged, slots):
+        if seen[slot].any():
+            flows = np.where(seen[slot], totals[slot], np.nan).astype(np.float32)
+            result[gage] = (wb, pd.Series(flows, index=dates, name=flow_column(MODEL_ID)))
+    return result
+
+
+def station_states(gages, storage=None):
+    """
+    USGS id -> state id from Streamstats.csv.
+    """
+    table = streamstats(storage or get_storage())
+    states = dict(zip(table['NWIS_site_id'], table['state_id']))
+    return {g: states.get(g) for g in gages}
+
+
+def score_run(ingested, startdate=None, enddate=None, storage=None):
+    """
+    Skill of the ingested series against NWIS at every gauge.
+
+    Returns:
+        pd.DataFrame: one row per gauge with its waterbody, n, r2, rmse, maxerror, r, kge and pbias.
+    """
+    storage = storage or get_storage()
+    states = station_states(list(ingested), storage)
+    rows = []
+    for gage, (wb, mod) in ingested.items():
+        row = {'USGS_id': gage, 'waterbody': wb, 'state': states.get(gage)}
+        try:
+            obs = read_series(usgs_key(row['state'], gage), USGS_FLOW, storage)
+        except Exception as e:
+            #gauges without NWIS observations are listed unscored
+            if not is_missing(e):
+                raise
+            rows.append(row)
+            continue
+        row.update(aligned_skill(align(obs, mod, startdate, enddate)))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_series(ingested, root, model_id=MODEL_ID):
+    """
+    Write the ingested series under `root` as hydrofabric keyed model series.
+
+    Returns:
+        int: files written.
+    """
+    for gage, (wb, series) in ingested.items():
+        path = os.path.join(root, *hydrofabric_key(model_id, wb).split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.DataFrame({'Datetime': series.index.strftime('%Y-%m-%d'), series.name: series.to_numpy()}).to_csv(path)
+    return len(ingested)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest a NextGen run and score it against NWIS.')
+    parser.add_argument('--outputs', required=True, help='directory of the nexus outputs')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_DIR, help='NextGen config directory')
+    parser.add_argument('--gages', nargs='+', help='USGS ids, defaults to every crosswalked gauge')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--start', help='first day scored, YYYY-MM-DD')
+    parser.add_argument('--end', help='last day scored, YYYY-MM-DD')
+    parser.add_argument('--storage-root', help='read NWIS from this local bucket mirror instead of S3')
+    parser.add_argument('--write', help='write the series as NextGen hydrofabric series under this directory')
+    parser.add_argument('--scores', help='write the scores to this csv')
+    args = parser.parse_args(argv)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    ingested = ingest_run(args.outputs, args.config, args.gages, args.workers)
+    print(f"{len(ingested)} gauges ingested from {args.outputs}")
+    if args.write:
+        print(f"{write_series(ingested, args.write)} series written to {args.write}")
+    scores = score_run(ingested, args.start, args.end, storage)
+    print(scores.to_string(index=False))
+    if args.scores:
+        scores.to_csv(args.scores, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Hydrographs and skill of several stations in one response, for comparing gauges side by side.
+
+The series of all stations are read concurrently, an observed series shared by several requests comes from the
+worker's series cache, every pair is aligned to the window and the skill of all of them is computed in one
+metrics.batch_skill call. Windows wider than the plot are averaged per week, month or water year, like the
+single station plots.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .storage import get_storage, is_missing
+from .timing import span
+from .series import read_series, usgs_key, model_key, flow_column, date_strings, flow_values, USGS_FLOW
+from .alignment import align_many
+from .metrics import batch_skill, batch_fdc, METRICS, FDC_METRICS
+from .pyramids import choose_level, period_starts, plot_max_points, LEVEL_NAMES
+from .utils import streamstats
+
+
+MAX_STATIONS = 25
+#plotly's default colors, one per station, observed solid and modeled dashed
+COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22',
+          '#17becf']
+
+
+def station_info(site_ids, storage):
+    """
+    USGS id -> (state, NHD id) from Streamstats.csv, for the ids it has.
+    """
+    table = streamstats(storage)
+    table = table[table['NWIS_site_id'].isin(site_ids)]
+    return {site: (state, NHD_id) for site, state, NHD_id in
+            zip(table['NWIS_site_id'], table['state_id'], table['NHD_reachcode'])}
+
+
+def read_all(keys, storage, workers=8):
+    """
+    Read many series at once, each key once.
+
+    Args:
+        keys (list): (storage key, flow column) pairs.
+
+    Returns:
+        dict: (key, flow column) -> pd.Series, or the exception raised reading it.
+    """
+    def read(item):
+        try:
+            return read_series(item[0], item[1], storage)
+        except Exception as e:
+            return e
+
+    unique = list(dict.fromkeys(keys))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique)))) as pool:
+        #the request's I/O ledger and timing spans follow the reads into the threads
+        futures = [pool.submit(contextvars.copy_context().run, read, item) for item in unique]
+        return {item: f.result() for item, f in zip(unique, futures)}
+
+
+def available_pairs(keys, series):
+    """
+    site -> (observed, modeled) series of the sites with both, from the result of read_all. Stations missing either
+    series are left out, other read errors are raised.
+
+    Args:
+        keys (dict): site -> ((observed key, flow column), (model key, flow column)).
+    """
+    pairs = {}
+    for site, (obs_key, mod_key) in keys.items():
+        obs, mod = series[obs_key], series[mod_key]
+        for value in (obs, mod):
+            if isinstance(value, Exception) and not is_missing(value):
+                raise value
+        if not isinstance(obs, Exception) and not isinstance(mod, Exception):
+            pairs[site] = (obs, mod)
+    return pairs
+
+
+def _periods(aligned, level):
+    if level == 'day':
+        return aligned.dates, aligned.obs, aligned.mod
+    frame = aligned.to_frame('obs', 'mod')
+    means = frame.groupby(np.asarray(period_starts(frame.index, level))).mean()
+    return pd.DatetimeIndex(means.index), means['obs'].to_numpy(), means['mod'].to_numpy()
+
+
+def batch_plot(site_ids, model_id, startdate, enddate, storage=None, workers=8):
+    """
+    Overlay of the observed and modeled flows of several stations with a table of their skill.
+
+    Args:
+        site_ids (list): USGS ids, at most MAX_STATIONS.
+        model_id (str): model to compare against.
+        startdate (str): first day, 'YYYY-MM-DD'.
+        enddate (str): last day, 'YYYY-MM-DD'.
+
+    Returns:
+        dict: title, data (plotly traces), layout, metrics (one row per station) and missing (ids without data).
+    """
+    storage = storage or get_storage()
+    site_ids = list(dict.fromkeys(site_ids))
+    info = station_info(site_ids, storage)
+    stations = [(site, *info[site]) for site in site_ids if site in info]
+    keys = {}
+    for site, state, NHD_id in stations:
+        try:
+            keys[site] = ((usgs_key(state, site), USGS_FLOW),
+                          (model_key(model_id, state, NHD_id, site), flow_column(model_id)))
+        except KeyError:
+            continue
+    series = read_all([k for pair in keys.values() for k in pair], storage, workers)
+
+    with span('align'):
+        aligned = align_many(available_pairs(keys, series), startdate, enddate)
+    sites, pairs = list(aligned), list(aligned.values())
+    with span('metrics'):
+        columns = batch_skill(pairs)
+        fdc = batch_fdc(pairs)
+        columns.update({m: fdc[m] for m in FDC_METRICS})
+
+    level = choose_level(startdate, enddate, plot_max_points()) if startdate and enddate else 'day'
+    data, table = [], []
+    for i, (site, aligned) in enumerate(zip(sites, pairs)):
+        color = COLORS[i % len(COLORS)]
+        dates, obs, mod = _periods(aligned, level)
+        x = date_strings(dates)
+        data.append({'name': f"{site} USGS Observed", 'mode': 'lines', 'x': x, 'y': flow_values(obs),
+                     'legendgroup': site, 'line': {'width': 2, 'color': color}})
+        data.append({'name': f"{site} {model_id} Modeled", 'mode': 'lines', 'x': x, 'y': flow_values(mod),
+                     'legendgroup': site, 'line': {'width': 2, 'color': color, 'dash': 'dash'}})
+        row = {'site_id': site, 'state': info[site][0]}
+        for metric in METRICS + FDC_METRICS:
+            v = columns[metric][i]
+            row[metric] = int(v) if metric == 'n' else (round(float(v), 2) if np.isfinite(v) else None)
+        table.append(row)
+
+    period = '' if level == 'day' else f"{LEVEL_NAMES[level]} mean "
+    layout = {'yaxis': {'title': f"{period}Streamflow (cfs)"}, 'xaxis': {'title': 'Date'}}
+    return {
+        'title': f"{model_id} and Observed Streamflow at {len(sites)} USGS sites",
+        'data': data,
+        'layout': layout,
+        'level': level,
+        'metrics': table,
+        'missing': [site for site in site_ids if site not in sites],
+    }
@@ -0,0 +1,333 @@
+"""
+Incremental build of the derived datasets, keyed on the fingerprints of their sources.
+
+The WBD extracts, the pyramids, the series store, the flow matrices and the default view artifacts are each built
+from objects of the bucket that are refreshed as NWIS and the models are rerun. The pipeline splits them into
+partitions, a HU2 region of the WBD extracts, a state of the pyramids, the store, the matrices and the default
+views, lists the storage keys each one reads, and fingerprints them (ETag and size on S3, size and mtime in a local
+mirror). A partition whose sources, parameters and outputs are those of its last build is skipped; the others are
+rebuilt in parallel on a process pool, and recorded in the build manifest as each one finishes, so an interrupted
+run only redoes what it had not finished::
+
+    python -m tethysapp.community_streamflow_evaluation_system.pipeline --states UT AL --models NWM_v2.1 MLP \\
+        --pyramid-output <bucket mirror> --storage-root <bucket mirror>
+
+Every builder puts its outputs in place with renames, a file at a time for the extracts and pyramids and a
+directory at a time for the store and matrices (swap_dir), so a server never reads a half built dataset. The
+default views are composed last, in this process, from the datasets of the first stage.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from .storage import create_storage, is_missing
+from .series import usgs_key, model_keys, configure_hydrofabric_models
+
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'build_manifest.json')
+FORMAT_VERSION = 1
+TARGETS = ('wbd', 'pyramids', 'series_store', 'matrices', 'defaults')
+STREAMSTATS = 'Streamstats/Streamstats.csv'
+#concurrent fingerprint requests, listings are small and latency bound
+FINGERPRINT_THREADS = 32
+
+#per worker process, set by _init_worker
+_storage = None
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'format': FORMAT_VERSION, 'partitions': {}}
+    if manifest.get('format') != FORMAT_VERSION:
+        return {'format': FORMAT_VERSION, 'partitions': {}}
+    return manifest
+
+
+def write_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def fingerprints(keys, storage):
+    """
+    Fingerprint of each key, None for keys missing from storage.
+    """
+    def fingerprint(key):
+        try:
+            return storage.fingerprint(key)
+        except Exception as e:
+            if not is_missing(e):
+                raise
+            return None
+
+    keys = sorted(set(keys))
+    with ThreadPoolExecutor(max_workers=FINGERPRINT_THREADS) as pool:
+        return dict(zip(keys, pool.map(fingerprint, keys)))
+
+
+def _partition(target, name, inputs, params, **args):
+    return {'target': target, 'name': f"{target}/{name}" if name else target, 'inputs': inputs, 'params': params,
+            'args': args}
+
+
+def wbd_partitions(regions, levels, output):
+    return [_partition('wbd', region, [f"WBD/WBD_{region}_HU2_GDB/WBD_{region}_HU2_GDB.gdb"],
+                       {'levels': list(levels), 'output': output}, region=region, levels=list(levels), output=output)
+            for region in regions]
+
+
+def pyramid_partitions(storage, states, models, output):
+    from .pyramids import station_list
+    partitions = []
+    for state in states:
+        geojson = f"GeoJSON/StreamStats_{state}_4326.geojson"
+        try:
+            stations = station_list(storage, [state])
+        except Exception as e:
+            #states without stations
+            if not is_missing(e):
+                raise
+            continue
+        inputs = [geojson] + [usgs_key(state, site) for _, site, _ in stations]
+        for model_id in models:
+            inputs.extend(k for k in model_keys(model_id, [(state, NHD_id, site) for _, site, NHD_id in stations])
+                          if k is not None)
+        partitions.append(_partition('pyramids', state, inputs, {'models': list(models), 'output': output},
+                                     state=state, models=list(models), output=output))
+    return partitions
+
+
+def store_partition(stations, models, output):
+    from .series_store import station_items
+    items = station_items(stations, models)
+    return _partition('series_store', None, [STREAMSTATS] + [key for key, _ in items],
+                      {'models': list(models), 'output': output}, items=items, output=output)
+
+
+def matrix_partition(stations, models, output, start, end):
+    from .series_store import station_items
+    inputs = [STREAMSTATS] + [key for key, _ in station_items(stations, models)]
+    return _partition('matrices', None, inputs, {'models': list(models), 'output': output, 'start': start,
+                                                 'end': end},
+                      stations=stations, models=list(models), output=output, start=start, end=end)
+
+
+def defaults_partition(output):
+    from .artifacts import read_manifest as read_artifacts
+    #the keys the views read are only known from the last build
+    built = read_artifacts(output)
+    return _partition('defaults', None, sorted(built['sources']) if built else [], {'output': output},
+                      output=output)
+
+
+def _init_worker(backend, root, hydrofabric_models):
+    global _storage
+    _storage = create_storage(backend, root)
+    configure_hydrofabric_models(hydrofabric_models)
+
+
+def build_partition(partition, storage=None):
+    """
+    Build a partition in place.
+
+    Returns:
+        list: the output paths, checked for existence by the next runs.
+    """
+    storage = storage or _storage
+    target, args = partition['target'], partition['args']
+    if target == 'wbd':
+        from .wbd import extract_region, extract_path
+        extract_region(storage, args['output'], args['region'], args['levels'])
+        return [p for p in (extract_path(args['output'], d, args['region']) for d in args['levels'])
+                if os.path.exists(p)]
+    if target == 'pyramids':
+        from .pyramids import build_pyramids
+        build_pyramids(storage, args['output'], [args['state']], args['models'])
+        return []
+    if target == 'series_store':
+        from .series_store import build_store
+        build_store(args['output'], args['items'], storage)
+        return [args['output']]
+    if target == 'matrices':
+        from .matrices import build_matrices
+        build_matrices(args['output'], args['stations'], args['models'], storage, args['start'], args['end'])
+        return [args['output']]
+    if target == 'defaults':
+        from .artifacts import build_defaults, MANIFEST_FILE
+        build_defaults(args['output'], storage, force=True)
+        return [os.path.join(args['output'], MANIFEST_FILE)]
+    raise ValueError(f"Unknown build target '{target}', expected one of {', '.join(TARGETS)}")
+
+
+def _timed_build(partition, storage=None):
+    t0 = time.perf_counter()
+    return build_partition(partition, storage), time.perf_counter() - t0
+
+
+def stale(partitions, manifest, storage):
+    """
+    Fingerprint the sources of the partitions and keep the ones to rebuild, each given its `sources`.
+    """
+    current = fingerprints([key for p in partitions for key in p['inputs']], storage)
+    todo = []
+    for partition in partitions:
+        partition['sources'] = {key: current[key] for key in partition['inputs']}
+        built = manifest['partitions'].get(partition['name'])
+        if built is not None and built['sources'] == partition['sources'] and built['params'] == partition['params'] \
+                and all(os.path.exists(p) for p in built['outputs']):
+            continue
+        todo.append(partition)
+    return todo
+
+
+def _record(manifest, path, partition, outputs, seconds):
+    manifest['partitions'][partition['name']] = {
+        'sources': partition['sources'],
+        'params': partition['params'],
+        'outputs': outputs,
+        'built': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'seconds': round(seconds, 3),
+    }
+    write_manifest(path, manifest)
+
+
+def run(stages, manifest_path, backend, root, hydrofabric_models, workers=None, dry_run=False):
+    """
+    Build the stale partitions of each stage, the process pool for all but the default views.
+
+    Args:
+        stages (list): per stage, a function returning its partitions, called once the stage before is built.
+
+    Returns:
+        dict: partitions 'built', 'skipped' and 'failed'.
+    """
+    storage = create_storage(backend, root)
+    manifest = read_manifest(manifest_path)
+    counts = {'built': 0, 'skipped': 0, 'failed': 0}
+    for partitions_of in stages:
+        partitions = partitions_of(storage)
+        todo = stale(partitions, manifest, storage)
+        counts['skipped'] += len(partitions) - len(todo)
+        for partition in todo:
+            built = manifest['partitions'].get(partition['name'])
+            if built is None:
+                reason = 'not built before'
+            else:
+                changed = sum(1 for k, v in partition['sources'].items() if built['sources'].get(k) != v)
+                reason = f"{changed} of {len(partition['sources'])} sources changed"
+            print(f"{'would build' if dry_run else 'building'} {partition['name']}: {reason}")
+        if dry_run or not todo:
+            continue
+
+        #the default views go through the Django views, composed in this process
+        local = [p for p in todo if p['target'] == 'defaults']
+        pooled = [p for p in todo if p['target'] != 'defaults']
+        if pooled:
+            t0 = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_worker,
+                                     initargs=(backend, root, hydrofabric_models)) as pool:
+                futures = {pool.submit(_timed_build, p): p for p in pooled}
+                for future in as_completed(futures):
+                    partition = futures[future]
+                    try:
+                        outputs, seconds = future.result()
+                    except Exception as e:
+                        print(f"{partition['name']} failed: {type(e).__name__}: {e}")
+                        counts['failed'] += 1
+                        continue
+                    _record(manifest, manifest_path, partition, outputs, seconds)
+                    counts['built'] += 1
+                    print(f"{partition['name']} built in {seconds:.0f} s, {time.perf_counter() - t0:.0f} s")
+        for partition in local:
+            try:
+                outputs, seconds = _timed_build(partition, storage)
+            except Exception as e:
+                print(f"{partition['name']} failed: {type(e).__name__}: {e}")
+                counts['failed'] += 1
+                continue
+            #the sources of the views are only known once they have been composed
+            from .artifacts import read_manifest as read_artifacts
+            partition['sources'] = read_artifacts(partition['args']['output'])['sources']
+            _record(manifest, manifest_path, partition, outputs, seconds)
+            counts['built'] += 1
+            print(f"{partition['name']} built in {seconds:.0f} s")
+    return counts
+
+
+def main(argv=None):
+    from .wbd import DEFAULT_WBD_DIR, REGIONS, LEVELS
+    from .series_store import DEFAULT_STORE_DIR
+    from .matrices import DEFAULT_MATRIX_DIR, DEFAULT_START, DEFAULT_END
+    from .artifacts import DEFAULT_ARTIFACT_DIR
+    from .evaluate import select_stations, MODELS
+
+    parser = argparse.ArgumentParser(description='Rebuild the derived datasets whose sources changed.')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--states', nargs='+', help='state ids, e.g. UT AL, defaults to every state')
+    parser.add_argument('--models', nargs='+', default=MODELS)
+    parser.add_argument('--regions', nargs='+', default=REGIONS, help='HU2 regions of the WBD extracts')
+    parser.add_argument('--levels', nargs='+', type=int, default=LEVELS, help='HUC digits of the WBD extracts')
+    parser.add_argument('--start', default=DEFAULT_START, help='first day of the matrices, YYYY-MM-DD')
+    parser.add_argument('--end', default=DEFAULT_END, help='last day of the matrices, YYYY-MM-DD')
+    parser.add_argument('--wbd-output', default=DEFAULT_WBD_DIR)
+    parser.add_argument('--pyramid-output', help='directory to write the pyramid keys under, e.g. the bucket mirror; '
+                                                 'pyramids are not built without it')
+    parser.add_argument('--store-output', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--matrix-output', default=DEFAULT_MATRIX_DIR)
+    parser.add_argument('--defaults-output', default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='build manifest')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--workers', type=int, help='processes, defaults to the CPU count')
+    parser.add_argument('--dry-run', action='store_true', help='list the partitions to rebuild and stop')
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+
+    backend, root = ('local', args.storage_root) if args.storage_root else ('s3', None)
+    configure_hydrofabric_models(args.hydrofabric_models)
+    targets = set(args.targets)
+    if 'pyramids' in targets and not args.pyramid_output:
+        print('pyramids skipped, no --pyramid-output')
+        targets.discard('pyramids')
+
+    def first_stage(storage):
+        stations = select_stations(storage, args.states)
+        states = args.states or sorted({state for _, state, _ in stations})
+        partitions = []
+        if 'wbd' in targets:
+            partitions += wbd_partitions(args.regions, args.levels, args.wbd_output)
+        if 'pyramids' in targets:
+            partitions += pyramid_partitions(storage, states, args.models, args.pyramid_output)
+        if 'series_store' in targets:
+            partitions.append(store_partition(stations, args.models, args.store_output))
+        if 'matrices' in targets:
+            partitions.append(matrix_partition(stations, args.models, args.matrix_output, args.start, args.end))
+        return partitions
+
+    def second_stage(storage):
+        if 'defaults' not in targets:
+            return []
+        import django
+        django.setup()
+        from .pyramids import configure_plot_max_points
+        from .storage import configure_storage
+        configure_storage(storage)
+        configure_plot_max_points(500)
+        return [defaults_partition(args.defaults_output)]
+
+    counts = run([first_stage, second_stage], args.manifest, backend, root, args.hydrofabric_models, args.workers,
+                 args.dry_run)
+    print(f"{counts['built']} partitions built, {counts['skipped']} unchanged, {counts['failed']} failed")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
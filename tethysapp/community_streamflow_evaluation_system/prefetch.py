@@ -0,0 +1,256 @@
+"""
+Predictive prefetch of the station series of a composed map.
+
+After a map is composed the next requests are clicks on a few of its stations, each one reading the NWIS and
+model series of the station. With the prefetch app setting on, the stations of a composed map are queued for a
+background thread that reads their series into the series cache (cache.py), so the clicks find them warm.
+
+The queue is a priority heap: stations plotted most often in this worker first, then the stations closest to the
+middle of the map. Every map a session composes starts a new generation for the session, and the queued stations
+of older generations are dropped, so changing the selection cancels the prefetch of the previous one. The thread
+only reads while no foreground request of the worker is running.
+"""
+import heapq
+import itertools
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from .series import read_series, usgs_key, model_key, flow_column, USGS_FLOW
+from .pyramids import read_pyramid, pyramid_key, choose_level, plot_max_points
+from .query import defaults
+
+
+log = logging.getLogger(f"tethys.{__name__}")
+MAX_SESSIONS = 1024
+
+_settings = None
+
+
+def configure_prefetch(enabled, max_stations=20):
+    """
+    Turn the prefetch on or off for this process, e.g. from the benchmark suite, instead of the app settings.
+    """
+    global _settings
+    _settings = (enabled, max_stations)
+
+
+def prefetch_settings():
+    """
+    The prefetch and prefetch_max_stations app settings.
+
+    Returns:
+        bool, int: whether to prefetch, and the stations queued per composed map.
+    """
+    global _settings
+    if _settings is None:
+        from tethys_apps.exceptions import TethysAppSettingDoesNotExist
+        from .app import CSES as app
+        try:
+            _settings = (bool(app.get_custom_setting('prefetch')),
+                         app.get_custom_setting('prefetch_max_stations') or 20)
+        except TethysAppSettingDoesNotExist as e:
+            #apps installed before the prefetch settings were added
+            log.warning(f"prefetch is off: {e}")
+            _settings = (False, 0)
+    return _settings
+
+
+def prefetch_station(props):
+    """
+    Read what a click on a station reads: its observed and modeled series, plus its pyramid for windows longer
+    than the plot width.
+    """
+    state, site_id, NHD_id = props.get('state'), props.get('id'), props.get('NHD_id')
+    #the default layers carry no model, their plots are of the default plot model
+    model_id = props.get('model_id') or defaults('plot')['model_id']
+    startdate, enddate = props.get('startdate'), props.get('enddate')
+    if props.get('model_id') and startdate and enddate and choose_level(startdate, enddate, plot_max_points()) != 'day':
+        read_pyramid(pyramid_key(model_id, state, NHD_id, site_id))
+    read_series(usgs_key(state, site_id), USGS_FLOW)
+    read_series(model_key(model_id, state, NHD_id, site_id), flow_column(model_id))
+
+
+class Prefetcher:
+    """
+    Priority queue of stations to prefetch and the background thread draining it.
+
+    Args:
+        load (callable): reads the series of a station from its feature properties.
+        max_stations (int): stations queued per composed map.
+    """
+
+    def __init__(self, load=prefetch_station, max_stations=20):
+        self.load = load
+        self.max_stations = max_stations
+        self.popularity = Counter()
+        self.loaded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._generations = OrderedDict()
+        self._foreground = 0
+        self._loading = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @contextmanager
+    def foreground(self):
+        """
+        Mark a foreground request as running, the prefetch waits for it.
+        """
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def clicked(self, site_id):
+        if site_id:
+            self.popularity[site_id] += 1
+
+    def order(self, stations):
+        """
+        Stations by popularity, then by distance to the middle of the map.
+        """
+        coords = np.array([s.get('coordinates') or (np.nan, np.nan) for s in stations], dtype=float)
+        center = np.nanmean(coords, axis=0) if np.isfinite(coords).any() else np.zeros(2)
+        distance = np.nan_to_num(np.hypot(*(coords - center).T), nan=np.inf)
+        return sorted(range(len(stations)), key=lambda i: (-self.popularity[stations[i].get('id')], distance[i]))
+
+    def schedule(self, session, stations):
+        """
+        Queue the stations of a composed map for `session`, cancelling what was queued for its previous map.
+
+        Args:
+            session (str): session key, or the client address.
+            stations (list<dict>): feature properties with 'coordinates' of the point.
+
+        Returns:
+            int: the generation of the session.
+        """
+        with self._cond:
+            generation = self._generations.pop(session, 0) + 1
+            self._generations[session] = generation
+            while len(self._generations) > MAX_SESSIONS:
+                self._generations.popitem(last=False)
+            #drop the stale entries now rather than when they are popped, keeps the heap bounded
+            live = [item for item in self._heap if self._generations.get(item[3]) == item[4]]
+            self.cancelled += len(self._heap) - len(live)
+            self._heap = live
+            heapq.heapify(self._heap)
+            for rank, i in enumerate(self.order(stations)[:self.max_stations]):
+                station = stations[i]
+                heapq.heappush(self._heap, (-self.popularity[station.get('id')], rank, next(self._seq), session,
+                                            generation, station))
+            self._ensure_thread()
+            self._cond.notify_all()
+        return generation
+
+    def cancel(self, session):
+        with self._cond:
+            self._generations[session] = self._generations.get(session, 0) + 1
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for item in self._heap if self._generations.get(item[3]) == item[4])
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='cses-prefetch', daemon=True)
+            self._thread.start()
+
+    def drain(self, timeout=None):
+        """
+        Wait until the queue is empty and nothing is loading.
+
+        Returns:
+            bool: False if `timeout` seconds passed first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._loading and not self._heap, timeout)
+
+    def _next(self):
+        with self._cond:
+            self._loading = False
+            self._cond.notify_all()
+            while True:
+                while not self._heap or self._foreground:
+                    self._cond.wait()
+                item = heapq.heappop(self._heap)
+                if self._generations.get(item[3]) == item[4]:
+                    self._loading = True
+                    return item[5]
+                self.cancelled += 1
+
+    def _run(self):
+        while True:
+            station = self._next()
+            try:
+                self.load(station)
+                self.loaded += 1
+            except Exception:
+                self.failed += 1
+
+    def stats(self):
+        return {'pending': self.pending(), 'loaded': self.loaded, 'failed': self.failed,
+                'cancelled': self.cancelled, 'sessions': len(self._generations)}
+
+
+PREFETCHER = Prefetcher()
+
+
+def session_key(request):
+    session = getattr(request, 'session', None)
+    key = getattr(session, 'session_key', None)
+    return key or request.META.get('REMOTE_ADDR', '')
+
+
+def layer_stations(layer_groups):
+    """
+    Feature properties, with the point coordinates, of the plottable layers of a composed map.
+    """
+    stations = []
+    for group in layer_groups:
+        for layer in group['layers']:
+            if not (layer.get('data') or {}).get('plottable'):
+                continue
+            for feature in layer['options'].get('features', []):
+                props = dict(feature.get('properties') or {})
+                props['coordinates'] = (feature.get('geometry') or {}).get('coordinates')
+                stations.append(props)
+    return stations
+
+
+class PrefetchMixin:
+    """
+    Mixin for the MapLayout views, queues the stations of every composed map for prefetch, counts the stations
+    plotted, and holds the prefetch while a request is being handled.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with PREFETCHER.foreground():
+            return super().dispatch(request, *args, **kwargs)
+
+    def get_context(self, request, context, *args, **kwargs):
+        context = super().get_context(request, context, *args, **kwargs)
+        enabled, max_stations = prefetch_settings()
+        if enabled:
+            PREFETCHER.max_stations = max_stations
+            PREFETCHER.schedule(session_key(request), layer_stations(context.get('layer_groups', [])))
+        return context
+
+    def get_plot_data(self, request, *args, **kwargs):
+        try:
+            PREFETCHER.clicked(json.loads(request.POST.get('feature_props', '{}')).get('id'))
+        except (ValueError, AttributeError):
+            pass
+        return super().get_plot_data(request, *args, **kwargs)
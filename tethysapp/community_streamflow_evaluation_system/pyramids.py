@@ -0,0 +1,337 @@
+"""
+Aggregate pyramids of the observed/modeled pairs, for plotting long windows.
+
+For every site and model the paired daily flows are summarized per week, month and water year (Oct 1 - Sep 30):
+mean/min/max of both series for the plot, plus the paired sums that RMSE, r, KGE and bias are computed from, so
+skill over any run of whole periods can be merged from the rows without the daily data. The skill in the plot title
+and the flow duration curves beside it are the exception: the periods at the edges of a window run past it and
+exceedance quantiles do not merge across periods, so both are computed from the daily series of the window, which
+are read but not plotted.
+
+One parquet file per site and model is stored next to the model series::
+
+    {model}/NHD_segments_{state}.h5/pyramids/{model}_{NHD_id}_{site}.parquet
+
+Build them from the bucket (or a local mirror) with::
+
+    python -m tethysapp.community_streamflow_evaluation_system.pyramids --output <bucket mirror> --states UT AL
+"""
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .storage import get_storage, create_storage, is_missing
+from .timing import span
+from .series import read_series, usgs_key, model_key, flow_column, date_strings, flow_values, USGS_FLOW, \
+    configure_hydrofabric_models
+from .alignment import align
+from .cache import SERIES
+from .metrics import SUMS, skill_from_sums, stats_from_sums
+from .rolling import add_rolling, pyramid_sums
+from .fdc import add_fdc
+from .query import plot_skill
+
+
+#coarser levels after the daily series
+LEVELS = ('week', 'month', 'water_year')
+#average days per period, estimates how many points a window has at each level
+LEVEL_DAYS = {'day': 1.0, 'week': 7.0, 'month': 30.44, 'water_year': 365.25}
+LEVEL_NAMES = {'week': 'Weekly', 'month': 'Monthly', 'water_year': 'Water year'}
+#levels of the skill summary
+SUMMARY_LEVELS = ('month', 'water_year')
+
+MODELS = ['NWM_v2.1', 'NWM_v3.0', 'MLP', 'XGBoost', 'CNN', 'LSTM']
+
+
+def pyramid_key(model_id, state, NHD_id, site_id):
+    return f"{model_id}/NHD_segments_{state}.h5/pyramids/{model_id}_{NHD_id}_{site_id}.parquet"
+
+
+def period_starts(dates, level):
+    """
+    First day of the week (Monday), month or water year (Oct 1) each date falls in.
+    """
+    if level == 'week':
+        return dates.to_period('W-SUN').start_time
+    if level == 'month':
+        return dates.to_period('M').start_time
+    if level == 'water_year':
+        start_year = dates.year - (dates.month < 10)
+        return pd.to_datetime(pd.DataFrame({'year': start_year, 'month': 10, 'day': 1}))
+    raise ValueError(f"Unknown pyramid level '{level}', expected one of {', '.join(LEVELS)}")
+
+
+def build_pyramid(aligned):
+    """
+    Summarize an aligned pair at every level.
+
+    Args:
+        aligned (alignment.Aligned): paired daily flows, days missing either value are left out.
+
+    Returns:
+        pd.DataFrame: one row per level and period start, with n, obs_/mod_ mean, min, max and the paired sums
+        obs_sum, mod_sum, obs_sq, mod_sq, obs_mod, err_sq and err_abs_max.
+    """
+    obs = np.asarray(aligned.obs, dtype=np.float64)
+    mod = np.asarray(aligned.mod, dtype=np.float64)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    df = pd.DataFrame({'obs': obs[ok], 'mod': mod[ok]}, index=aligned.dates[ok])
+    df['obs_sq'] = df.obs ** 2
+    df['mod_sq'] = df['mod'] ** 2
+    df['obs_mod'] = df.obs * df['mod']
+    df['err_sq'] = (df['mod'] - df.obs) ** 2
+    df['err_abs'] = (df['mod'] - df.obs).abs()
+
+    frames = []
+    for level in LEVELS:
+        g = df.groupby(np.asarray(period_starts(df.index, level)))
+        out = pd.DataFrame({
+            'n': g.size(),
+            'obs_mean': g.obs.mean(),
+            'obs_min': g.obs.min(),
+            'obs_max': g.obs.max(),
+            'mod_mean': g['mod'].mean(),
+            'mod_min': g['mod'].min(),
+            'mod_max': g['mod'].max(),
+            'obs_sum': g.obs.sum(),
+            'mod_sum': g['mod'].sum(),
+            'obs_sq': g.obs_sq.sum(),
+            'mod_sq': g.mod_sq.sum(),
+            'obs_mod': g.obs_mod.sum(),
+            'err_sq': g.err_sq.sum(),
+            'err_abs_max': g.err_abs.max(),
+        })
+        out.index.name = 'start'
+        out.insert(0, 'level', level)
+        frames.append(out.reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_pyramid(key, storage=None):
+    """
+    A stored pyramid, None when it has not been built for this site and model, other read errors are raised.
+    Pyramids are kept in the worker's series cache.
+    """
+    storage = storage or get_storage()
+
+    def load():
+        data = storage.read_bytes(key)
+        with span('parquet_read'):
+            return pd.read_parquet(io.BytesIO(data))
+    try:
+        return SERIES.get((storage, key), load)
+    except Exception as e:
+        if not is_missing(e):
+            raise
+        return None
+
+
+def choose_level(startdate, enddate, max_points):
+    """
+    Finest level at which the window fits in `max_points` points, 'day' when the daily series does.
+    """
+    days = (pd.Timestamp(enddate) - pd.Timestamp(startdate)).days + 1
+    for level in ('day',) + LEVELS:
+        if days / LEVEL_DAYS[level] <= max_points:
+            return level
+    return LEVELS[-1]
+
+
+def level_rows(pyramid, level, startdate=None, enddate=None):
+    """
+    Rows of one level whose periods overlap the window, ordered by period start.
+    """
+    rows = pyramid[pyramid['level'] == level].sort_values('start')
+    starts = rows['start'].to_numpy()
+    i = starts.searchsorted(np.asarray(period_starts(pd.DatetimeIndex([startdate]), level))[0]) if startdate else 0
+    j = starts.searchsorted(pd.Timestamp(enddate).to_datetime64(), side='right') if enddate else len(rows)
+    return rows.iloc[i:j]
+
+
+def skill(rows):
+    """
+    Skill over the paired days of `rows`, merged from their sums, see metrics.stats_from_sums.
+    """
+    sums = rows[SUMS].to_numpy(dtype=np.float64).sum(axis=0)
+    return stats_from_sums(sums, rows['err_abs_max'].max() if len(rows) else np.nan)
+
+
+def _json_number(v):
+    return None if not np.isfinite(v) else round(float(v), 4)
+
+
+def skill_summary(pyramid, level='water_year', startdate=None, enddate=None):
+    """
+    Skill per month or water year, computed for all periods at once from their sums.
+
+    Returns:
+        list<dict>: one entry per period with its start date, n, r2, rmse, maxerror, r, kge and pbias.
+    """
+    rows = level_rows(pyramid, level, startdate, enddate)
+    columns = skill_from_sums(*rows[SUMS].to_numpy(dtype=np.float64).T)
+    columns['maxerror'] = rows['err_abs_max'].to_numpy()
+    starts = date_strings(pd.DatetimeIndex(rows['start']))
+    return [
+        dict({k: _json_number(v[i]) for k, v in columns.items()}, start=starts[i], n=int(rows['n'].iloc[i]))
+        for i in range(len(rows))
+    ]
+
+
+_max_points = None
+
+
+def configure_plot_max_points(max_points):
+    """
+    Set the plot width in points for this process, e.g. from the benchmark suite, instead of the app setting.
+    """
+    global _max_points
+    _max_points = max_points
+
+
+def plot_max_points():
+    """
+    The plot_max_points app setting, points per trace before a plot is drawn from the pyramids.
+    """
+    global _max_points
+    if _max_points is None:
+        from .app import CSES as app
+        _max_points = app.get_custom_setting('plot_max_points') or 500
+    return _max_points
+
+
+def pyramid_plot(site_id, NHD_id, state, model_id, startdate, enddate, layout):
+    """
+    Title, traces and layout of a long window plotted from the pyramid of a site and model.
+
+    Returns None when the daily series fit the plot width, or the pyramid has not been built, and the daily
+    series are plotted instead.
+    """
+    if not (model_id and startdate and enddate):
+        return None
+    level = choose_level(startdate, enddate, plot_max_points())
+    if level == 'day':
+        return None
+    pyramid = read_pyramid(pyramid_key(model_id, state, NHD_id, site_id))
+    if pyramid is None:
+        return None
+
+    rows = level_rows(pyramid, level, startdate, enddate)
+    x = date_strings(pd.DatetimeIndex(rows['start']))
+    #the title skill and the flow duration curves, from the days of the window
+    obs = read_series(usgs_key(state, site_id), USGS_FLOW)
+    mod = read_series(model_key(model_id, state, NHD_id, site_id), flow_column(model_id))
+    aligned = align(obs, mod, startdate, enddate)
+    with span('metrics'):
+        title_skill = plot_skill(aligned)
+    name = LEVEL_NAMES[level]
+    data = [
+        {
+            'name': f"USGS Observed {name.lower()} range",
+            'x': x + x[::-1],
+            'y': flow_values(rows['obs_max']) + flow_values(rows['obs_min'])[::-1],
+            'fill': 'toself',
+            'fillcolor': 'rgba(0, 0, 255, 0.15)',
+            'line': {'width': 0},
+            'hoverinfo': 'skip',
+        },
+        {
+            'name': f"USGS Observed {name.lower()} mean",
+            'mode': 'lines',
+            'x': x,
+            'y': flow_values(rows['obs_mean']),
+            'line': {'width': 2, 'color': 'blue'},
+        },
+        {
+            'name': f"{model_id} Modeled {name.lower()} mean",
+            'mode': 'lines',
+            'x': x,
+            'y': flow_values(rows['mod_mean']),
+            'line': {'width': 2, 'color': 'red'},
+        },
+    ]
+    title = f"{model_id} and Observed Streamflow at USGS site: {site_id} ({name} means) <br> {title_skill}"
+    with span('rolling'):
+        add_rolling(data, layout, *pyramid_sums(pyramid), startdate, enddate, plot_max_points())
+    with span('fdc'):
+        add_fdc(data, layout, aligned, model_id)
+    return title, data, layout
+
+
+def station_list(storage, states):
+    """
+    (state, USGS id, NHD id) of every station in the state GeoJSONs.
+    """
+    stations = []
+    for state in states:
+        geojson = json.loads(storage.read_bytes(f"GeoJSON/StreamStats_{state}_4326.geojson"))
+        for feature in geojson['features']:
+            props = feature['properties']
+            stations.append((state, props['USGS_id'], props['NHD_id']))
+    return stations
+
+
+def build_pyramids(storage, output, states, models=MODELS):
+    """
+    Build and write the pyramid of every station and model with data.
+
+    Args:
+        storage (Storage): where the series are read from.
+        output (str): directory the pyramid keys are written under, e.g. the local bucket mirror.
+        states (list): state ids.
+        models (list): model ids.
+
+    Returns:
+        int: number of pyramids written.
+    """
+    count = 0
+    for state, site_id, NHD_id in station_list(storage, states):
+        try:
+            obs = read_series(usgs_key(state, site_id), USGS_FLOW, storage)
+        except Exception as e:
+            #stations without an observed or modeled series have no pyramid
+            if not is_missing(e):
+                raise
+            continue
+        for model_id in models:
+            try:
+                mod = read_series(model_key(model_id, state, NHD_id, site_id), flow_column(model_id), storage)
+            except Exception as e:
+                if not is_missing(e):
+                    raise
+                continue
+            path = os.path.join(output, *pyramid_key(model_id, state, NHD_id, site_id).split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            #replaced in one rename, a server reading the mirror never sees a partial file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            build_pyramid(align(obs, mod)).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the weekly/monthly/water-year pyramids of every station.')
+    parser.add_argument('--output', required=True, help='directory to write the pyramid keys under')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--states', nargs='+', help='state ids, defaults to every state in Streamstats.csv')
+    parser.add_argument('--models', nargs='+', default=MODELS)
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+    configure_hydrofabric_models(args.hydrofabric_models)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    states = args.states
+    if not states:
+        streamstats = pd.read_csv(storage.open('Streamstats/Streamstats.csv'), usecols=['state_id'])
+        states = sorted(streamstats['state_id'].dropna().unique())
+    count = build_pyramids(storage, args.output, states, args.models)
+    print(f"{count} pyramids written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
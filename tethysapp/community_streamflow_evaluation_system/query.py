@@ -0,0 +1,280 @@
+"""
+Typed, validated query of the map views.
+
+The views used to read their GET parameters inside a bare ``except:`` that fell back to the default layers on any
+error, so a mistyped HUC or date paid for a second, default round of storage and geometry work and the error was
+never shown. parse_query checks the whole query before any work is done: dates parsed once, site ids normalized to
+the Streamstats form, states and HUC codes checked, the model one of Model. A bad query is answered at once with a
+400 naming the parameter; a query without any parameter is the default view, whose stations and windows are read
+from the defaults.json of the app workspace.
+"""
+import enum
+import json
+import os
+import re
+from datetime import datetime
+
+from django.http import JsonResponse
+
+from .artifacts import default_layer
+from .metrics import aligned_skill, skill_title
+from .storage import is_missing
+from .wbd import REGIONS
+
+
+DEFAULTS_FILE = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'defaults.json')
+#the date pickers' format, and ISO dates
+DATE_FORMATS = ('%m-%d-%Y', '%Y-%m-%d')
+HUC_LEVELS = (2, 4, 6, 8, 10, 12)
+
+_defaults = None
+
+
+class Model(str, enum.Enum):
+    """
+    Models the views can evaluate.
+    """
+    NWM_V21 = 'NWM_v2.1'
+    NWM_V30 = 'NWM_v3.0'
+    MLP = 'MLP'
+    XGBOOST = 'XGBoost'
+    CNN = 'CNN'
+    LSTM = 'LSTM'
+    NEXTGEN = 'NextGen'
+
+
+class QueryError(ValueError):
+    """
+    Invalid query parameter, answered with `status` and the parameter's name.
+    """
+
+    def __init__(self, field, message, status=400):
+        super().__init__(f"{field}: {message}")
+        self.field = field
+        self.message = message
+        self.status = status
+
+    def response(self):
+        return JsonResponse({'error': self.message, 'field': self.field}, status=self.status)
+
+
+def plot_skill(aligned):
+    """
+    Title skill of a plotted pair, from metrics.aligned_skill on its flows, the numbers the API and cses-evaluate
+    report for the same window. A pair without paired days is answered with a 404.
+    """
+    if not len(aligned):
+        raise QueryError('startdate', 'no paired observed/modeled days in this window', status=404)
+    return skill_title(aligned_skill(aligned))
+
+
+class Query:
+    """
+    Validated parameters of a map view request.
+
+    Args:
+        startdate (str): first day, 'YYYY-MM-DD'.
+        enddate (str): last day, 'YYYY-MM-DD'.
+        model_id (Model): model to evaluate.
+        selection: the view's stations, site ids, a state id, HUC codes or an outlet id.
+    """
+
+    def __init__(self, startdate, enddate, model_id, selection):
+        self.startdate = startdate
+        self.enddate = enddate
+        self.model_id = model_id
+        self.selection = selection
+
+    def __repr__(self):
+        return f"Query({self.startdate}, {self.enddate}, {self.model_id.value}, {self.selection!r})"
+
+
+def _values(value):
+    #the views' inputs come as 'a, b' or '[a, b]'
+    return [v.strip().strip('\'"') for v in re.split(r'[,\s]+', (value or '').strip().strip('][')) if v.strip()]
+
+
+def parse_date(field, value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise QueryError(field, f"'{value}' is not a date, expected MM-DD-YYYY or YYYY-MM-DD")
+
+
+def parse_model(value, field='model_id'):
+    try:
+        return Model(value.strip())
+    except ValueError:
+        raise QueryError(field, f"unknown model '{value}', expected one of {[m.value for m in Model]}")
+
+
+def parse_sites(value, field='reach_ids'):
+    """
+    USGS site ids, the ids Streamstats.csv lost their leading 0 from padded back to 8 digits.
+    """
+    sites = []
+    for site in _values(value):
+        if not site.isdigit() or not 7 <= len(site) <= 15:
+            raise QueryError(field, f"'{site}' is not a USGS site id")
+        sites.append(site.zfill(8))
+    if not sites:
+        raise QueryError(field, 'no site ids')
+    return list(dict.fromkeys(sites))
+
+
+def parse_state(value, field='state_id'):
+    state = value.strip().upper()
+    if not re.fullmatch('[A-Z]{2}', state):
+        raise QueryError(field, f"'{value}' is not a two letter state id")
+    return state
+
+
+def parse_hucs(value, field='huc_ids'):
+    """
+    HUC codes of one level, as the HUC view selects them.
+    """
+    hucs = list(dict.fromkeys(_values(value)))
+    if not hucs or not all(h.isdigit() and len(h) in HUC_LEVELS for h in hucs):
+        raise QueryError(field, f"expected HUC codes of {', '.join(map(str, HUC_LEVELS))} digits")
+    if len({len(h) for h in hucs}) != 1:
+        raise QueryError(field, 'HUC codes must all be of one level')
+    unknown = [h for h in hucs if h[:2] not in REGIONS]
+    if unknown:
+        raise QueryError(field, f"{unknown} are not in the HU2 regions 01 to 22")
+    return hucs
+
+
+def parse_outlet(value, field='outlet_id'):
+    outlet = value.strip()
+    if not outlet:
+        raise QueryError(field, 'no outlet id')
+    return outlet
+
+
+def parse_feature(props):
+    """
+    The station and window of a clicked station's properties, which come back from the client as it sent them.
+
+    Args:
+        props (dict): the feature's properties, id, NHD_id and state, and startdate, enddate and model_id but for
+            the default layers.
+
+    Returns:
+        tuple: site id, NHD id, state, startdate, enddate and model id, each None when absent from the default layers.
+    """
+    site_id = parse_sites(str(props.get('id') or ''), 'id')[0]
+    state = parse_state(str(props.get('state') or ''), 'state')
+    NHD_id = props.get('NHD_id')
+    if NHD_id is not None and not str(NHD_id).isdigit():
+        raise QueryError('NHD_id', f"'{NHD_id}' is not an NHD reach id")
+    startdate, enddate = [parse_date(f, props[f]) if props.get(f) else None for f in ('startdate', 'enddate')]
+    if startdate and enddate and enddate < startdate:
+        raise QueryError('enddate', 'ends before startdate')
+    model_id = parse_model(props['model_id']).value if props.get('model_id') else None
+    if model_id and NHD_id is None:
+        raise QueryError('NHD_id', 'missing NHD reach id')
+    return site_id, NHD_id, state, startdate, enddate, model_id
+
+
+#GET parameter of each view's stations and its parser
+SELECTORS = {
+    'reach_ids': parse_sites,
+    'state_id': parse_state,
+    'huc_ids': parse_hucs,
+    'outlet_id': parse_outlet,
+}
+
+
+def parse_query(params, selector):
+    """
+    The validated query of a map view.
+
+    Args:
+        params (QueryDict): the request's GET parameters.
+        selector (str): the view's station parameter, a key of SELECTORS.
+
+    Returns:
+        Query: None when the request has none of the parameters, the default view.
+    """
+    fields = ('start-date', 'end-date', 'model_id', selector)
+    if not any(params.get(f) for f in fields):
+        return None
+    missing = [f for f in fields if not params.get(f)]
+    if missing:
+        raise QueryError(missing[0], 'missing parameter')
+    startdate = parse_date('start-date', _values(params['start-date'])[0])
+    enddate = parse_date('end-date', _values(params['end-date'])[0])
+    if enddate < startdate:
+        raise QueryError('end-date', 'ends before start-date')
+    model_id = parse_model(_values(params['model_id'])[0])
+    return Query(startdate, enddate, model_id, SELECTORS[selector](params[selector]))
+
+
+def defaults(view):
+    """
+    The default configuration of a view ('reach', 'huc', 'state', 'network' or 'plot') from defaults.json.
+    """
+    global _defaults
+    if _defaults is None:
+        with open(DEFAULTS_FILE) as f:
+            _defaults = json.load(f)
+    return _defaults[view]
+
+
+class QueryMixin:
+    """
+    Mixin for the MapLayout views, validates the query before any layer is composed and answers errors with a
+    structured JSON response: 400 for bad parameters, 404 for stations or series that do not exist.
+
+    Attributes:
+        selector (str): the view's station parameter, a key of SELECTORS.
+    """
+    selector = None
+
+    def query(self, request):
+        """
+        The validated query of the request, parsed once. Raises QueryError.
+        """
+        if not hasattr(request, 'cses_query'):
+            request.cses_query = parse_query(request.GET, self.selector)
+        return request.cses_query
+
+    def materialized_layers(self, view, map_view):
+        """
+        Layer groups of a default view from its materialized artifact, None when none was built.
+        """
+        layer = default_layer(view)
+        if layer is None:
+            return None
+        map_view['view']['extent'] = list(layer['extent'])
+        stations_layer = self.build_geojson_layer(
+            geojson=layer['geojson'],
+            layer_name='USGS Stations',
+            layer_title='USGS Station',
+            layer_variable='stations',
+            visible=True,
+            selectable=True,
+            plottable=True,
+        )
+        return [self.build_layer_group(id='nextgen-features', display_name='NextGen Features',
+                                       layer_control='checkbox', layers=[stations_layer], visible=True)]
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.query(request)
+            return super().dispatch(request, *args, **kwargs)
+        except QueryError as e:
+            return e.response()
+
+    def get_plot_data(self, request, *args, **kwargs):
+        try:
+            return super().get_plot_data(request, *args, **kwargs)
+        except QueryError as e:
+            return e.response()
+        except Exception as e:
+            if is_missing(e):
+                return JsonResponse({'error': 'no observed or modeled series for this station and model',
+                                     'field': 'feature_props'}, status=404)
+            raise
@@ -0,0 +1,120 @@
+"""
+Rolling skill timeline under the hydrograph.
+
+One RMSE or KGE for a whole window hides when a model drifts, e.g. the snowmelt seasons. The station plots add
+stacked panels of the NSE and KGE, the RMSE and the percent bias over trailing windows of the rolling_windows app
+setting (30, 90 and 365 days by default), sharing the hydrograph's date axis. The windows are computed over the
+whole paired record with metrics.rolling_skill, so the first days of the plotted window have full windows too and
+a 40 year daily record costs one pass; long windows plotted from a pyramid use its weekly sums instead of the daily
+series.
+"""
+import numpy as np
+import pandas as pd
+
+from .alignment import day_numbers
+from .metrics import paired_sums, rolling_skill, SUMS
+
+
+#panels under the hydrograph, top to bottom: y axis title and metrics
+PANELS = [
+    ('NSE / KGE', ['nse', 'kge']),
+    ('RMSE (cfs)', ['rmse']),
+    ('Bias (%)', ['pbias']),
+]
+METRIC_NAMES = {'nse': 'NSE', 'kge': 'KGE', 'rmse': 'RMSE', 'pbias': 'Bias'}
+METRIC_COLORS = {'nse': 'green', 'kge': 'purple', 'rmse': 'darkorange', 'pbias': 'saddlebrown'}
+#one dash per window, shortest first
+DASHES = ['dot', 'dash', 'solid', 'dashdot', 'longdash']
+#share of the plot height kept by the hydrograph
+HYDROGRAPH_SHARE = 0.5
+PANEL_GAP = 0.04
+
+_windows = None
+
+
+def configure_rolling_windows(windows):
+    """
+    Set the rolling windows in days for this process, e.g. from the benchmark suite, instead of the app setting.
+    An empty list turns the panels off.
+    """
+    global _windows
+    _windows = tuple(sorted(int(w) for w in windows))
+
+
+def rolling_windows():
+    """
+    Days of each rolling window, from the rolling_windows app setting (comma separated).
+    """
+    global _windows
+    if _windows is None:
+        from .app import CSES as app
+        setting = app.get_custom_setting('rolling_windows') or ''
+        _windows = tuple(sorted(int(w) for w in setting.split(',') if w.strip()))
+    return _windows
+
+
+def daily_sums(aligned):
+    """
+    Day numbers and paired sums of the days of an aligned pair.
+    """
+    ok, sums = paired_sums(aligned.obs, aligned.mod)
+    return day_numbers(aligned.dates)[ok], sums
+
+
+def pyramid_sums(pyramid):
+    """
+    Day numbers and paired sums of the weeks of a pyramid, dated by their Monday.
+    """
+    rows = pyramid[pyramid['level'] == 'week'].sort_values('start')
+    return day_numbers(pd.DatetimeIndex(rows['start'])), rows[SUMS].to_numpy(dtype=np.float64).T
+
+
+def _json_values(values):
+    return [None if not np.isfinite(v) else round(float(v), 4) for v in values]
+
+
+def add_rolling(data, layout, days, sums, startdate, enddate, max_points):
+    """
+    Add the rolling skill panels of the rows (days, sums) to a plot, evaluated at the rows of the plotted window.
+
+    Args:
+        data (list): traces of the hydrograph, extended in place.
+        layout (dict): layout of the hydrograph, given a y axis per panel in place.
+        startdate (str): first plotted day, None for the start of the record.
+        enddate (str): last plotted day, None for the end of the record.
+        max_points (int): points per trace, the rows are thinned to it.
+    """
+    windows = rolling_windows()
+    if not windows or not len(days):
+        return
+    lo = days.searchsorted(day_numbers(pd.DatetimeIndex([startdate]))[0]) if startdate else 0
+    hi = days.searchsorted(day_numbers(pd.DatetimeIndex([enddate]))[0], side='right') if enddate else len(days)
+    shown = np.arange(lo, hi)[::max(1, -(-(hi - lo) // max_points))]
+    if not len(shown):
+        return
+    x = (days[shown].astype('datetime64[D]')).astype(str).tolist()
+
+    #the hydrograph on top, the panels stacked below it on the shared date axis
+    height = (1.0 - HYDROGRAPH_SHARE - PANEL_GAP * len(PANELS)) / len(PANELS)
+    layout.setdefault('yaxis', {})['domain'] = [1.0 - HYDROGRAPH_SHARE, 1.0]
+    for i, (title, _) in enumerate(PANELS):
+        top = 1.0 - HYDROGRAPH_SHARE - PANEL_GAP - i * (height + PANEL_GAP)
+        layout[f"yaxis{i + 2}"] = {'title': title, 'domain': [round(max(top - height, 0.0), 4), round(top, 4)],
+                                   'anchor': 'x'}
+    layout.setdefault('xaxis', {})['anchor'] = f"y{len(PANELS) + 1}"
+
+    for k, window in enumerate(windows):
+        dash = DASHES[k % len(DASHES)]
+        columns = rolling_skill(days, sums, window)
+        for i, (_, metrics) in enumerate(PANELS):
+            for metric in metrics:
+                data.append({
+                    'name': f"{window} day {METRIC_NAMES[metric]}",
+                    'legendgroup': f"rolling-{window}",
+                    'mode': 'lines',
+                    'x': x,
+                    'y': _json_values(columns[metric][shown]),
+                    'xaxis': 'x',
+                    'yaxis': f"y{i + 2}",
+                    'line': {'width': 1, 'color': METRIC_COLORS[metric], 'dash': dash},
+                })
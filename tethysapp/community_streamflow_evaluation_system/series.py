@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+#pyarrow's multi-threaded csv reader, the pandas C parser is used when it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+from .storage import get_storage
+from .timing import span
+from .cache import SERIES
+from .series_store import series_store
+from .crosswalk import load_crosswalk, DEFAULT_CONFIG_DIR
+from .network import load_network
+
+
+USGS_FLOW = 'USGS_flow'
+
+
+def flow_column(model_id):
+    """
+    Name of the flow column in a model's NHD segment csv, e.g. 'NWM_flow' for NWM_v2.1 and NWM_v3.0.
+    """
+    return f"{model_id[:3]}_flow"
+
+
+def usgs_key(state, site_id):
+    return f"NWIS/NWIS_sites_{state}.h5/NWIS_{site_id}.csv"
+
+
+_hydrofabric_models = None
+
+
+def configure_hydrofabric_models(models):
+    """
+    Set the models keyed by hydrofabric waterbody for this process, e.g. from a command line tool, instead of the
+    app setting.
+    """
+    global _hydrofabric_models
+    _hydrofabric_models = tuple(models)
+
+
+def hydrofabric_models():
+    """
+    Model ids whose series are stored per hydrofabric waterbody rather than per NHD reach, from the
+    hydrofabric_models app setting (comma separated).
+    """
+    global _hydrofabric_models
+    if _hydrofabric_models is None:
+        from .app import CSES as app
+        setting = app.get_custom_setting('hydrofabric_models') or ''
+        _hydrofabric_models = tuple(m.strip() for m in setting.split(',') if m.strip())
+    return _hydrofabric_models
+
+
+def model_key(model_id, state, NHD_id, site_id=None):
+    """
+    Key of a model's series at a station.
+
+    Models in hydrofabric_models() resolve the station's USGS id to its waterbody through the crosswalk, the others
+    use the NHD reach id.
+    """
+    if site_id is not None and model_id in hydrofabric_models():
+        key = model_keys(model_id, [(state, NHD_id, site_id)])[0]
+        if key is None:
+            raise KeyError(f"USGS site {site_id} is not in the hydrofabric crosswalk")
+        return key
+    return f"{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv"
+
+
+def model_keys(model_id, stations):
+    """
+    Keys of a model's series at many stations, resolved in one crosswalk lookup for hydrofabric models.
+
+    Args:
+        model_id (str): model id.
+        stations (iterable): (state, NHD_id, USGS id) per station.
+
+    Returns:
+        list: key per station, None for stations of a hydrofabric model missing from the crosswalk.
+    """
+    stations = list(stations)
+    if model_id not in hydrofabric_models():
+        return [model_key(model_id, state, NHD_id) for state, NHD_id, _ in stations]
+    #a gage on several waterbodies reads the most downstream one
+    waterbodies = load_crosswalk().outlet_waterbodies([site_id for _, _, site_id in stations],
+                                                      load_network(DEFAULT_CONFIG_DIR))
+    return [hydrofabric_key(model_id, wb) if wb is not None else None for wb in waterbodies]
+
+
+def hydrofabric_key(model_id, waterbody_id):
+    return f"{model_id}/hydrofabric/{model_id}_{waterbody_id}.csv"
+
+
+def parse_series(body, flow_col):
+    """
+    Parse a daily flow csv into a float32 series on a sorted, unique datetime64 index.
+
+    Only the Datetime and flow columns are read, the index column and the model csvs' feature_id are skipped.
+
+    Args:
+        body (file-like): csv object from the storage backend.
+        flow_col (str): flow column, 'USGS_flow' or flow_column(model_id).
+
+    Returns:
+        pd.Series: flows named `flow_col`, duplicate dates keep their first value.
+    """
+    if pa is not None:
+        table = pacsv.read_csv(body, convert_options=pacsv.ConvertOptions(
+            include_columns=['Datetime', flow_col],
+            column_types={'Datetime': pa.timestamp('s'), flow_col: pa.float32()},
+        ))
+        dates = table.column('Datetime').to_numpy()
+        flows = table.column(flow_col).to_numpy()
+    else:
+        df = pd.read_csv(body, usecols=['Datetime', flow_col], dtype={flow_col: np.float32},
+                         parse_dates=['Datetime'], date_format='%Y-%m-%d')
+        dates = df['Datetime'].to_numpy()
+        flows = df[flow_col].to_numpy()
+
+    series = pd.Series(flows, index=pd.DatetimeIndex(dates, name='Datetime'), name=flow_col)
+    if not series.index.is_monotonic_increasing:
+        series = series.sort_index(kind='stable')
+    if not series.index.is_unique:
+        series = series[~series.index.duplicated()]
+    return series
+
+
+def read_series(key, flow_col, storage=None):
+    """
+    Read a flow csv from storage, see parse_series. Series are kept in the worker's series cache, series of the
+    shared series store (series_store.py) are resolved from it instead.
+    """
+    store = series_store()
+    if store is not None:
+        series = store.get(key, flow_col)
+        if series is not None:
+            return series
+    storage = storage or get_storage()
+
+    def load():
+        body = storage.open(key)
+        with span('csv_parse'):
+            return parse_series(body, flow_col)
+    return SERIES.get((storage, key, flow_col), load)
+
+
+def date_strings(index):
+    """
+    Dates of a datetime index as 'YYYY-MM-DD' strings, the x values sent to the plot.
+    """
+    return index.strftime('%Y-%m-%d').to_list()
+
+
+def flow_values(values):
+    """
+    Flows (series or array) as a list of floats for the plot and metrics.
+
+    float32 values are rounded to 8 significant digits and at most 4 decimals, so 131.567 stays 131.567
+    rather than 131.56700134277344 in the JSON sent to the browser, without a string per value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.ceil(np.log10(np.abs(values)))
+    scale = 10.0 ** np.clip(8 - np.nan_to_num(magnitude, nan=0.0, posinf=0.0, neginf=0.0), 0, 4)
+    return (np.round(values * scale) / scale).tolist()
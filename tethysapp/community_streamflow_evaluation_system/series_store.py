@@ -0,0 +1,227 @@
+"""
+Shared, memory-mapped store of hot flow series for the workers of a node.
+
+Every worker process used to hold its own parsed copies of the series it had read. The store packs the series of a
+set of stations into two flat files in the app workspace, float32 flows and int32 day offsets since 1970-01-01,
+with an index of the (key, flow column) -> [start, stop) slice of each series::
+
+    python -m tethysapp.community_streamflow_evaluation_system.series_store --states UT AL \\
+        --models NWM_v2.1 NWM_v3.0 --storage-root <bucket mirror>
+
+Workers map the files read-only, so the pages are shared through the OS page cache, and read_series resolves a
+stored series as a view on the mapped flows without reading the bucket or filling the per-worker series cache.
+Series missing from the store are read from storage as before. A rebuild writes a new directory and swaps it in;
+workers notice the new index and map the new files.
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .storage import is_missing
+
+
+#store shipped with the app workspace
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'series_store')
+FLOWS_FILE = 'flows.f32'
+DAYS_FILE = 'days.i32'
+INDEX_FILE = 'index.json'
+FORMAT_VERSION = 1
+#seconds between checks for a rebuilt store
+RECHECK_SECONDS = 10
+
+_store_dir = None
+_attached = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def configure_series_store(path):
+    """
+    Use the store at `path` for this process, e.g. from the benchmark suite, instead of the app workspace. None
+    turns the store off.
+    """
+    global _store_dir, _attached, _checked
+    with _lock:
+        _store_dir = path if path is not None else ''
+        _attached = None
+        _checked = 0.0
+
+
+def series_store_dir():
+    return DEFAULT_STORE_DIR if _store_dir is None else _store_dir
+
+
+class SeriesStore:
+    """
+    Read-only view of a built store.
+
+    Args:
+        path (str): store directory, see build_store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        index_path = os.path.join(path, INDEX_FILE)
+        self.mtime = os.stat(index_path).st_mtime_ns
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['version'] != FORMAT_VERSION:
+            raise ValueError(f"series store version {index['version']}, expected {FORMAT_VERSION}")
+        self.slices = {(key, flow_col): (start, stop) for key, flow_col, start, stop in index['series']}
+        total = index['total']
+        #plain ndarray views on the mappings, np.memmap refuses empty files
+        self.flows = np.asarray(np.memmap(os.path.join(path, FLOWS_FILE), dtype=np.float32, mode='r',
+                                          shape=(total,))) if total else np.empty(0, dtype=np.float32)
+        self.days = np.asarray(np.memmap(os.path.join(path, DAYS_FILE), dtype=np.int32, mode='r',
+                                         shape=(total,))) if total else np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __contains__(self, item):
+        return item in self.slices
+
+    def get(self, key, flow_col):
+        """
+        The stored series of `key`, like parse_series, its values a view on the mapped flows.
+
+        Returns:
+            pd.Series: None when the series is not in the store.
+        """
+        bounds = self.slices.get((key, flow_col))
+        if bounds is None:
+            return None
+        start, stop = bounds
+        dates = (self.days[start:stop].astype(np.int64) * 86400).view('datetime64[s]')
+        return pd.Series(self.flows[start:stop], index=pd.DatetimeIndex(dates, name='Datetime'), name=flow_col,
+                         copy=False)
+
+    def nbytes(self):
+        return self.flows.nbytes + self.days.nbytes
+
+
+def series_store():
+    """
+    The attached store of series_store_dir(), None when none was built.
+    """
+    global _attached, _checked
+    now = time.monotonic()
+    if now - _checked < RECHECK_SECONDS:
+        return _attached
+    with _lock:
+        _checked = now
+        path = series_store_dir()
+        try:
+            mtime = os.stat(os.path.join(path, INDEX_FILE)).st_mtime_ns if path else None
+        except OSError:
+            mtime = None
+        if mtime is None:
+            _attached = None
+        elif _attached is None or _attached.path != path or _attached.mtime != mtime:
+            try:
+                _attached = SeriesStore(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"series store {path} not attached: {e}")
+                _attached = None
+        return _attached
+
+
+def build_store(output, items, storage):
+    """
+    Read the series of `items` from storage and write them as a store at `output`, replacing the one there.
+
+    Args:
+        items (iterable): (storage key, flow column) pairs, missing series are skipped.
+
+    Returns:
+        int: series stored.
+    """
+    #imported here, series imports this module to resolve stored series
+    from .series import parse_series
+
+    tmp = f"{output.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    epoch = np.datetime64('1970-01-01', 'D')
+    index, total = [], 0
+    with open(os.path.join(tmp, FLOWS_FILE), 'wb') as flows, open(os.path.join(tmp, DAYS_FILE), 'wb') as days:
+        for key, flow_col in dict.fromkeys(items):
+            #parsed from storage, not through read_series, which would answer from the store being replaced
+            try:
+                series = parse_series(storage.open(key), flow_col)
+            except Exception as e:
+                if not is_missing(e):
+                    raise
+                continue
+            offsets = (series.index.values.astype('datetime64[D]') - epoch).astype(np.int32)
+            flows.write(np.ascontiguousarray(series.to_numpy(), dtype=np.float32).tobytes())
+            days.write(offsets.tobytes())
+            index.append([key, flow_col, total, total + len(series)])
+            total += len(series)
+    with open(os.path.join(tmp, INDEX_FILE), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'total': total, 'series': index}, f)
+
+    #workers holding the old files keep their mappings, the next check attaches the new ones
+    swap_dir(tmp, output)
+    return len(index)
+
+
+def swap_dir(tmp, output):
+    """
+    Put the directory built at `tmp` in place of `output` with two renames. Readers find the old directory, the new
+    one or, between the renames, none, which the store and matrix readers treat as not built.
+    """
+    old = f"{output.rstrip(os.sep)}.old-{os.getpid()}"
+    if os.path.exists(output):
+        os.replace(output, old)
+    os.replace(tmp, output)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def station_items(stations, models):
+    """
+    (key, flow column) of the observed series and the series of each model at the stations.
+
+    Args:
+        stations (list): (site id, state, NHD id) per station.
+    """
+    from .series import usgs_key, model_keys, flow_column, USGS_FLOW
+
+    items = [(usgs_key(state, site), USGS_FLOW) for site, state, _ in stations]
+    for model_id in models:
+        keys = model_keys(model_id, [(state, NHD_id, site) for site, state, NHD_id in stations])
+        items.extend((key, flow_column(model_id)) for key in keys if key is not None)
+    return items
+
+
+def main(argv=None):
+    from .storage import create_storage
+    from .series import configure_hydrofabric_models
+    from .evaluate import select_stations, MODELS
+
+    parser = argparse.ArgumentParser(description='Build the shared series store of the app workspace.')
+    parser.add_argument('--states', nargs='+', help='state ids, e.g. UT AL')
+    parser.add_argument('--hucs', nargs='+', help='HUC codes, e.g. 1602 1603')
+    parser.add_argument('--sites', nargs='+', help='USGS site ids')
+    parser.add_argument('--models', nargs='*', default=MODELS)
+    parser.add_argument('--output', default=DEFAULT_STORE_DIR, help='store directory')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--hydrofabric-models', nargs='*', default=['NextGen'],
+                        help='models whose series are keyed by hydrofabric waterbody, see the hydrofabric_models setting')
+    args = parser.parse_args(argv)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    configure_hydrofabric_models(args.hydrofabric_models)
+    stations = select_stations(storage, args.states, args.hucs, args.sites)
+    count = build_store(args.output, station_items(stations, args.models), storage)
+    print(f"{count} series of {len(stations)} stations written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+#functions to load AWS data
+import boto3
+from botocore import UNSIGNED
+from botocore.client import Config
+from botocore.exceptions import ClientError
+os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
+
+from .timing import span
+from .io_ledger import record_read
+
+
+BUCKET_NAME = 'streamflow-app-data'
+
+#backends selectable with the storage_backend app setting
+BACKENDS = ('s3', 'local', 'memory')
+
+
+class Storage:
+    """
+    Read access to the streamflow-app-data layout, keyed by the object keys used in the bucket
+    (e.g. 'Streamstats/Streamstats.csv', 'NWIS/NWIS_sites_AL.h5/NWIS_02450250.csv').
+    """
+
+    def open(self, key):
+        """
+        Open an object for reading.
+
+        Args:
+            key (str): object key.
+
+        Returns:
+            file-like: readable binary object accepted by pd.read_csv, gpd.read_file and json.load.
+        """
+        raise NotImplementedError
+
+    def read_bytes(self, key):
+        """
+        Read a whole object into memory.
+        """
+        return self.open(key).read()
+
+    def uri(self, key):
+        """
+        Path or URI of an object or prefix for readers that need to open it themselves (GDAL for the WBD FileGDBs).
+        """
+        raise NotImplementedError
+
+    def fingerprint(self, key):
+        """
+        Version of an object, or of the objects under a prefix, that changes whenever it is rewritten. Raises the
+        backend's missing key error, see is_missing.
+        """
+        raise NotImplementedError
+
+
+def _digest(entries):
+    return hashlib.sha1(repr(sorted(entries)).encode()).hexdigest()
+
+
+class S3Storage(Storage):
+    """
+    Objects in an S3 bucket, read unsigned by default as the public streamflow-app-data bucket is.
+    """
+
+    def __init__(self, bucket_name=BUCKET_NAME, endpoint_url=None, unsigned=True):
+        config = Config(signature_version=UNSIGNED) if unsigned else None
+        self.bucket_name = bucket_name
+        self.s3 = boto3.resource('s3', endpoint_url=endpoint_url, config=config)
+        self.bucket = self.s3.Bucket(bucket_name)
+
+    def open(self, key):
+        return io.BytesIO(self.read_bytes(key))
+
+    def read_bytes(self, key):
+        #the whole body is read here so the GET is timed apart from parsing
+        t0 = time.perf_counter()
+        with span('storage'):
+            data = self.bucket.Object(key).get()['Body'].read()
+        record_read(key, len(data), time.perf_counter() - t0, 's3')
+        return data
+
+    def uri(self, key):
+        #GDAL reads these itself, the ledger only sees that the prefix was opened
+        record_read(key, 0, 0.0, 's3-gdal')
+        return f"s3://{self.bucket_name}/{key}"
+
+    def fingerprint(self, key):
+        #ETag and size from a listing, which covers the FileGDB prefixes as well as objects
+        key = key.strip('/')
+        objects = [(o.key, o.e_tag, o.size) for o in self.bucket.objects.filter(Prefix=key)
+                   if o.key == key or o.key.startswith(key + '/')]
+        if not objects:
+            raise KeyError(key)
+        exact = [o for o in objects if o[0] == key]
+        if not exact:
+            return _digest(objects)
+        _, etag, size = exact[0]
+        etag = etag.strip('"')
+        return f"{etag}:{size}"
+
+
+class LocalStorage(Storage):
+    """
+    Local mirror of the bucket, keys are paths relative to `root`.
+
+    Objects are opened memory-mapped so CSV/GeoJSON parsing reads straight from the page cache without copying
+    the file into Python first; the FileGDBs are handed to GDAL as plain paths.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+
+    def path(self, key):
+        """
+        Path of a key, KeyError when it resolves outside the mirror: keys come from the station properties clients
+        send back, and '..' segments or symlinks must not reach other files of the host.
+        """
+        path = os.path.realpath(os.path.join(self.root, *key.strip('/').split('/')))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise KeyError(key)
+        return path
+
+    def open(self, key):
+        t0 = time.perf_counter()
+        with span('storage'), open(self.path(key), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            #empty files cannot be mapped
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else io.BytesIO()
+        record_read(key, size, time.perf_counter() - t0, 'local')
+        return mapped
+
+    def read_bytes(self, key):
+        t0 = time.perf_counter()
+        with span('storage'), open(self.path(key), 'rb') as f:
+            data = f.read()
+        record_read(key, len(data), time.perf_counter() - t0, 'local')
+        return data
+
+    def uri(self, key):
+        record_read(key, 0, 0.0, 'local-gdal')
+        return self.path(key)
+
+    def fingerprint(self, key):
+        path = self.path(key)
+        stat = os.stat(path)
+        if not os.path.isdir(path):
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        entries = []
+        for folder, _, files in os.walk(path):
+            for name in files:
+                stat = os.stat(os.path.join(folder, name))
+                entries.append((os.path.relpath(os.path.join(folder, name), path), stat.st_size, stat.st_mtime_ns))
+        return _digest(entries)
+
+
+class MemoryStorage(Storage):
+    """
+    Objects held in memory.
+
+    Objects are added with put_bytes, or read through from `source` on first access and kept, so with an S3
+    source every object is fetched once per process.
+    """
+
+    def __init__(self, objects=None, source=None):
+        self.objects = dict(objects or {})
+        self.source = source
+        self._lock = threading.Lock()
+        self._spill_dir = None
+
+    def put_bytes(self, key, data):
+        with self._lock:
+            self.objects[key] = bytes(data)
+
+    def read_bytes(self, key):
+        data = self.objects.get(key)
+        if data is None:
+            if self.source is None:
+                raise KeyError(key)
+            data = self.source.read_bytes(key)
+            self.put_bytes(key, data)
+        else:
+            record_read(key, len(data), 0.0, 'memory')
+        return data
+
+    def open(self, key):
+        return io.BytesIO(self.read_bytes(key))
+
+    def uri(self, key):
+        #GDAL needs files, spill the objects under the prefix to a temp dir once
+        prefix = key.strip('/')
+        keys = [k for k in self.objects if k == prefix or k.startswith(prefix + '/')]
+        if not keys:
+            if self.source is None:
+                raise KeyError(key)
+            return self.source.uri(key)
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix='cses-storage-')
+        for k in keys:
+            path = os.path.join(self._spill_dir, *k.split('/'))
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(self.objects[k])
+        return os.path.join(self._spill_dir, *prefix.split('/'))
+
+    def fingerprint(self, key):
+        if self.source is not None:
+            return self.source.fingerprint(key)
+        prefix = key.strip('/')
+        entries = [(k, hashlib.sha1(v).hexdigest()) for k, v in self.objects.items()
+                   if k == prefix or k.startswith(prefix + '/')]
+        if not entries:
+            raise KeyError(key)
+        return _digest(entries)
+
+    def __del__(self):
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+
+def is_missing(error):
+    """
+    Whether `error` is a backend's answer to a key or station that does not exist.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404')
+    return isinstance(error, (KeyError, FileNotFoundError))
+
+
+def create_storage(backend='s3', root=None, bucket_name=BUCKET_NAME, endpoint_url=None):
+    """
+    Build a storage backend.
+
+    Args:
+        backend (str): 's3', 'local' or 'memory'.
+        root (str): mirror directory, required for 'local'.
+        bucket_name (str): bucket for 's3', and the source of 'memory'.
+        endpoint_url (str): S3 endpoint override, e.g. a local S3 server.
+
+    Returns:
+        Storage: the backend.
+    """
+    if backend == 's3':
+        return S3Storage(bucket_name, endpoint_url=endpoint_url)
+    if backend == 'local':
+        if not root:
+            raise ValueError("The local storage backend needs storage_root, the directory of the bucket mirror")
+        return LocalStorage(root)
+    if backend == 'memory':
+        return MemoryStorage(source=S3Storage(bucket_name, endpoint_url=endpoint_url))
+    raise ValueError(f"Unknown storage backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def configure_storage(storage):
+    """
+    Set the process wide storage backend, e.g. from the command line tools or the benchmark suite.
+    """
+    global _storage
+    with _storage_lock:
+        _storage = storage
+    return storage
+
+
+def get_storage():
+    """
+    The process wide storage backend, built from the storage_backend/storage_root app settings on first use.
+    """
+    global _storage
+    if _storage is None:
+        from .app import CSES as app
+        backend = app.get_custom_setting('storage_backend') or 's3'
+        root = app.get_custom_setting('storage_root')
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(backend, root)
+    return _storage
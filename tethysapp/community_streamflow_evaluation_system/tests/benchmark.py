@@ -0,0 +1,423 @@
+"""
+Offline benchmark suite for the evaluation hot paths.
+
+Generates a synthetic streamflow-app-data bucket (see synthetic_bucket.py), serves it from a local moto S3 server
+and times reach_json, combine_jsons, Join_WBD_StreamStats, every compose_layers and get_plot_for_layer_feature
+against it, plus the NextGen network view, a batch plot, a JSON API page, the startup warmup, a prefetched click and a long-window plot drawn from the pyramids. Results are written to a JSON file so runs can be
+compared and regressions show up as numbers.
+
+Run it from the Tethys environment (moto is needed on top of the app requirements)::
+
+    python -m tethysapp.community_streamflow_evaluation_system.tests.benchmark --sites 50 --days 3650 \
+        --repeat 5 --output benchmark_results.json --baseline previous_results.json
+
+or, at a tiny scale, as part of the app tests with ``tethys manage test`` (BenchmarkTestCase below).
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from . import synthetic_bucket
+
+
+GDAL_S3_ENV = ('AWS_S3_ENDPOINT', 'AWS_HTTPS', 'AWS_VIRTUAL_HOSTING', 'AWS_ENDPOINT_URL_S3')
+
+
+class LocalS3:
+    """
+    moto S3 server on localhost holding the synthetic bucket.
+
+    The server runs in its own process: GDAL holds the GIL while pyogrio reads a layer, so an in-process server
+    thread would deadlock the WBD reads. boto3 is pointed at it through AWS_ENDPOINT_URL_S3 and GDAL (used by
+    gpd.read_file for the WBD GDBs) through AWS_S3_ENDPOINT, so both the boto3 reads and the s3:// reads of the
+    controllers are served locally.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.process = None
+        self.endpoint = None
+        self._env = {}
+
+    def __enter__(self):
+        import boto3
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.process = subprocess.Popen([sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.endpoint = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.process.kill()
+                    raise RuntimeError('moto server did not start, is moto[server] installed?')
+                time.sleep(0.1)
+
+        self._env = {k: os.environ.get(k) for k in GDAL_S3_ENV + ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY',
+                                                                  'AWS_DEFAULT_REGION')}
+        os.environ.update({
+            'AWS_ENDPOINT_URL_S3': self.endpoint,
+            'AWS_S3_ENDPOINT': f"127.0.0.1:{port}",
+            'AWS_HTTPS': 'NO',
+            'AWS_VIRTUAL_HOSTING': 'FALSE',
+            'AWS_DEFAULT_REGION': 'us-east-1',
+        })
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+        client = boto3.client('s3', endpoint_url=self.endpoint)
+        synthetic_bucket.upload_bucket(self.root, client)
+        return self
+
+    def __exit__(self, *exc):
+        for k, v in self._env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        self.process.terminate()
+        self.process.wait()
+
+    def storage(self):
+        """
+        S3 storage backend reading the local server, unsigned like the app.
+        """
+        from ..storage import S3Storage
+        return S3Storage(synthetic_bucket.BUCKET_NAME, endpoint_url=self.endpoint)
+
+
+def timed(fn, repeat, cold=True):
+    """
+    Run `fn` `repeat` times, return the wall times in ms, the I/O ledger of the last run and the last result.
+    With `cold` the worker caches are emptied before every run.
+    """
+    from ..io_ledger import IOLedger, tracking
+    from ..cache import clear_caches
+
+    times = []
+    result = ledger = None
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        ledger = IOLedger()
+        t0 = time.perf_counter()
+        with tracking(ledger):
+            result = fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return times, ledger, result
+
+
+def summarize(times, ledger):
+    return {
+        'runs': len(times),
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.fmean(times), 3),
+        'max_ms': round(max(times), 3),
+        'gets': len(ledger.reads),
+        'bytes': ledger.total_bytes,
+        'duplicate_keys': len(ledger.duplicates()),
+    }
+
+
+def first_feature_props(layer_groups):
+    """
+    Properties of the first station of a composed layer, what the map sends back on click.
+    """
+    geojson = layer_groups[0]['layers'][0]['options']
+    return geojson['features'][0]['properties']
+
+
+def prepare_bucket(root, **kwargs):
+    """
+    Build the synthetic bucket under `root`, the pyramids of its stations and the WBD extracts, see
+    synthetic_bucket.build_bucket.
+    """
+    from ..pyramids import build_pyramids
+    from ..series import configure_hydrofabric_models
+    from ..storage import LocalStorage
+    from ..wbd import extract_region
+
+    scale = synthetic_bucket.build_bucket(root, **kwargs)
+    configure_hydrofabric_models(['NextGen'])
+    scale['pyramids'] = build_pyramids(LocalStorage(root), root, scale['states'], scale['models'])
+    regions = sorted(set(synthetic_bucket.STATE_REGIONS.values()))
+    levels = range(2, scale['huc_digits'] + 1, 2)
+    scale['wbd_layers'] = sum(extract_region(LocalStorage(root), os.path.join(root, 'wbd'), r, levels)
+                              for r in regions)
+    return scale
+
+
+def run_benchmarks(repeat=3, reach_count=10, state='UT', huc='1602', model='NWM_v2.1', start='01-01-2012',
+                   end='12-31-2014', long_end='12-31-2019'):
+    """
+    Time the hot paths against the configured storage backend.
+
+    Returns:
+        dict: benchmark name -> timing summary.
+    """
+    from django.test import RequestFactory
+    from types import SimpleNamespace
+    from .. import utils, Reach_Controller, State_Controller, HUC_Controller, Network_Controller, nextgen, warmup, overlay, \
+        API_Controller
+    from ..storage import get_storage
+    from ..pyramids import configure_plot_max_points
+    from ..rolling import configure_rolling_windows
+    from ..series import configure_hydrofabric_models
+    from ..series_store import configure_series_store, build_store, station_items
+    from ..evaluate import select_stations
+    from ..matrices import build_matrices, Matrices
+    from ..artifacts import configure_artifact_dir, build_defaults
+    from ..prefetch import configure_prefetch
+
+    reach_ids = synthetic_bucket.REACH_DEFAULT_SITES + synthetic_bucket.HUC_DEFAULT_SITES[:max(reach_count - 2, 0)]
+    factory = RequestFactory()
+    results = {}
+
+    def record(name, fn, cold=True):
+        times, ledger, result = timed(fn, repeat, cold)
+        r = results[name] = summarize(times, ledger)
+        print(f"{name:<47} median {r['median_ms']:>9.1f} ms  min {r['min_ms']:>9.1f} ms  "
+              f"{r['gets']:>4} reads {r['bytes'] / 1e6:>8.2f} MB  {r['duplicate_keys']} duplicated")
+        return result
+
+    storage = get_storage()
+    configure_plot_max_points(500)
+    configure_rolling_windows([30, 90, 365])
+    configure_hydrofabric_models(['NextGen'])
+    #the storage reads are measured, not a series store of the app workspace
+    configure_series_store(None)
+    configure_artifact_dir(None)
+    #no background reads between the measurements, the warmup plots the stations of the default setting
+    configure_prefetch(False)
+    record('utils.reach_json', lambda: utils.reach_json(reach_ids, storage))
+    paths = [f"GeoJSON/StreamStats_{s}_4326.geojson" for s in list(synthetic_bucket.STATE_REGIONS)[:2]]
+    record('utils.combine_jsons', lambda: utils.combine_jsons(paths, storage))
+    record('HUC_Eval.Join_WBD_StreamStats', lambda: HUC_Controller.HUC_Eval().Join_WBD_StreamStats([huc]))
+
+    params = {
+        'start-date': start,
+        'end-date': end,
+        'model_id': model,
+    }
+    views = [
+        ('Reach_Eval', Reach_Controller.Reach_Eval, dict(params, reach_ids=', '.join(reach_ids))),
+        ('State_Eval', State_Controller.State_Eval, dict(params, state_id=state)),
+        ('HUC_Eval', HUC_Controller.HUC_Eval, dict(params, huc_ids=huc)),
+    ]
+    for name, view_class, query in views:
+        for label, q in (('', query), ('[default]', {})):
+            request = factory.get('/', q)
+            layers = record(f"{name}.compose_layers{label}",
+                            lambda: view_class().compose_layers(request, {'view': {}}, None))
+            props = first_feature_props(layers)
+            record(f"{name}.get_plot_for_layer_feature{label}",
+                   lambda: view_class().get_plot_for_layer_feature(request, 'USGS Stations', props.get('id'), {},
+                                                                   props, None))
+
+    workspace = SimpleNamespace(path=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'workspaces',
+                                                  'app_workspace'))
+    request = factory.get('/', {})
+    record('Network_Eval.compose_layers[default]',
+           lambda: Network_Controller.Network_Eval().compose_layers(request, {'view': {}}, workspace))
+
+    #ingest and score a synthetic run of the sample hydrofabric
+    with tempfile.TemporaryDirectory(prefix='cses-ngen-') as outputs:
+        synthetic_bucket.write_nextgen_outputs(outputs, os.path.join(nextgen.DEFAULT_CONFIG_DIR,
+                                                                     'flowpath_edge_list.json'))
+        ingested = record('nextgen.ingest_run', lambda: nextgen.ingest_run(outputs, workers=4))
+    record('nextgen.score_run', lambda: nextgen.score_run(ingested, storage=storage))
+
+    #several stations overlaid in one response
+    window = [datetime.strptime(d, '%m-%d-%Y').strftime('%Y-%m-%d') for d in (start, end)]
+    record('overlay.batch_plot', lambda: overlay.batch_plot(reach_ids[:5], model, *window))
+
+    #a page of state scores from the JSON API
+    request = factory.get('/', {'state': state, 'model_id': model, 'start-date': window[0], 'end-date': window[1],
+                                'limit': 100}, HTTP_ACCEPT_ENCODING='gzip')
+    record('API_Controller.api_metrics', lambda: API_Controller.api_metrics(request))
+
+    #the startup warmup, then a default view served from the warm caches
+    record('warmup.warm', lambda: warmup.warm())
+    request = factory.get('/', {})
+    record('HUC_Eval.compose_layers[default,warm]',
+           lambda: HUC_Controller.HUC_Eval().compose_layers(request, {'view': {}}, None), cold=False)
+
+    #a click on a station whose series were prefetched after its map was composed
+    from ..cache import clear_caches
+    from ..prefetch import PREFETCHER, layer_stations
+    clear_caches()
+    request = factory.get('/', views[0][2])
+    layers = Reach_Controller.Reach_Eval().compose_layers(request, {'view': {}}, None)
+    PREFETCHER.schedule('benchmark', layer_stations(layers))
+    PREFETCHER.drain(timeout=60)
+    props = first_feature_props(layers)
+    record('Reach_Eval.get_plot_for_layer_feature[prefetched]',
+           lambda: Reach_Controller.Reach_Eval().get_plot_for_layer_feature(request, 'USGS Stations', props.get('id'),
+                                                                           {}, props, None), cold=False)
+
+    #a window longer than the plot width, drawn from the pyramids
+    request = factory.get('/', dict(views[0][2], **{'start-date': '01-01-2010', 'end-date': long_end}))
+    props = first_feature_props(Reach_Controller.Reach_Eval().compose_layers(request, {'view': {}}, None))
+    record('Reach_Eval.get_plot_for_layer_feature[long]',
+           lambda: Reach_Controller.Reach_Eval().get_plot_for_layer_feature(request, 'USGS Stations', props.get('id'),
+                                                                           {}, props, None))
+
+    #a click answered from the shared series store
+    with tempfile.TemporaryDirectory(prefix='cses-store-') as store_dir:
+        build_store(store_dir, station_items(select_stations(storage, sites=reach_ids), [model]), storage)
+        configure_series_store(store_dir)
+        request = factory.get('/', views[0][2])
+        props = first_feature_props(Reach_Controller.Reach_Eval().compose_layers(request, {'view': {}}, None))
+        record('Reach_Eval.get_plot_for_layer_feature[series_store]',
+               lambda: Reach_Controller.Reach_Eval().get_plot_for_layer_feature(request, 'USGS Stations',
+                                                                               props.get('id'), {}, props, None))
+        configure_series_store(None)
+
+    #a window of every station of the bucket scored from the site x day matrices
+    with tempfile.TemporaryDirectory(prefix='cses-matrices-') as matrix_dir:
+        build_matrices(matrix_dir, select_stations(storage), [model], storage, start='2010-01-01',
+                       end=window[1])
+        matrices = Matrices(matrix_dir)
+        record('matrices.score', lambda: matrices.score(model, *window))
+
+    #a default view and a default plot served from the materialized artifacts, and a rebuild of unchanged sources
+    with tempfile.TemporaryDirectory(prefix='cses-defaults-') as artifact_dir:
+        build_defaults(artifact_dir, storage)
+        record('artifacts.build_defaults[unchanged]', lambda: build_defaults(artifact_dir, storage))
+        configure_artifact_dir(artifact_dir)
+        request = factory.get('/', {})
+        layers = record('HUC_Eval.compose_layers[artifacts]',
+                        lambda: HUC_Controller.HUC_Eval().compose_layers(request, {'view': {}}, None))
+        props = first_feature_props(layers)
+        record('HUC_Eval.get_plot_for_layer_feature[artifacts]',
+               lambda: HUC_Controller.HUC_Eval().get_plot_for_layer_feature(request, 'USGS Stations', props.get('id'),
+                                                                           {}, props, None))
+        configure_artifact_dir(None)
+    return results
+
+
+def run_with_backend(root, backend, **kwargs):
+    """
+    Run the benchmarks with the synthetic bucket under `root` read through `backend`.
+    """
+    from ..storage import configure_storage, LocalStorage, MemoryStorage
+    from ..wbd import configure_wbd_dir
+
+    configure_wbd_dir(os.path.join(root, 'wbd'))
+    if backend == 'local':
+        configure_storage(LocalStorage(root))
+        return run_benchmarks(**kwargs)
+    with LocalS3(root) as s3:
+        storage = s3.storage()
+        configure_storage(MemoryStorage(source=storage) if backend == 'memory' else storage)
+        return run_benchmarks(**kwargs)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Benchmarks whose median time regressed by more than `tolerance` (fraction) against `baseline`, or that read
+    more objects than they used to.
+    """
+    regressions = {}
+    for name, summary in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None or not old['median_ms']:
+            continue
+        change = summary['median_ms'] / old['median_ms'] - 1.0
+        if change > tolerance:
+            regressions[name] = f"median +{change * 100:.0f}%"
+        elif summary.get('gets', 0) > old.get('gets', summary.get('gets', 0)):
+            regressions[name] = f"reads {old['gets']} -> {summary['gets']}"
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CSES evaluation hot paths against a synthetic bucket.')
+    parser.add_argument('--sites', type=int, default=20, help='random gauges per state')
+    parser.add_argument('--days', type=int, default=3650, help='length of every daily series')
+    parser.add_argument('--huc-digits', type=int, default=8, help='deepest WBD level written')
+    parser.add_argument('--huc-vertices', type=int, default=2000, help='vertices of the HU2/HU4 polygons')
+    parser.add_argument('--backend', choices=['s3', 'local', 'memory'], default='s3',
+                        help='storage backend to read the synthetic bucket through, s3 uses a local moto server')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed median slowdown, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+    import django
+    django.setup()
+
+    with tempfile.TemporaryDirectory(prefix='cses-bench-') as root:
+        t0 = time.perf_counter()
+        scale = prepare_bucket(root, sites_per_state=args.sites, days=args.days, huc_digits=args.huc_digits,
+                               huc_vertices=args.huc_vertices)
+        print(f"Synthetic bucket: {scale['sites']} sites, {scale['series_files']} series "
+              f"({time.perf_counter() - t0:.1f} s)")
+        results = run_with_backend(root, args.backend, repeat=args.repeat)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'scale': scale,
+        'backend': args.backend,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, change in regressions.items():
+            print(f"REGRESSION {name}: {change}")
+        return 1 if regressions else 0
+    return 0
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """
+    Smoke run of the suite at a tiny scale, checks every hot path runs offline and is recorded.
+    """
+
+    def test_benchmarks_run_offline(self):
+        try:
+            import moto  # noqa: F401
+        except ImportError:
+            self.skipTest('moto is not installed')
+
+        with tempfile.TemporaryDirectory(prefix='cses-bench-') as root:
+            prepare_bucket(root, sites_per_state=3, days=800, huc_digits=4, huc_vertices=200)
+            results = run_with_backend(root, 's3', repeat=1, reach_count=4, start='01-01-2010', end='12-31-2011',
+                                       long_end='03-10-2012')
+
+        self.assertIn('HUC_Eval.Join_WBD_StreamStats', results)
+        self.assertEqual(len(results), 29)
+        self.assertEqual(results['HUC_Eval.compose_layers[artifacts]']['gets'], 0)
+        for summary in results.values():
+            self.assertGreater(summary['median_ms'], 0)
+            self.assertEqual(summary['duplicate_keys'], 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
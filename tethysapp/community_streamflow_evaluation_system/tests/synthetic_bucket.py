@@ -0,0 +1,309 @@
+"""
+Synthetic stand-in for the streamflow-app-data bucket.
+
+Writes the same key layout the controllers read from S3 (StreamStats catalog, per-state station GeoJSON,
+NWIS and model CSVs, and per-HU2 WBD FileGDBs) into a local directory, at a configurable scale, so the
+benchmark suite can run offline. The default Reach/State/HUC sites are always included so the default
+code paths of the controllers resolve against the synthetic data too.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Polygon
+
+
+BUCKET_NAME = 'streamflow-app-data'
+
+MODELS = ['NWM_v2.1', 'NWM_v3.0', 'MLP', 'XGBoost', 'CNN', 'LSTM']
+
+# HU2 region each synthetic state is laid over, the state boxes do not overlap
+STATE_REGIONS = {'AL': '03', 'UT': '16', 'ID': '17', 'CO': '14', 'TX': '12', 'NY': '02'}
+
+# sites the default views of the controllers ask for
+REACH_DEFAULT_SITES = ['10126000', '10068500']
+HUC_DEFAULT_SITES = ['10171000', '10166430', '10168000', '10164500', '10163000', '10157500', '10155500', '10156000',
+                     '10155200', '10155000', '10154200', '10153100', '10150500', '10149400', '10149000', '10147100',
+                     '10146400', '10145400', '10172700']
+DEFAULT_HUC = '1602'
+# gauges of the sample NextGen crosswalk, in Alabama
+NETWORK_DEFAULT_SITES = ['02449838', '02449882', '02450000', '02450180', '02450250', '02450825', '02453000']
+
+
+def state_box(state):
+    """
+    Lon/lat bounds of the synthetic state, one 4 x 3 degree box per state laid out west to east.
+    """
+    i = list(STATE_REGIONS).index(state)
+    minx = -120.0 + 8.0 * i
+    miny = 32.0 + (i % 2) * 4.0
+    return minx, miny, minx + 4.0, miny + 3.0
+
+
+def densified_box(minx, miny, maxx, maxy, vertices):
+    """
+    Rectangle with roughly `vertices` vertices and a small ripple on the edges, mimics WBD boundary detail.
+    """
+    n = max(vertices // 4, 1)
+    t = np.linspace(0.0, 1.0, n, endpoint=False)
+    ripple = 0.002 * np.sin(t * 40 * np.pi)
+    south = np.column_stack([minx + t * (maxx - minx), miny + ripple])
+    east = np.column_stack([maxx + ripple, miny + t * (maxy - miny)])
+    north = np.column_stack([maxx - t * (maxx - minx), maxy + ripple])
+    west = np.column_stack([minx + ripple, maxy - t * (maxy - miny)])
+    return Polygon(np.concatenate([south, east, north, west]))
+
+
+def site_ids(state, n, rng):
+    """
+    Random 8 digit USGS ids, eastern states get a leading zero like the real NWIS ids.
+    """
+    prefix = 0 if STATE_REGIONS[state] < '10' else 1
+    low = prefix * 10_000_000 + 1_000_000
+    ids = rng.choice(np.arange(low, low + 8_000_000), size=n, replace=False)
+    return [str(i).zfill(8) for i in ids]
+
+
+def build_catalog(sites_per_state, seed=0):
+    """
+    Build the StreamStats catalog for every synthetic state.
+
+    Args:
+        sites_per_state (int): number of random gauges per state, the default sites are added on top.
+        seed (int): random seed.
+
+    Returns:
+        DataFrame: one row per gauge with string USGS ids.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    nhd = 1_000_000
+    for state in STATE_REGIONS:
+        ids = site_ids(state, sites_per_state, rng)
+        if state == 'UT':
+            ids = REACH_DEFAULT_SITES + HUC_DEFAULT_SITES + [i for i in ids if i not in REACH_DEFAULT_SITES + HUC_DEFAULT_SITES]
+        if state == 'AL':
+            ids = NETWORK_DEFAULT_SITES + [i for i in ids if i not in NETWORK_DEFAULT_SITES]
+        minx, miny, maxx, maxy = state_box(state)
+        n = len(ids)
+        df = pd.DataFrame({
+            'NWIS_site_id': ids,
+            'NWIS_sitename': [f"SYNTHETIC CREEK {i} NEAR {state}" for i in ids],
+            'dec_lat_va': rng.uniform(miny + 0.05, maxy - 0.05, n),
+            'dec_long_va': rng.uniform(minx + 0.05, maxx - 0.05, n),
+            'state_id': state,
+            'NHD_reachcode': np.arange(nhd, nhd + n),
+            'Drainage_area_mi2': rng.lognormal(5, 1.5, n).round(2),
+            'Mean_Basin_Elev_ft': rng.uniform(200, 9000, n).round(1),
+            'Perc_Forest': rng.uniform(0, 100, n).round(1),
+            'Perc_Develop': rng.uniform(0, 40, n).round(1),
+            'Annual_Precip_in': rng.uniform(5, 70, n).round(1),
+        })
+        if state == 'UT':
+            #the Jordan River gauges sit inside the default HUC 1602, the south east quarter of the HU2 box
+            jordan = df['NWIS_site_id'].isin(HUC_DEFAULT_SITES)
+            midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+            df.loc[jordan, 'dec_lat_va'] = rng.uniform(miny + 0.05, midy - 0.05, jordan.sum())
+            df.loc[jordan, 'dec_long_va'] = rng.uniform(midx + 0.05, maxx - 0.05, jordan.sum())
+        nhd += n
+        frames.append(df)
+    return pd.concat(frames).reset_index(drop=True)
+
+
+def write_streamstats(root, catalog):
+    path = os.path.join(root, 'Streamstats', 'Streamstats.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = catalog.copy()
+    #the real file stores the ids as integers (leading zeros lost) and has some duplicated rows
+    out['NWIS_site_id'] = out['NWIS_site_id'].astype(int)
+    out = pd.concat([out, out.iloc[::25]]).reset_index(drop=True)
+    out.to_csv(path)
+    return path
+
+
+def write_state_geojson(root, catalog):
+    paths = []
+    os.makedirs(os.path.join(root, 'GeoJSON'), exist_ok=True)
+    for state, df in catalog.groupby('state_id'):
+        gdf = gpd.GeoDataFrame({
+            'id': df['NWIS_site_id'].values,
+            'USGS_id': df['NWIS_site_id'].values,
+            'NHD_id': df['NHD_reachcode'].values,
+            'NWIS_sitename': df['NWIS_sitename'].values,
+            'state': state,
+            'dec_lat_va': df['dec_lat_va'].values,
+            'dec_long_va': df['dec_long_va'].values,
+            'Drainage_area_mi2': df['Drainage_area_mi2'].values,
+        }, geometry=gpd.points_from_xy(df['dec_long_va'], df['dec_lat_va']), crs='EPSG:4326')
+        path = os.path.join(root, 'GeoJSON', f"StreamStats_{state}_4326.geojson")
+        with open(path, 'w') as f:
+            json.dump(json.loads(gdf.to_json()), f)
+        paths.append(path)
+    return paths
+
+
+def synthetic_flow(n, rng):
+    """
+    Log-normal flow with an annual cycle, cfs.
+    """
+    t = np.arange(n)
+    seasonal = 1.0 + 0.8 * np.sin(2 * np.pi * (t - 90) / 365.25)
+    return np.round(rng.lognormal(4, 0.6) * seasonal * rng.lognormal(0, 0.3, n), 3)
+
+
+def write_series(root, catalog, start, days, models, seed=0):
+    """
+    Write the NWIS observation CSV and one CSV per model for every gauge.
+    """
+    rng = np.random.default_rng(seed + 1)
+    dates = pd.date_range(start, periods=days, freq='D').strftime('%Y-%m-%d')
+    count = 0
+    for row in catalog.itertuples(index=False):
+        state, site, nhd = row.state_id, row.NWIS_site_id, row.NHD_reachcode
+        obs = synthetic_flow(days, rng)
+
+        nwis_dir = os.path.join(root, 'NWIS', f"NWIS_sites_{state}.h5")
+        os.makedirs(nwis_dir, exist_ok=True)
+        pd.DataFrame({'Datetime': dates, 'USGS_flow': obs}).to_csv(os.path.join(nwis_dir, f"NWIS_{site}.csv"))
+        count += 1
+
+        for model in models:
+            model_dir = os.path.join(root, model, f"NHD_segments_{state}.h5")
+            os.makedirs(model_dir, exist_ok=True)
+            mod = np.round(obs * rng.lognormal(0, 0.25, days), 3)
+            pd.DataFrame({
+                'feature_id': nhd,
+                'Datetime': dates,
+                f"{model[:3]}_flow": mod,
+            }).to_csv(os.path.join(model_dir, f"{model}_{nhd}.csv"))
+            count += 1
+    return count
+
+
+def huc_layers(hu2, box, max_digits, vertices):
+    """
+    Nested WBDHU2..WBDHU{max_digits} polygons, every level splits its parent 2 x 2 into the children
+    01 (south west), 02 (south east), 03 (north west) and 04 (north east).
+    """
+    layers = {}
+    units = [(hu2, box)]
+    digits = 2
+    while digits <= max_digits:
+        name = f"WBDHU{digits}"
+        col = f"huc{digits}"
+        geoms = [densified_box(*b, vertices if digits <= 4 else 16) for _, b in units]
+        gdf = gpd.GeoDataFrame({
+            'areaacres': [g.area * 2.47e6 for g in geoms],
+            'areasqkm': [g.area * 1e4 for g in geoms],
+            'states': 'SYN',
+            col: [code for code, _ in units],
+            'name': [f"Synthetic {code}" for code, _ in units],
+            'shape_Length': [g.length for g in geoms],
+            'shape_Area': [g.area for g in geoms],
+        }, geometry=geoms, crs='EPSG:4269')
+        layers[name] = gdf
+
+        children = []
+        for code, (minx, miny, maxx, maxy) in units:
+            midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+            quads = [(minx, miny, midx, midy), (midx, miny, maxx, midy), (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+            for k, q in enumerate(quads):
+                children.append((f"{code}{k + 1:02d}", q))
+        units = children
+        digits += 2
+    return layers
+
+
+def write_wbd(root, max_digits=8, vertices=2000):
+    """
+    One FileGDB per HU2 region, laid over the state box, with the HUC4 of the default HUC view named 1602.
+    """
+    paths = []
+    for state, hu2 in STATE_REGIONS.items():
+        gdb = os.path.join(root, 'WBD', f"WBD_{hu2}_HU2_GDB", f"WBD_{hu2}_HU2_GDB.gdb")
+        os.makedirs(os.path.dirname(gdb), exist_ok=True)
+        for name, gdf in huc_layers(hu2, state_box(state), max_digits, vertices).items():
+            gdf.to_file(gdb, layer=name, driver='OpenFileGDB')
+        paths.append(gdb)
+    return paths
+
+
+def build_bucket(root, sites_per_state=20, days=3650, start='2010-01-01', models=None, huc_digits=8,
+                 huc_vertices=2000, seed=0):
+    """
+    Generate the full synthetic bucket layout under `root`.
+
+    Args:
+        root (str): directory to write into, keys are relative to it.
+        sites_per_state (int): random gauges per state on top of the default sites.
+        days (int): length of every daily series.
+        start (str): first day of every series.
+        models (list): model ids to write series for, defaults to every model of the app.
+        huc_digits (int): deepest WBD level written, 2 to 12.
+        huc_vertices (int): vertices of the HU2/HU4 polygons.
+        seed (int): random seed.
+
+    Returns:
+        dict: summary of what was written, recorded with the benchmark results.
+    """
+    models = MODELS if models is None else models
+    catalog = build_catalog(sites_per_state, seed)
+    write_streamstats(root, catalog)
+    write_state_geojson(root, catalog)
+    n_series = write_series(root, catalog, start, days, models, seed)
+    write_wbd(root, huc_digits, huc_vertices)
+    return {
+        'states': list(STATE_REGIONS),
+        'sites': len(catalog),
+        'series_files': n_series,
+        'days': days,
+        'start': start,
+        'models': models,
+        'huc_digits': huc_digits,
+        'huc_vertices': huc_vertices,
+    }
+
+
+def write_nextgen_outputs(output_dir, edge_list_path, start='2022-08-24 13:00:00', hours=240, seed=0):
+    """
+    ngen nexus outputs (no header: step, time, flow in m3/s) for every nexus of a flowpath edge list.
+
+    Returns:
+        int: files written.
+    """
+    rng = np.random.default_rng(seed + 2)
+    with open(edge_list_path) as f:
+        edges = json.load(f)
+    nexuses = sorted({e[k] for e in edges for k in ('id', 'toid') if e[k].startswith('nex-')})
+    times = pd.date_range(start, periods=hours, freq='h').strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(output_dir, exist_ok=True)
+    for nexus in nexuses:
+        flow = rng.lognormal(-1, 0.5) * (1.0 + 0.5 * np.sin(np.arange(hours) * 2 * np.pi / 24))
+        with open(os.path.join(output_dir, f"{nexus}_output.csv"), 'w') as f:
+            f.writelines(f"{i}, {t}, {q:.6f}\n" for i, (t, q) in enumerate(zip(times, flow)))
+    return len(nexuses)
+
+
+def upload_bucket(root, s3_client, bucket_name=BUCKET_NAME):
+    """
+    Upload every file under `root` to `bucket_name`, keys relative to `root`.
+
+    The bucket gets a public read policy like the real one, the controllers read it unsigned.
+    """
+    s3_client.create_bucket(Bucket=bucket_name)
+    s3_client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps({
+        'Version': '2012-10-17',
+        'Statement': [{
+            'Effect': 'Allow',
+            'Principal': '*',
+            'Action': ['s3:GetObject', 's3:ListBucket'],
+            'Resource': [f"arn:aws:s3:::{bucket_name}", f"arn:aws:s3:::{bucket_name}/*"],
+        }],
+    }))
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            key = os.path.relpath(path, root).replace(os.sep, '/')
+            s3_client.upload_file(path, bucket_name, key)
@@ -0,0 +1,108 @@
+"""
+Tests of the headless JSON API.
+"""
+import gzip
+import json
+import tempfile
+import unittest
+
+from django.test import RequestFactory
+
+from . import synthetic_bucket
+from .. import API_Controller
+from ..alignment import align
+from ..metrics import aligned_skill
+from ..series import read_series, usgs_key, model_key, flow_column, USGS_FLOW
+from ..storage import configure_storage, get_storage, LocalStorage
+
+
+MODEL = 'NWM_v2.1'
+WINDOW = {'start-date': '2010-01-01', 'end-date': '2010-12-31'}
+
+
+class APITestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        configure_storage(LocalStorage(cls.tmp.name))
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def get(self, view, **params):
+        response = view(RequestFactory().get('/', params))
+        return response.status_code, json.loads(response.content)
+
+    def test_cursor_pages_through_every_station(self):
+        status, everything = self.get(API_Controller.api_stations, state='UT,CO')
+        self.assertEqual(status, 200)
+        self.assertIsNone(everything['next'])
+        sites, cursor = [], None
+        while True:
+            params = {'state': 'UT,CO', 'limit': 2, 'fields': 'site_id'}
+            if cursor:
+                params['cursor'] = cursor
+            status, body = self.get(API_Controller.api_stations, **params)
+            self.assertEqual(status, 200)
+            self.assertTrue(all(list(row) == ['site_id'] for row in body['results']))
+            sites += [row['site_id'] for row in body['results']]
+            cursor = body['next']
+            if cursor is None:
+                break
+        self.assertEqual(sites, [row['site_id'] for row in everything['results']])
+        self.assertEqual(sites, sorted(sites))
+        self.assertGreater(len(sites), 2)
+        self.assertEqual({row['state'] for row in everything['results']}, {'UT', 'CO'})
+
+    def test_invalid_parameters(self):
+        metrics = dict(state='UT', model_id=MODEL)
+        for view, params in ((API_Controller.api_stations, {}),
+                             (API_Controller.api_stations, {'state': 'UT', 'huc': '16'}),
+                             (API_Controller.api_stations, {'state': 'UT', 'limit': 'ten'}),
+                             (API_Controller.api_stations, {'state': 'UT', 'limit': API_Controller.MAX_LIMIT + 1}),
+                             (API_Controller.api_stations, {'state': 'UT', 'cursor': 'not a cursor'}),
+                             (API_Controller.api_stations, {'state': 'UT', 'fields': 'site_id,password'}),
+                             (API_Controller.api_stations, {'huc': '160'}),
+                             (API_Controller.api_stations, {'reach_ids': '10126000,../x'}),
+                             (API_Controller.api_metrics, dict(WINDOW, state='UT')),
+                             (API_Controller.api_metrics, dict(WINDOW, state='UT', model_id='GR4J')),
+                             (API_Controller.api_metrics, dict(metrics, **{'start-date': '2010-01-01'})),
+                             (API_Controller.api_metrics, dict(metrics, **{'start-date': '2010-06-01',
+                                                                           'end-date': '2010-01-01'}))):
+            status, body = self.get(view, **params)
+            self.assertEqual(status, 400, params)
+            self.assertIn('error', body)
+
+    def test_metrics_match_the_views(self):
+        status, body = self.get(API_Controller.api_metrics, state='UT', model_id=MODEL, limit=3, **WINDOW)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['count'], 3)
+        self.assertIsNotNone(body['next'])
+        row = body['results'][0]
+        obs = read_series(usgs_key('UT', row['site_id']), USGS_FLOW, get_storage())
+        mod = read_series(model_key(MODEL, 'UT', row['NHD_id'], row['site_id']), flow_column(MODEL), get_storage())
+        expected = aligned_skill(align(obs, mod, WINDOW['start-date'], WINDOW['end-date']))
+        self.assertGreater(row['n'], 0)
+        self.assertEqual(row['n'], expected['n'])
+        self.assertAlmostEqual(row['kge'], expected['kge'], places=4)
+        self.assertAlmostEqual(row['rmse'], expected['rmse'], places=4)
+
+    def test_gzip(self):
+        request = RequestFactory().get('/', {'state': 'UT,CO'}, HTTP_ACCEPT_ENCODING='gzip')
+        response = API_Controller.api_stations(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        _, body = self.get(API_Controller.api_stations, state='UT,CO')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests of the alignment of observed and modeled series.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ..alignment import align, align_many, coverage_frame
+
+
+def series(start, values, dtype=np.float32):
+    index = pd.DatetimeIndex(pd.date_range(start, periods=len(values)), name='Datetime')
+    return pd.Series(np.asarray(values, dtype=dtype), index=index)
+
+
+class AlignTestCase(unittest.TestCase):
+
+    def test_pairs_the_common_days(self):
+        obs = series('2010-01-01', [1, 2, 3, 4, 5])
+        mod = series('2010-01-03', [30, 40, 50, 60])
+        aligned = align(obs, mod)
+        self.assertEqual(aligned.dates.strftime('%Y-%m-%d').tolist(), ['2010-01-03', '2010-01-04', '2010-01-05'])
+        np.testing.assert_array_equal(aligned.obs, [3, 4, 5])
+        np.testing.assert_array_equal(aligned.mod, [30, 40, 50])
+        self.assertEqual(aligned.coverage['days'], 6)
+        self.assertEqual(aligned.coverage['missing_paired'], 3)
+
+    def test_gaps(self):
+        obs = series('2010-01-01', [1, 2, 3, 4, 5, 6]).drop(pd.DatetimeIndex(['2010-01-02', '2010-01-05']))
+        mod = series('2010-01-01', [10, 20, 30, 40, 50, 60]).drop(pd.DatetimeIndex(['2010-01-03']))
+        aligned = align(obs, mod, '2010-01-01', '2010-01-06')
+        np.testing.assert_array_equal(aligned.obs, [1, 4, 6])
+        np.testing.assert_array_equal(aligned.mod, [10, 40, 60])
+        self.assertEqual({k: aligned.coverage[k] for k in ('days', 'observed', 'modeled', 'paired')},
+                         {'days': 6, 'observed': 4, 'modeled': 5, 'paired': 3})
+
+    def test_non_finite_flows_are_missing(self):
+        obs = series('2010-01-01', [1, np.nan, 3, np.inf, 5])
+        mod = series('2010-01-01', [10, 20, np.nan, 40, 50])
+        aligned = align(obs, mod)
+        np.testing.assert_array_equal(aligned.obs, [1, 5])
+        self.assertEqual(aligned.coverage['observed'], 3)
+        self.assertEqual(aligned.coverage['modeled'], 4)
+        self.assertEqual(aligned.coverage['missing_paired'], 3)
+
+    def test_window(self):
+        obs = series('2010-01-01', range(10))
+        mod = series('2010-01-01', range(10))
+        aligned = align(obs, mod, '2010-01-03', '2010-01-05')
+        np.testing.assert_array_equal(aligned.obs, [2, 3, 4])
+        self.assertEqual(aligned.coverage['start'], '2010-01-03')
+        #a window past the series has no days
+        aligned = align(obs, mod, '2011-01-01')
+        self.assertEqual(len(aligned), 0)
+        self.assertTrue(all(v >= 0 for k, v in aligned.coverage.items() if isinstance(v, int)))
+
+    def test_window_ending_before_it_starts(self):
+        obs = series('2010-01-01', range(10))
+        with self.assertRaises(ValueError):
+            align(obs, obs, '2010-01-05', '2010-01-03')
+        with self.assertRaises(ValueError):
+            align_many({'a': (obs, obs)}, '2010-01-05', '2010-01-03')
+
+    def test_empty_series(self):
+        empty = series('2010-01-01', [])
+        aligned = align(empty, series('2010-01-01', [1, 2]))
+        self.assertEqual(len(aligned), 0)
+        self.assertEqual(aligned.coverage['modeled'], 2)
+
+
+class AlignManyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.pairs = {}
+        for i in range(6):
+            obs = series(f"2010-01-{1 + i:02d}", rng.gamma(2, 50, 400))
+            obs[rng.random(len(obs)) < 0.1] = np.nan
+            mod = series('2010-01-01', rng.gamma(2, 50, 380), dtype=np.float64)
+            self.pairs[f"site{i}"] = (obs, mod.drop(mod.index[rng.random(len(mod)) < 0.05]))
+        self.pairs['empty'] = (series('2010-01-01', []), series('2010-01-01', [1.0]))
+
+    def assert_same(self, many, startdate, enddate):
+        for site, (obs, mod) in self.pairs.items():
+            one = align(obs, mod, startdate, enddate)
+            self.assertTrue(many[site].dates.equals(one.dates))
+            np.testing.assert_array_equal(many[site].obs, one.obs)
+            np.testing.assert_array_equal(many[site].mod, one.mod)
+            self.assertEqual(many[site].coverage, one.coverage)
+
+    def test_grid_matches_align(self):
+        self.assert_same(align_many(self.pairs, '2010-02-01', '2010-12-31'), '2010-02-01', '2010-12-31')
+
+    def test_open_window_matches_align(self):
+        self.assert_same(align_many(self.pairs), None, None)
+
+    def test_coverage_frame(self):
+        frame = coverage_frame(align_many(self.pairs, '2010-02-01', '2010-02-28'))
+        self.assertEqual(list(frame.index), list(self.pairs))
+        self.assertTrue((frame['days'] == 28).all())
+        self.assertTrue((frame[['missing_observed', 'missing_modeled', 'missing_paired']] >= 0).all().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
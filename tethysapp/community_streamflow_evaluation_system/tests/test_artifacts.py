@@ -0,0 +1,107 @@
+"""
+Tests of the materialized default views.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import RequestFactory
+
+from . import synthetic_bucket
+from .. import artifacts
+from ..storage import configure_storage, LocalStorage, MemoryStorage
+
+
+class ArtifactsTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..pyramids import configure_plot_max_points
+        from ..rolling import configure_rolling_windows
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        cls.root = os.path.join(cls.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(cls.root, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        cls.storage = LocalStorage(cls.root)
+        configure_storage(cls.storage)
+        configure_plot_max_points(500)
+        configure_rolling_windows([30])
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        artifacts.configure_artifact_dir(None)
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.output = os.path.join(tempfile.mkdtemp(dir=self.tmp.name), 'defaults')
+        artifacts.configure_artifact_dir(None)
+
+    def test_rebuilt_only_when_a_source_changes(self):
+        first, built = artifacts.build_defaults(self.output, self.storage)
+        self.assertTrue(built)
+        self.assertEqual(first['files'], sorted([artifacts.layer_file(v) for v in ('reach', 'huc', 'state')]
+                                                + [artifacts.PLOTS_FILE]))
+        self.assertIn(f"NWIS/NWIS_sites_UT.h5/NWIS_{synthetic_bucket.REACH_DEFAULT_SITES[0]}.csv", first['sources'])
+        self.assertEqual(artifacts.build_defaults(self.output, self.storage), (first, False))
+
+        #a source rewritten with other flows
+        path = self.storage.path(f"NWIS/NWIS_sites_UT.h5/NWIS_{synthetic_bucket.REACH_DEFAULT_SITES[0]}.csv")
+        with open(path) as f:
+            lines = f.read().splitlines()
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines[:1] + [line.rsplit(',', 1)[0] + ',1.0' for line in lines[1:]]) + '\n')
+        second, built = artifacts.build_defaults(self.output, self.storage)
+        self.assertTrue(built)
+        self.assertNotEqual(second['version'], first['version'])
+        #the version before is kept for requests in flight
+        self.assertTrue(os.path.isdir(os.path.join(self.output, first['version'])))
+
+    def test_changed_sources(self):
+        storage = MemoryStorage({'a.csv': b'1', 'b.csv': b'2'})
+        sources = {'a.csv': storage.fingerprint('a.csv'), 'b.csv': 'old', 'deleted.csv': 'old'}
+        self.assertEqual(artifacts.changed_sources(sources, storage), ['b.csv', 'deleted.csv'])
+        #an outage is not a change
+        with mock.patch.object(storage, 'fingerprint', side_effect=ConnectionError('endpoint unreachable')):
+            with self.assertRaises(ConnectionError):
+                artifacts.changed_sources(sources, storage)
+
+    def test_views_served_from_the_artifacts(self):
+        from ..Reach_Controller import Reach_Eval
+        from ..controllers import default_view_file
+
+        current, _ = artifacts.build_defaults(self.output, self.storage, force=True)
+        artifacts.configure_artifact_dir(self.output)
+        self.assertEqual(artifacts.manifest()['version'], current['version'])
+        layer = artifacts.default_layer('reach')
+        sites = [f['properties']['id'] for f in layer['geojson']['features']]
+        self.assertEqual(sorted(sites), sorted(synthetic_bucket.REACH_DEFAULT_SITES))
+
+        props = layer['geojson']['features'][0]['properties']
+        artifacts.configure_artifact_dir(None)
+        live = Reach_Eval().get_plot_for_layer_feature(RequestFactory().get('/'), 'USGS Stations', props['id'], {},
+                                                       props, None)
+        artifacts.configure_artifact_dir(self.output)
+        self.assertEqual(list(artifacts.default_plot(props['id'])), json.loads(json.dumps(list(live))))
+
+        request = RequestFactory().get('/')
+        response = default_view_file(request, current['version'], artifacts.PLOTS_FILE)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+        response = default_view_file(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag), current['version'],
+                                     artifacts.PLOTS_FILE)
+        self.assertEqual(response.status_code, 304)
+        for version, name in ((current['version'], artifacts.MANIFEST_FILE), (current['version'], '../manifest.json'),
+                              ('..', artifacts.PLOTS_FILE), ('0' * 16, artifacts.PLOTS_FILE)):
+            self.assertEqual(default_view_file(request, version, name).status_code, 404, (version, name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Tests of the worker's LRU cache of parsed objects.
+"""
+import threading
+import time
+import unittest
+
+from ..cache import LRUCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 0)
+        cache.get('c', lambda: 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats(), {'entries': 2, 'maxsize': 2, 'hits': 1, 'misses': 3})
+
+    def test_concurrent_misses_load_once(self):
+        cache = LRUCache()
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('key', load))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_are_not_cached(self):
+        cache = LRUCache()
+
+        def fail():
+            raise KeyError('key')
+
+        with self.assertRaises(KeyError):
+            cache.get('key', fail)
+        self.assertNotIn('key', cache)
+        self.assertEqual(cache.get('key', lambda: 'value'), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
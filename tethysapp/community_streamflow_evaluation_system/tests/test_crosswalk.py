@@ -0,0 +1,67 @@
+"""
+Tests of the gage/waterbody crosswalk and the hydrofabric series keys.
+"""
+import unittest
+
+from ..crosswalk import Crosswalk, load_crosswalk
+from ..network import Network
+from ..series import model_key, model_keys, configure_hydrofabric_models
+
+
+#gage G1 on wb-1 and wb-2, wb-1 drains to wb-2; wb-3 holds G2 and G3
+MAPPING = {'wb-1': {'Gage_no': ['G1']}, 'wb-2': {'Gage_no': ['G1']}, 'wb-3': {'Gage_no': ['G2', 'G3']},
+           'wb-4': {}}
+EDGES = [{'id': 'wb-1', 'toid': 'nex-1'}, {'id': 'nex-1', 'toid': 'wb-2'}, {'id': 'wb-3', 'toid': 'nex-3'}]
+
+
+class CrosswalkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.crosswalk = Crosswalk(MAPPING)
+
+    def test_both_directions(self):
+        self.assertEqual(len(self.crosswalk), 4)
+        self.assertEqual(self.crosswalk.waterbody_lists(['G1', 'G2', 'G9']), {'G1': ['wb-1', 'wb-2'], 'G2': ['wb-3']})
+        positions, gages = self.crosswalk.gages(['wb-4', 'wb-3', 'wb-9'])
+        self.assertEqual(positions.tolist(), [1, 1])
+        self.assertEqual(sorted(gages), ['G2', 'G3'])
+        wbs, gages = self.crosswalk.pairs()
+        self.assertEqual(sorted(zip(wbs, gages)), [('wb-1', 'G1'), ('wb-2', 'G1'), ('wb-3', 'G2'), ('wb-3', 'G3')])
+
+    def test_empty_lookups(self):
+        positions, wbs = self.crosswalk.waterbodies([])
+        self.assertEqual((len(positions), len(wbs)), (0, 0))
+        positions, wbs = Crosswalk({}).waterbodies(['G1'])
+        self.assertEqual(len(positions), 0)
+
+    def test_outlet_is_the_most_downstream(self):
+        network = Network(EDGES, MAPPING)
+        self.assertEqual(self.crosswalk.outlet_waterbodies(['G9', 'G1', 'G2'], network), [None, 'wb-2', 'wb-3'])
+        #without a network the first listed
+        self.assertEqual(self.crosswalk.outlet_waterbodies(['G1']), ['wb-1'])
+
+    def test_sample_hydrofabric(self):
+        crosswalk = load_crosswalk()
+        self.assertIs(load_crosswalk(), crosswalk)
+        self.assertEqual(crosswalk.waterbody_lists(['02453000']), {'02453000': ['wb-114271', 'wb-114272']})
+
+
+class HydrofabricKeyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        configure_hydrofabric_models(['NextGen'])
+
+    def test_gage_resolves_to_its_outlet_waterbody(self):
+        self.assertEqual(model_key('NextGen', 'FL', 1, '02453000'), 'NextGen/hydrofabric/NextGen_wb-114272.csv')
+        self.assertEqual(model_keys('NextGen', [('FL', 1, '02453000'), ('UT', 2, '10126000')]),
+                         ['NextGen/hydrofabric/NextGen_wb-114272.csv', None])
+        with self.assertRaises(KeyError):
+            model_key('NextGen', 'UT', 2, '10126000')
+
+    def test_other_models_use_the_reach(self):
+        self.assertEqual(model_key('NWM_v3.0', 'FL', 1, '02453000'), 'NWM_v3.0/NHD_segments_FL.h5/NWM_v3.0_1.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
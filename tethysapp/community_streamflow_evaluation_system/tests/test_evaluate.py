@@ -0,0 +1,118 @@
+"""
+Tests of the cses-evaluate batch evaluator.
+"""
+import importlib.util
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from . import synthetic_bucket
+from .. import evaluate
+from ..alignment import align
+from ..metrics import aligned_skill
+from ..series import read_series, usgs_key, model_key, flow_column, configure_hydrofabric_models, USGS_FLOW
+from ..storage import LocalStorage
+
+
+MODEL = 'NWM_v2.1'
+WINDOW = ('2010-01-01', '2010-12-31')
+
+
+class EvaluateTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        cls.root = os.path.join(cls.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(cls.root, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        cls.storage = LocalStorage(cls.root)
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp(dir=self.tmp.name)
+
+    def evaluate(self, stations, chunk_size=2):
+        units = evaluate.plan(stations, [MODEL], [WINDOW], self.output, chunk_size)
+        return units, sum(evaluate.evaluate_unit(unit, self.storage) for unit in units)
+
+    def test_scores_match_the_views(self):
+        stations = evaluate.select_stations(self.storage, states=['UT'])
+        self.evaluate(stations)
+        scores = evaluate.read_scores(self.output).set_index('site_id')
+        self.assertEqual(sorted(scores.index), sorted(s for s, _, _ in stations))
+        site, state, NHD_id = stations[0]
+        obs = read_series(usgs_key(state, site), USGS_FLOW, self.storage)
+        mod = read_series(model_key(MODEL, state, NHD_id, site), flow_column(MODEL), self.storage)
+        expected = aligned_skill(align(obs, mod, *WINDOW))
+        self.assertEqual(scores.loc[site, 'n'], expected['n'])
+        self.assertAlmostEqual(scores.loc[site, 'kge'], expected['kge'], places=6)
+        self.assertEqual(set(scores['state']), {'UT'})
+
+    def test_rerun_resumes(self):
+        stations = evaluate.select_stations(self.storage, states=['UT'])
+        _, written = self.evaluate(stations)
+        self.assertGreater(written, 0)
+        units, written = self.evaluate(stations)
+        self.assertEqual((units, written), ([], 0))
+
+    def test_other_selection_does_not_reuse_parts(self):
+        ut = evaluate.select_stations(self.storage, states=['UT'])
+        #the last station alone, chunk 0 of this selection but not of the next
+        self.evaluate(ut[-1:])
+        units, _ = self.evaluate(ut)
+        self.assertTrue(units)
+        scores = evaluate.read_scores(self.output)
+        self.assertEqual(sorted(scores['site_id']), sorted(s for s, _, _ in ut))
+
+    def test_missing_series_score_zero_days(self):
+        stations = evaluate.select_stations(self.storage, states=['UT'])[:1] + [('09999999', 'UT', 1)]
+        self.evaluate(stations)
+        scores = evaluate.read_scores(self.output).set_index('site_id')
+        self.assertEqual(scores.loc['09999999', 'n'], 0)
+        self.assertGreater(scores.loc[stations[0][0], 'n'], 0)
+
+    def test_reader_errors_fail_the_unit(self):
+        from ..cache import clear_caches
+        from ..storage import MemoryStorage
+        site, state, NHD_id = evaluate.select_stations(self.storage, states=['UT'])[0]
+        storage = MemoryStorage({usgs_key(state, site): b'Datetime,USGS_flow\nyesterday,1.0\n'})
+        clear_caches()
+        unit = evaluate.plan([(site, state, NHD_id)], [MODEL], [WINDOW], self.output)[0]
+        with self.assertRaises(Exception) as raised:
+            evaluate.score_unit(unit, storage)
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+
+    def test_split_models(self):
+        stations = evaluate.select_stations(self.storage, states=['UT'])
+        units = evaluate.plan(stations, [MODEL, 'NWM_v3.0'], [WINDOW], self.output, chunk_size=2)
+        split = evaluate.split_models(units)
+        self.assertEqual(len(split), 2 * len(units))
+        self.assertEqual(sum(len(u['todo']) for u in split), sum(len(u['todo']) for u in units))
+        self.assertTrue(all({m for m, _, _ in u['todo']} == {u['model_id']} for u in split))
+
+    @unittest.skipUnless(importlib.util.find_spec('distributed'), 'dask.distributed is not installed')
+    def test_dask_matches_the_process_pool(self):
+        stations = evaluate.select_stations(self.storage, states=['UT'])
+        self.evaluate(stations)
+        expected = evaluate.read_scores(self.output)
+        output = tempfile.mkdtemp(dir=self.tmp.name)
+        units = evaluate.plan(stations, [MODEL], [WINDOW], output, chunk_size=2)
+        with redirect_stdout(StringIO()):
+            written = evaluate.run_dask(units, 'local', self.root, ['NextGen'], workers=1)
+        self.assertEqual(written, sum(len(u['todo']) for u in units))
+        scores = evaluate.read_scores(output)
+        self.assertTrue(scores.equals(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
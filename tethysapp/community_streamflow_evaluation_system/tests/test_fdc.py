@@ -0,0 +1,45 @@
+"""
+Tests of the flow duration curves beside the hydrograph.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ..alignment import Aligned
+from ..fdc import add_fdc
+from ..metrics import batch_fdc
+
+
+def aligned(obs, mod):
+    dates = pd.date_range('2010-01-01', periods=len(obs), name='Datetime')
+    return Aligned(dates, np.asarray(obs, dtype=np.float32), np.asarray(mod, dtype=np.float32), {})
+
+
+class AddFdcTestCase(unittest.TestCase):
+
+    def test_curves_on_their_own_axes(self):
+        obs = np.random.default_rng(0).gamma(2, 50, 365)
+        pair = aligned(obs, obs * 1.1)
+        #after the rolling panels, which take y2 to y4
+        data, layout = [], {'yaxis': {'domain': [0.5, 1.0]}, 'yaxis2': {}, 'yaxis3': {}, 'yaxis4': {}}
+        add_fdc(data, layout, pair, 'NWM_v2.1')
+        self.assertEqual(len(data), 2)
+        self.assertEqual({(t['xaxis'], t['yaxis']) for t in data}, {('x2', 'y5')})
+        self.assertEqual(layout['yaxis5']['type'], 'log')
+        self.assertEqual(layout['yaxis5']['domain'], [0.5, 1.0])
+        self.assertLessEqual(layout['xaxis']['domain'][1], layout['xaxis2']['domain'][0])
+        self.assertIn('high 10.0%', data[1]['name'])
+        expected = batch_fdc([pair])
+        np.testing.assert_allclose(data[0]['y'], np.round(expected['obs'][0], 4))
+        self.assertEqual(data[0]['x'][0], 0.0)
+        self.assertEqual(data[0]['x'][-1], 100.0)
+
+    def test_no_paired_days(self):
+        data, layout = [], {}
+        add_fdc(data, layout, aligned([np.nan, 1.0], [2.0, np.nan]), 'NWM_v2.1')
+        self.assertEqual((data, layout), ([], {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
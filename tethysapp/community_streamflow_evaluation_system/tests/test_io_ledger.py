@@ -0,0 +1,72 @@
+"""
+Tests of the per-request I/O ledger and its budgets.
+"""
+import unittest
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from .. import io_ledger
+from ..cache import clear_caches
+from ..io_ledger import IOLedger, IOLedgerMixin, IOBudgetExceeded, tracking
+from ..overlay import read_all
+from ..storage import MemoryStorage
+
+
+STORAGE = MemoryStorage({f"NWIS/{i}.csv": b'Datetime,USGS_flow\n2010-01-01,1.0\n' for i in range(3)})
+
+
+class View:
+
+    def dispatch(self, request, *args, **kwargs):
+        for key in ('NWIS/0.csv', 'NWIS/1.csv', 'NWIS/0.csv'):
+            STORAGE.read_bytes(key)
+        return HttpResponse('ok')
+
+
+class LedgerView(IOLedgerMixin, View):
+    pass
+
+
+class IOLedgerTestCase(unittest.TestCase):
+
+    def test_reads_and_duplicates(self):
+        with tracking(IOLedger('test')) as ledger:
+            STORAGE.read_bytes('NWIS/0.csv')
+            STORAGE.read_bytes('NWIS/0.csv')
+            STORAGE.read_bytes('NWIS/1.csv')
+        STORAGE.read_bytes('NWIS/2.csv')
+        summary = ledger.to_dict()
+        self.assertEqual((summary['gets'], summary['duplicates']), (3, {'NWIS/0.csv': 2}))
+        self.assertEqual(summary['bytes'], 3 * len(b'Datetime,USGS_flow\n2010-01-01,1.0\n'))
+
+    def test_reads_on_threads_are_recorded(self):
+        clear_caches()
+        with tracking(IOLedger('threads')) as ledger:
+            read_all([(f"NWIS/{i}.csv", 'USGS_flow') for i in range(3)], STORAGE)
+        self.assertEqual(sorted(key for key, _, _, _ in ledger.reads), [f"NWIS/{i}.csv" for i in range(3)])
+
+    def test_budget(self):
+        ledger = IOLedger('budget', max_gets=1, reject=True)
+        ledger.record('a', 1, 0.0, 'memory')
+        with self.assertRaises(IOBudgetExceeded):
+            ledger.record('b', 1, 0.0, 'memory')
+        self.assertTrue(ledger.over_budget())
+        self.assertFalse(IOLedger('bytes', max_bytes=10).over_budget())
+
+    def test_views_over_budget(self):
+        with mock.patch.object(io_ledger, '_settings', (None, 2, True, False)):
+            response = LedgerView().dispatch(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 503)
+        with mock.patch.object(io_ledger, '_settings', (None, 2, False, False)), \
+                self.assertLogs(io_ledger.log, 'WARNING') as logs:
+            response = LedgerView().dispatch(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('more than once' in line for line in logs.output))
+        self.assertTrue(any('over I/O budget' in line for line in logs.output))
+        self.assertEqual(io_ledger.recent_ledgers()[0]['gets'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
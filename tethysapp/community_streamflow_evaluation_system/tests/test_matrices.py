@@ -0,0 +1,78 @@
+"""
+Tests of the site x day flow matrices.
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from . import synthetic_bucket
+from ..alignment import align
+from ..cache import clear_caches
+from ..evaluate import select_stations
+from ..matrices import build_matrices, Matrices, OBSERVED
+from ..metrics import aligned_skill, METRICS
+from ..series import read_series, usgs_key, model_key, flow_column, configure_hydrofabric_models, USGS_FLOW
+from ..series_store import configure_series_store
+from ..storage import LocalStorage, MemoryStorage
+
+
+MODEL = 'NWM_v2.1'
+
+
+class MatricesTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        root = os.path.join(cls.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(root, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        cls.storage = LocalStorage(root)
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+        clear_caches()
+        cls.stations = select_stations(cls.storage, states=['UT'])
+        cls.output = os.path.join(cls.tmp.name, 'matrices')
+        cls.shape = build_matrices(cls.output, cls.stations + [('09999999', 'UT', 1)], [MODEL], cls.storage,
+                                   '2009-12-01', '2010-12-31')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_layout(self):
+        matrices = Matrices(self.output)
+        self.assertEqual(self.shape, (len(self.stations) + 1, 396))
+        self.assertEqual(list(matrices.sites), sorted(s for s, _, _ in self.stations + [('09999999', 'UT', 1)]))
+        self.assertEqual(matrices.sources(), sorted([OBSERVED, MODEL]))
+        self.assertEqual(matrices.matrix(OBSERVED).shape, self.shape)
+        #the sites without series are a row of NaN
+        self.assertTrue(np.isnan(matrices.matrix(OBSERVED)[matrices.rows(['09999999'])[0]]).all())
+
+    def test_scores_match_the_views(self):
+        matrices = Matrices(self.output)
+        sites = [s for s, _, _ in self.stations] + ['09999999', '00000000']
+        scores = matrices.score(MODEL, '2010-02-01', '2010-11-30', sites).set_index('site_id')
+        for site, state, NHD_id in self.stations:
+            obs = read_series(usgs_key(state, site), USGS_FLOW, self.storage)
+            mod = read_series(model_key(MODEL, state, NHD_id, site), flow_column(MODEL), self.storage)
+            expected = aligned_skill(align(obs, mod, '2010-02-01', '2010-11-30'))
+            for metric in METRICS:
+                self.assertAlmostEqual(scores.loc[site, metric], expected[metric], places=6, msg=metric)
+        self.assertEqual(scores.loc['09999999', 'n'], 0)
+        self.assertEqual(scores.loc['00000000', 'n'], 0)
+        self.assertTrue(np.isnan(scores.loc['00000000', 'kge']))
+
+    def test_reader_errors_fail_the_build(self):
+        site, state, NHD_id = self.stations[0]
+        clear_caches()
+        storage = MemoryStorage({usgs_key(state, site): b'Datetime,USGS_flow\nyesterday,1.0\n'})
+        with self.assertRaises(Exception) as raised:
+            build_matrices(os.path.join(self.tmp.name, 'broken'), [(site, state, NHD_id)], [], storage,
+                           '2010-01-01', '2010-01-31')
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+
+if __name__ == '__main__':
+    unittest.main()
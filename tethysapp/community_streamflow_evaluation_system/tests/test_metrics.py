@@ -0,0 +1,158 @@
+"""
+Tests of the skill metrics against sklearn and hydroeval.
+"""
+import unittest
+
+import hydroeval as he
+import numpy as np
+import pandas as pd
+from sklearn.metrics import r2_score, mean_squared_error, max_error
+
+from ..alignment import Aligned, day_numbers
+from ..metrics import (aligned_skill, batch_skill, paired_sums, rolling_skill, batch_fdc, matrix_fdc,
+                       METRICS, FDC_METRICS, EXCEEDANCE)
+
+
+def aligned(obs, mod):
+    dates = pd.date_range('2010-01-01', periods=len(obs), name='Datetime')
+    return Aligned(dates, np.asarray(obs, dtype=np.float32), np.asarray(mod, dtype=np.float32), {})
+
+
+def make_pairs(rng, k=8):
+    pairs = []
+    for i in range(k):
+        obs = rng.gamma(2, 50, 30 + 40 * i)
+        pairs.append(aligned(obs, obs * rng.uniform(0.6, 1.4) + rng.normal(0, 10, len(obs))))
+    pairs.append(aligned([], []))
+    return pairs
+
+
+class SkillTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_matches_sklearn_and_hydroeval(self):
+        for pair in make_pairs(self.rng)[:-1]:
+            obs, mod = pair.obs.astype(np.float64), pair.mod.astype(np.float64)
+            stats = aligned_skill(pair)
+            self.assertEqual(stats['n'], len(obs))
+            self.assertAlmostEqual(stats['r2'], r2_score(obs, mod), places=8)
+            self.assertAlmostEqual(stats['rmse'], mean_squared_error(obs, mod) ** 0.5, places=6)
+            self.assertAlmostEqual(stats['maxerror'], max_error(obs, mod), places=6)
+            kge, r, _, _ = he.evaluator(he.kge, mod, obs).ravel()
+            self.assertAlmostEqual(stats['kge'], kge, places=8)
+            self.assertAlmostEqual(stats['r'], r, places=8)
+            self.assertAlmostEqual(stats['r2'], he.evaluator(he.nse, mod, obs)[0], places=8)
+            #hydroeval's bias is positive when the model is low
+            self.assertAlmostEqual(stats['pbias'], -he.evaluator(he.pbias, mod, obs)[0], places=6)
+
+    def test_unpaired_days_are_left_out(self):
+        pair = aligned([1.0, 2.0, np.nan, 4.0], [1.5, np.nan, 3.0, 3.0])
+        stats = aligned_skill(pair)
+        self.assertEqual(stats['n'], 2)
+        self.assertAlmostEqual(stats['maxerror'], 1.0)
+
+    def test_empty(self):
+        stats = aligned_skill(aligned([], []))
+        self.assertEqual(stats['n'], 0)
+        self.assertTrue(np.isnan(stats['maxerror']) and np.isnan(stats['kge']))
+
+    def test_batch_matches_each_pair(self):
+        pairs = make_pairs(self.rng)
+        pairs[0].obs = pairs[0].obs.copy()
+        pairs[0].obs[::3] = np.nan
+        columns = batch_skill(pairs)
+        for i, pair in enumerate(pairs):
+            stats = aligned_skill(pair)
+            for metric in METRICS:
+                np.testing.assert_allclose(columns[metric][i], stats[metric], rtol=1e-9, equal_nan=True,
+                                           err_msg=f"{metric} of pair {i}")
+
+    def test_batch_of_nothing(self):
+        columns = batch_skill([])
+        self.assertTrue(all(len(columns[metric]) == 0 for metric in METRICS))
+
+
+class RollingTestCase(unittest.TestCase):
+
+    def test_matches_each_window(self):
+        rng = np.random.default_rng(1)
+        dates = pd.date_range('2010-01-01', periods=200, name='Datetime')
+        obs = rng.gamma(2, 50, len(dates))
+        mod = obs * 1.2 + rng.normal(0, 10, len(dates))
+        obs[rng.random(len(obs)) < 0.2] = np.nan
+        #gaps in the record as well as unpaired days
+        keep = rng.random(len(dates)) > 0.1
+        dates, obs, mod = dates[keep], obs[keep], mod[keep]
+        days = day_numbers(dates)
+        ok, sums = paired_sums(obs, mod)
+        rolled = rolling_skill(days[ok], sums, window=30)
+        for row, day in enumerate(days[ok]):
+            inside = ok & (days > day - 30) & (days <= day)
+            stats = aligned_skill(aligned(obs[inside], mod[inside]))
+            self.assertEqual(rolled['n'][row], stats['n'])
+            if stats['n'] < 15:
+                self.assertTrue(np.isnan(rolled['kge'][row]))
+                continue
+            for metric, expected in (('nse', stats['r2']), ('rmse', stats['rmse']), ('kge', stats['kge']),
+                                     ('pbias', stats['pbias'])):
+                self.assertAlmostEqual(rolled[metric][row], expected, places=3, msg=f"{metric} on day {row}")
+
+    def test_empty(self):
+        rolled = rolling_skill(np.empty(0, dtype=np.int64), np.empty((7, 0)), window=30)
+        self.assertEqual(len(rolled['nse']), 0)
+
+
+def reference_fdc(obs, mod):
+    #one station at a time, Yilmaz et al. (2008)
+    ok = np.isfinite(obs) & np.isfinite(mod)
+    obs, mod = -np.sort(-obs[ok]), -np.sort(-mod[ok])
+    n = len(obs)
+    curve = lambda desc, p: np.interp(np.asarray(p) * (n - 1), np.arange(n), desc)
+    log = lambda flows: np.log(np.maximum(flows, 0.01))
+    high = max(int(np.ceil(0.02 * n)), 1)
+    fhv = 100.0 * (mod[:high].sum() - obs[:high].sum()) / obs[:high].sum()
+    obs_slope = log(curve(obs, 0.2)) - log(curve(obs, 0.7))
+    fms = 100.0 * ((log(curve(mod, 0.2)) - log(curve(mod, 0.7))) - obs_slope) / obs_slope
+    low = int(np.floor(0.7 * n))
+    obs_low = (log(obs[low:]) - log(obs[-1])).sum()
+    mod_low = (log(mod[low:]) - log(mod[-1])).sum()
+    flv = -100.0 * (mod_low - obs_low) / obs_low
+    return {'obs': curve(obs, EXCEEDANCE), 'mod': curve(mod, EXCEEDANCE), 'fhv': fhv, 'fms': fms, 'flv': flv}
+
+
+class FdcTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = make_pairs(np.random.default_rng(2))
+        self.pairs[1].mod = self.pairs[1].mod.copy()
+        self.pairs[1].mod[::4] = np.nan
+
+    def test_batch_matches_each_pair(self):
+        columns = batch_fdc(self.pairs)
+        for i, pair in enumerate(self.pairs[:-1]):
+            expected = reference_fdc(pair.obs.astype(np.float64), pair.mod.astype(np.float64))
+            for key in ('obs', 'mod') + tuple(FDC_METRICS):
+                np.testing.assert_allclose(columns[key][i], expected[key], rtol=1e-9, err_msg=f"{key} of pair {i}")
+        self.assertTrue(np.isnan(columns['obs'][-1]).all() and np.isnan(columns['fhv'][-1]))
+
+    def test_matrix_matches_batch(self):
+        width = max(len(p) for p in self.pairs)
+        pad = lambda values: np.concatenate([values, np.full(width - len(values), np.nan)])
+        obs = np.vstack([pad(p.obs.astype(np.float64)) for p in self.pairs])
+        mod = np.vstack([pad(p.mod.astype(np.float64)) for p in self.pairs])
+        batch, matrix = batch_fdc(self.pairs), matrix_fdc(obs, mod)
+        for key in ('obs', 'mod') + tuple(FDC_METRICS):
+            np.testing.assert_allclose(matrix[key], batch[key], rtol=1e-12, equal_nan=True)
+
+    def test_scaled_model(self):
+        obs = np.random.default_rng(3).gamma(2, 50, 365)
+        columns = batch_fdc([aligned(obs, obs * 1.1)])
+        self.assertAlmostEqual(columns['fhv'][0], 10.0, places=4)
+        self.assertAlmostEqual(columns['fms'][0], 0.0, places=4)
+        self.assertAlmostEqual(columns['flv'][0], 0.0, places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of the NextGen network graph and the Network evaluation view.
+"""
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from django.test import RequestFactory
+
+from . import synthetic_bucket
+from ..network import Network, load_network
+from ..query import QueryError
+from ..storage import configure_storage, LocalStorage
+
+
+WORKSPACE = SimpleNamespace(path=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'workspaces',
+                                              'app_workspace'))
+
+
+def chain(*ids):
+    return [{'id': a, 'toid': b} for a, b in zip(ids, ids[1:])]
+
+
+class NetworkTestCase(unittest.TestCase):
+    """
+    Two headwater branches joining above an outlet, with a gauge on each branch and one at the outlet.
+    """
+
+    def setUp(self):
+        crosswalk = {'wb-1': {'Gage_no': ['A']}, 'wb-2': {'Gage_no': ['B']}, 'wb-4': {'Gage_no': ['C']}}
+        self.network = Network(self.network_edges(), crosswalk)
+
+    def test_traversals(self):
+        self.assertEqual(self.network.outlets(), ['nex-4'])
+        self.assertEqual(self.network.downstream('wb-2'), ['wb-2', 'nex-2', 'wb-3', 'nex-3', 'wb-4', 'nex-4'])
+        self.assertEqual(set(self.network.upstream('wb-3')), {'wb-1', 'nex-1', 'wb-2', 'nex-2', 'wb-3'})
+        self.assertEqual(set(self.network.subnetwork_gauges('C')), {'A', 'B', 'C'})
+        self.assertEqual(self.network.subnetwork_gauges('nex-1'), ['A'])
+        self.assertEqual(set(self.network.subnetwork_gauges('wb-3')), {'A', 'B'})
+
+    def test_unknown_outlet(self):
+        with self.assertRaises(KeyError):
+            self.network.subnetwork_gauges('wb-99')
+
+    def test_cycle_rejected(self):
+        with self.assertRaises(ValueError):
+            Network(chain('wb-1', 'nex-1', 'wb-2', 'nex-2', 'wb-1'))
+
+    def test_upstream_gauge_counts(self):
+        self.assertEqual(self.network.upstream_gauge_counts(['A', 'B', 'C', 'X']), [0, 0, 2, 0])
+
+    def test_upstream_gauge_counts_of_a_gauge_on_several_waterbodies(self):
+        network = Network(self.network_edges(), {'wb-1': {'Gage_no': ['A']}, 'wb-2': {'Gage_no': ['A']},
+                                                 'wb-3': {'Gage_no': ['D']}, 'wb-4': {'Gage_no': ['C']}})
+        gauges = ['A', 'C', 'D']
+        self.assertEqual(network.upstream_gauge_counts(gauges), [len(network.upstream_gauges(g)) for g in gauges])
+        self.assertEqual(network.upstream_gauge_counts(gauges), [0, 2, 1])
+
+    def test_sample_hydrofabric_counts_match_traversals(self):
+        network = load_network(os.path.join(WORKSPACE.path, 'sample_nextgen_data', 'config'))
+        gauges = list(dict.fromkeys(network.gauge_ids.tolist()))
+        self.assertEqual(network.upstream_gauge_counts(gauges), [len(network.upstream_gauges(g)) for g in gauges])
+
+    @staticmethod
+    def network_edges():
+        return chain('wb-1', 'nex-1', 'wb-3', 'nex-3', 'wb-4', 'nex-4') + chain('wb-2', 'nex-2', 'wb-3')
+
+
+class NetworkEvalTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        configure_storage(LocalStorage(cls.tmp.name))
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def compose(self, outlet_id):
+        from ..Network_Controller import Network_Eval
+        request = RequestFactory().get('/', {'outlet_id': outlet_id, 'model_id': 'NWM_v2.1',
+                                             'start-date': '2010-01-01', 'end-date': '2010-12-31'})
+        map_view = {'view': {}}
+        return Network_Eval().compose_layers(request, map_view, WORKSPACE), map_view
+
+    def test_outlet_without_gauges_is_not_found(self):
+        with self.assertRaises(QueryError) as raised:
+            self.compose('nex-122631')
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(raised.exception.field, 'outlet_id')
+
+    def test_unknown_outlet_is_not_found(self):
+        with self.assertRaises(QueryError) as raised:
+            self.compose('not-a-node')
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_subnetwork_of_a_gauge(self):
+        layers, map_view = self.compose(synthetic_bucket.NETWORK_DEFAULT_SITES[-1])
+        features = layers[0]['layers'][0]['options']['features']
+        self.assertTrue(features)
+        counts = {f['properties']['USGS_id']: f['properties']['upstream_gauges'] for f in features}
+        self.assertEqual(counts[synthetic_bucket.NETWORK_DEFAULT_SITES[-1]], len(features) - 1)
+        self.assertEqual(len(map_view['view']['extent']), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of the NextGen run ingest and scoring.
+"""
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from .. import nextgen
+from ..network import Network
+from ..storage import MemoryStorage
+
+
+#nex-1 and nex-2 drain to gauge A on wb-3, which drains with nex-4 to gauge B on wb-5; nex-9 drains to no gauge
+EDGES = [('nex-1', 'wb-3'), ('nex-2', 'wb-3'), ('wb-3', 'nex-3'), ('nex-3', 'wb-5'), ('nex-4', 'wb-5'),
+         ('wb-5', 'nex-5'), ('nex-9', 'wb-9')]
+CROSSWALK = {'wb-3': {'Gage_no': ['A']}, 'wb-5': {'Gage_no': ['B']}}
+#m3/s per nexus, hourly over the two days of the run
+FLOWS = {'nex-1': 1.0, 'nex-2': 2.0, 'nex-3': 4.0, 'nex-4': 8.0, 'nex-9': 16.0}
+
+
+class IngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        self.config = os.path.join(self.tmp.name, 'config')
+        self.outputs = os.path.join(self.tmp.name, 'outputs')
+        os.makedirs(self.config)
+        os.makedirs(self.outputs)
+        with open(os.path.join(self.config, 'flowpath_edge_list.json'), 'w') as f:
+            json.dump([{'id': a, 'toid': b} for a, b in EDGES], f)
+        with open(os.path.join(self.config, 'crosswalk.json'), 'w') as f:
+            json.dump(CROSSWALK, f)
+        with open(os.path.join(self.config, 'awi_simplified_realization.json'), 'w') as f:
+            json.dump({'time': {'start_time': '2022-08-24 00:00:00', 'end_time': '2022-08-25 23:00:00'}}, f)
+        times = pd.date_range('2022-08-24', periods=48, freq='h')
+        for nexus, flow in FLOWS.items():
+            pd.DataFrame({'step': range(len(times)), 'time': times.strftime('%Y-%m-%d %H:%M:%S'), 'flow': flow}) \
+                .to_csv(os.path.join(self.outputs, f"{nexus}_output.csv"), header=False, index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_gauges_sum_the_nexus_outputs_upstream(self):
+        ingested = nextgen.ingest_run(self.outputs, self.config, workers=2)
+        self.assertEqual(sorted(ingested), ['A', 'B'])
+        wb, a = ingested['A']
+        self.assertEqual(wb, 'wb-3')
+        np.testing.assert_allclose(a.to_numpy(), [3.0 * nextgen.M3S_TO_CFS] * 2, rtol=1e-6)
+        np.testing.assert_allclose(ingested['B'][1].to_numpy(), [15.0 * nextgen.M3S_TO_CFS] * 2, rtol=1e-6)
+
+    def test_days_without_output_are_nan(self):
+        os.remove(os.path.join(self.outputs, 'nex-4_output.csv'))
+        os.remove(os.path.join(self.outputs, 'nex-3_output.csv'))
+        for nexus in ('nex-1', 'nex-2'):
+            path = os.path.join(self.outputs, f"{nexus}_output.csv")
+            rows = open(path).read().splitlines()[:24]
+            with open(path, 'w') as f:
+                f.write('\n'.join(rows) + '\n')
+        flows = nextgen.ingest_run(self.outputs, self.config, workers=2)['B'][1].to_numpy()
+        self.assertAlmostEqual(float(flows[0]), 3.0 * nextgen.M3S_TO_CFS, places=3)
+        self.assertTrue(np.isnan(flows[1]))
+
+    def test_nearest_downstream(self):
+        network = Network([{'id': a, 'toid': b} for a, b in EDGES], CROSSWALK)
+        targets = np.array([network.node('wb-3'), network.node('wb-5')])
+        label = network.nearest_downstream(targets)
+        labels = {node: int(label[network.node(node)]) for node in ('nex-1', 'wb-3', 'nex-3', 'nex-4', 'nex-5',
+                                                                     'nex-9')}
+        self.assertEqual(labels, {'nex-1': 0, 'wb-3': 0, 'nex-3': 1, 'nex-4': 1, 'nex-5': -1, 'nex-9': -1})
+
+    def test_split_network_rejected(self):
+        network = Network([{'id': 'nex-1', 'toid': 'wb-1'}, {'id': 'nex-1', 'toid': 'wb-2'}])
+        with self.assertRaises(ValueError):
+            network.nearest_downstream(np.array([network.node('wb-1')]))
+
+    def test_outputs_required(self):
+        with redirect_stderr(StringIO()), self.assertRaises(SystemExit):
+            nextgen.main(['--config', self.config])
+
+
+class ScoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        dates = pd.date_range('2022-08-24', periods=3, name='Datetime')
+        self.ingested = {g: ('wb-1', pd.Series([1.0, 2.0, 3.0], index=dates, name='flow')) for g in ('01', '02')}
+        #written with its index and without the leading zeros, like the real file
+        csv = b',NWIS_site_id,state_id\n0,1,AL\n1,2,AL\n'
+        nwis = b'Datetime,USGS_flow\n2022-08-24,1.0\n2022-08-25,2.0\n2022-08-26,4.0\n'
+        self.storage = MemoryStorage({'Streamstats/Streamstats.csv': csv,
+                                      'NWIS/NWIS_sites_AL.h5/NWIS_01.csv': nwis})
+
+    def test_gauges_without_observations_are_unscored(self):
+        from ..cache import clear_caches
+        clear_caches()
+        scores = nextgen.score_run({'01': self.ingested['01'], '02': self.ingested['02']}, storage=self.storage)
+        scores = scores.set_index('USGS_id')
+        self.assertEqual(scores.loc['01', 'n'], 3)
+        self.assertTrue(np.isnan(scores.loc['02', 'n']))
+
+    def test_reader_errors_are_raised(self):
+        from ..cache import clear_caches
+        clear_caches()
+        self.storage.put_bytes('NWIS/NWIS_sites_AL.h5/NWIS_01.csv', b'Datetime,USGS_flow\nyesterday,1.0\n')
+        with self.assertRaises(Exception) as raised:
+            nextgen.score_run(self.ingested, storage=self.storage)
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+
+if __name__ == '__main__':
+    unittest.main()
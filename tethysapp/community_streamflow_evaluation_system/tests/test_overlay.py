@@ -0,0 +1,93 @@
+"""
+Tests of the batch plot overlaying several stations.
+"""
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import RequestFactory
+
+from . import synthetic_bucket
+from ..alignment import align
+from ..cache import clear_caches
+from ..metrics import aligned_skill
+from ..overlay import batch_plot, station_info, MAX_STATIONS
+from ..series import read_series, usgs_key, model_key, flow_column, USGS_FLOW
+from ..storage import configure_storage, get_storage, LocalStorage, MemoryStorage
+
+
+MODEL = 'NWM_v2.1'
+SITES = synthetic_bucket.REACH_DEFAULT_SITES + synthetic_bucket.HUC_DEFAULT_SITES[:3]
+
+
+class BatchPlotTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..pyramids import configure_plot_max_points
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        configure_storage(LocalStorage(cls.tmp.name))
+        configure_plot_max_points(500)
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+        clear_caches()
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def test_skill_matches_each_station(self):
+        plot = batch_plot(SITES + ['09999999'], MODEL, '2010-01-01', '2010-06-30')
+        self.assertEqual(plot['missing'], ['09999999'])
+        self.assertEqual(plot['level'], 'day')
+        self.assertEqual(len(plot['data']), 2 * len(SITES))
+        rows = {row['site_id']: row for row in plot['metrics']}
+        self.assertEqual(sorted(rows), sorted(SITES))
+        info = station_info(SITES, get_storage())
+        for site in SITES:
+            state, NHD_id = info[site]
+            self.assertEqual(rows[site]['state'], state)
+            obs = read_series(usgs_key(state, site), USGS_FLOW, get_storage())
+            mod = read_series(model_key(MODEL, state, NHD_id, site), flow_column(MODEL), get_storage())
+            expected = aligned_skill(align(obs, mod, '2010-01-01', '2010-06-30'))
+            self.assertEqual(rows[site]['n'], expected['n'])
+            self.assertAlmostEqual(rows[site]['kge'], round(expected['kge'], 2))
+
+    def test_long_windows_are_averaged(self):
+        plot = batch_plot(SITES[:2], MODEL, '2010-01-01', '2012-12-31')
+        self.assertNotEqual(plot['level'], 'day')
+        self.assertLessEqual(len(plot['data'][0]['x']), 500)
+
+    def test_reader_errors_are_raised(self):
+        state, _ = station_info(SITES[:1], get_storage())[SITES[0]]
+        storage = MemoryStorage({'Streamstats/Streamstats.csv': get_storage().read_bytes('Streamstats/Streamstats.csv'),
+                                 usgs_key(state, SITES[0]): b'Datetime,USGS_flow\nyesterday,1.0\n'})
+        clear_caches()
+        with self.assertRaises(Exception) as raised:
+            batch_plot(SITES[:1], MODEL, '2010-01-01', '2010-06-30', storage)
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+        clear_caches()
+
+    def test_view_validates_parameters(self):
+        from ..controllers import batch_plot_view
+
+        valid = {'site_ids': ','.join(SITES[:2]), 'model_id': MODEL, 'start-date': '2010-01-01',
+                 'end-date': '2010-06-30'}
+        for field, value in (('site_ids', ','.join(f"{i:08d}" for i in range(MAX_STATIONS + 1))),
+                             ('site_ids', '10126000,../x'), ('model_id', 'GR4J'), ('end-date', '2009-12-31'),
+                             ('start-date', '')):
+            request = RequestFactory().get('/', dict(valid, **{field: value}))
+            request.user = mock.Mock(is_authenticated=True)
+            response = batch_plot_view(request)
+            self.assertEqual(response.status_code, 400, (field, value))
+            self.assertEqual(json.loads(response.content)['field'], field)
+
+
+if __name__ == '__main__':
+    unittest.main()
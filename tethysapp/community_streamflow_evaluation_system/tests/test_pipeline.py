@@ -0,0 +1,78 @@
+"""
+Tests of the incremental build pipeline.
+"""
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+from . import synthetic_bucket
+from .. import pipeline
+from ..evaluate import select_stations
+from ..series import configure_hydrofabric_models, usgs_key
+from ..storage import LocalStorage
+
+
+MODELS = ['NWM_v2.1']
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        self.root = os.path.join(self.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(self.root, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        self.storage = LocalStorage(self.root)
+        self.manifest = os.path.join(self.tmp.name, 'build_manifest.json')
+        configure_hydrofabric_models(['NextGen'])
+        self.ut = select_stations(self.storage, states=['UT'])
+        self.al = select_stations(self.storage, states=['AL'])
+        self.store = os.path.join(self.tmp.name, 'store')
+        self.matrices = os.path.join(self.tmp.name, 'matrices')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_stages(self, start='2010-01-01', extra=(), dry_run=False):
+        def stage(storage):
+            return [pipeline.store_partition(self.ut, MODELS, self.store),
+                    pipeline.matrix_partition(self.al, MODELS, self.matrices, start, '2010-12-31')] + list(extra)
+        with redirect_stdout(StringIO()):
+            return pipeline.run([stage], self.manifest, 'local', self.root, ['NextGen'], workers=1, dry_run=dry_run)
+
+    def test_only_stale_partitions_are_rebuilt(self):
+        self.assertEqual(self.run_stages(dry_run=True), {'built': 0, 'skipped': 0, 'failed': 0})
+        self.assertEqual(self.run_stages(), {'built': 2, 'skipped': 0, 'failed': 0})
+        self.assertTrue(os.path.isdir(self.store) and os.path.isdir(self.matrices))
+        self.assertEqual(self.run_stages(), {'built': 0, 'skipped': 2, 'failed': 0})
+
+        #a UT source rewritten, only the store reads it
+        site, state, _ = self.ut[0]
+        with open(self.storage.path(usgs_key(state, site)), 'a') as f:
+            f.write('\n')
+        self.assertEqual(self.run_stages(), {'built': 1, 'skipped': 1, 'failed': 0})
+        #other parameters
+        self.assertEqual(self.run_stages(start='2010-02-01'), {'built': 1, 'skipped': 1, 'failed': 0})
+        #an output removed
+        os.rename(self.store, self.store + '.moved')
+        self.assertEqual(self.run_stages(start='2010-02-01'), {'built': 1, 'skipped': 1, 'failed': 0})
+
+    def test_failed_partitions_are_not_recorded(self):
+        broken = pipeline._partition('bogus', None, [pipeline.STREAMSTATS], {})
+        self.assertEqual(self.run_stages(extra=[broken]), {'built': 2, 'skipped': 0, 'failed': 1})
+        self.assertNotIn('bogus', pipeline.read_manifest(self.manifest)['partitions'])
+        self.assertEqual(self.run_stages(extra=[broken]), {'built': 0, 'skipped': 2, 'failed': 1})
+
+    def test_fingerprints(self):
+        key = usgs_key(self.ut[0][1], self.ut[0][0])
+        prints = pipeline.fingerprints([key, 'NWIS/missing.csv'], self.storage)
+        self.assertEqual(prints, {key: self.storage.fingerprint(key), 'NWIS/missing.csv': None})
+        with mock.patch.object(self.storage, 'fingerprint', side_effect=PermissionError(key)):
+            with self.assertRaises(PermissionError):
+                pipeline.fingerprints([key], self.storage)
+
+
+if __name__ == '__main__':
+    unittest.main()
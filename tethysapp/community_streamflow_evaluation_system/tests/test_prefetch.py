@@ -0,0 +1,102 @@
+"""
+Tests of the predictive prefetch queue.
+"""
+import threading
+import unittest
+from unittest import mock
+
+from .. import prefetch
+from ..prefetch import Prefetcher, layer_stations
+
+
+def stations(*points):
+    return [{'id': site, 'coordinates': coordinates} for site, coordinates in points]
+
+
+class PrefetcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+        self.prefetcher = Prefetcher(load=lambda station: self.loaded.append(station['id']), max_stations=3)
+
+    def test_popular_then_central_first(self):
+        points = stations(('edge', (10.0, 0.0)), ('middle', (0.0, 0.0)), ('near', (1.0, 0.0)),
+                          ('other edge', (-10.0, 0.0)), ('nowhere', None))
+        self.prefetcher.clicked('edge')
+        with self.prefetcher.foreground():
+            self.prefetcher.schedule('a', points)
+            #held while a request is running
+            self.assertEqual(self.prefetcher.pending(), 3)
+            self.assertEqual(self.loaded, [])
+        self.assertTrue(self.prefetcher.drain(timeout=5))
+        self.assertEqual(self.loaded, ['edge', 'middle', 'near'])
+
+    def test_new_map_cancels_the_last_one(self):
+        with self.prefetcher.foreground():
+            self.prefetcher.schedule('a', stations(('a1', (0, 0)), ('a2', (1, 0))))
+            self.prefetcher.schedule('b', stations(('b1', (0, 0))))
+            self.prefetcher.schedule('a', stations(('a3', (0, 0))))
+            self.assertEqual(self.prefetcher.pending(), 2)
+        self.assertTrue(self.prefetcher.drain(timeout=5))
+        self.assertEqual(sorted(self.loaded), ['a3', 'b1'])
+        self.assertEqual(self.prefetcher.stats()['cancelled'], 2)
+
+    def test_failures_are_counted(self):
+        failed = threading.Event()
+
+        def load(station):
+            if station['id'] == 'bad':
+                failed.set()
+                raise KeyError(station['id'])
+            self.loaded.append(station['id'])
+
+        prefetcher = Prefetcher(load=load)
+        prefetcher.schedule('a', stations(('bad', (0, 0)), ('good', (5, 5))))
+        self.assertTrue(prefetcher.drain(timeout=5))
+        self.assertTrue(failed.is_set())
+        self.assertEqual((prefetcher.loaded, prefetcher.failed), (1, 1))
+
+    def test_layer_stations(self):
+        feature = {'properties': {'id': '10126000'}, 'geometry': {'coordinates': [-112.0, 41.0]}}
+        groups = [{'layers': [{'data': {'plottable': True}, 'options': {'features': [feature]}},
+                              {'data': {}, 'options': {'features': [feature]}}]}]
+        self.assertEqual(layer_stations(groups), [{'id': '10126000', 'coordinates': [-112.0, 41.0]}])
+
+
+class PrefetchStationTestCase(unittest.TestCase):
+
+    def test_default_layers_read_the_default_plot_model(self):
+        from ..series import configure_hydrofabric_models
+        configure_hydrofabric_models(['NextGen'])
+        keys = []
+        props = {'id': '10126000', 'NHD_id': 1000010, 'state': 'UT'}
+        with mock.patch.object(prefetch, 'defaults', return_value={'model_id': 'MLP', 'days': 365}), \
+                mock.patch.object(prefetch, 'read_series', side_effect=lambda key, column: keys.append(key)):
+            prefetch.prefetch_station(props)
+        self.assertEqual(keys, ['NWIS/NWIS_sites_UT.h5/NWIS_10126000.csv', 'MLP/NHD_segments_UT.h5/MLP_1000010.csv'])
+
+
+class PrefetchSettingsTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        prefetch.configure_prefetch(False)
+
+    def settings(self, error):
+        from ..app import CSES as app
+        prefetch._settings = None
+        with mock.patch.object(app, 'get_custom_setting', side_effect=error):
+            return prefetch.prefetch_settings()
+
+    def test_missing_settings_turn_prefetch_off(self):
+        from tethys_apps.exceptions import TethysAppSettingDoesNotExist
+        with self.assertLogs('tethys.' + prefetch.__name__, 'WARNING'):
+            self.assertEqual(self.settings(TethysAppSettingDoesNotExist('CustomTethysAppSetting', 'prefetch', 'CSES')),
+                             (False, 0))
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(RuntimeError):
+            self.settings(RuntimeError('database unavailable'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Tests of the aggregate pyramids and of the long-window plots drawn from them.
+"""
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from . import synthetic_bucket
+from ..alignment import align
+from ..metrics import aligned_skill, skill_title
+from ..pyramids import build_pyramid, build_pyramids, choose_level, configure_plot_max_points, level_rows, \
+    pyramid_plot, read_pyramid, skill
+from ..series import read_series, usgs_key, model_key, flow_column, USGS_FLOW
+from ..storage import configure_storage, LocalStorage, MemoryStorage
+
+
+SITE = synthetic_bucket.REACH_DEFAULT_SITES[0]
+MODEL = 'NWM_v2.1'
+
+
+class PyramidTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..rolling import configure_rolling_windows
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=800, huc_digits=2, huc_vertices=50)
+        storage = configure_storage(LocalStorage(cls.tmp.name))
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+        configure_plot_max_points(500)
+        configure_rolling_windows([30, 90])
+        build_pyramids(storage, cls.tmp.name, ['UT'], [MODEL])
+        cls.NHD_id = cls.station()[2]
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    @staticmethod
+    def station():
+        from ..pyramids import station_list
+        from ..storage import get_storage
+        return next(s for s in station_list(get_storage(), ['UT']) if s[1] == SITE)
+
+    def aligned(self, startdate=None, enddate=None):
+        obs = read_series(usgs_key('UT', SITE), USGS_FLOW)
+        mod = read_series(model_key(MODEL, 'UT', self.NHD_id, SITE), flow_column(MODEL))
+        return align(obs, mod, startdate, enddate)
+
+    def test_merged_skill_matches_the_daily_skill(self):
+        aligned = self.aligned()
+        pyramid = build_pyramid(aligned)
+        daily = aligned_skill(aligned)
+        for level in ('week', 'month', 'water_year'):
+            merged = skill(level_rows(pyramid, level))
+            for metric in ('rmse', 'kge', 'r'):
+                self.assertAlmostEqual(merged[metric], daily[metric], places=8)
+            self.assertEqual(level_rows(pyramid, level)['n'].sum(), daily['n'])
+
+    def test_choose_level(self):
+        self.assertEqual(choose_level('2010-01-01', '2010-12-31', 500), 'day')
+        self.assertEqual(choose_level('2010-01-01', '2015-12-31', 500), 'week')
+        self.assertEqual(choose_level('1980-01-01', '2019-12-31', 500), 'month')
+        self.assertEqual(choose_level('1980-01-01', '2019-12-31', 30), 'water_year')
+
+    def test_long_window_plot_has_the_rolling_and_fdc_panels(self):
+        layout = {'yaxis': {'title': 'Streamflow (cfs)'}, 'xaxis': {'title': 'Date'}}
+        title, data, layout = pyramid_plot(SITE, self.NHD_id, 'UT', MODEL, '2010-01-01', '2012-03-10', layout)
+        self.assertIn('Weekly', title)
+        names = [trace['name'] for trace in data]
+        self.assertIn('30 day KGE', names)
+        self.assertIn('USGS Observed FDC', names)
+        fdc = next(trace for trace in data if trace['name'] == 'USGS Observed FDC')
+        self.assertTrue(all(a >= b for a, b in zip(fdc['y'], fdc['y'][1:]) if a is not None and b is not None))
+        self.assertTrue(any(k.startswith('xaxis') and k != 'xaxis' for k in layout))
+
+    def test_title_skill_is_the_skill_of_the_window(self):
+        #the window starts and ends inside a week, a month and a water year
+        title = pyramid_plot(SITE, self.NHD_id, 'UT', MODEL, '2010-01-07', '2012-03-10', {})[0]
+        self.assertTrue(title.endswith(f"<br> {skill_title(aligned_skill(self.aligned('2010-01-07', '2012-03-10')))}"))
+
+    def test_skill_summary_levels(self):
+        from django.test import RequestFactory
+        from ..controllers import skill_summary_view
+
+        def get(level):
+            request = RequestFactory().get('/', {'state': 'UT', 'site_id': SITE, 'NHD_id': self.NHD_id,
+                                                 'model_id': MODEL, 'level': level})
+            request.user = mock.Mock(is_authenticated=True)
+            return skill_summary_view(request)
+
+        response = get('month')
+        self.assertEqual(response.status_code, 200)
+        periods = json.loads(response.content)['periods']
+        self.assertEqual(sum(period['n'] for period in periods), aligned_skill(self.aligned())['n'])
+        self.assertEqual(get('week').status_code, 400)
+
+    def test_short_window_is_plotted_daily(self):
+        self.assertIsNone(pyramid_plot(SITE, self.NHD_id, 'UT', MODEL, '2010-01-01', '2010-06-30', {}))
+
+    def test_pyramid_of_gappy_series(self):
+        aligned = self.aligned('2010-01-01', '2010-03-31')
+        aligned.obs = aligned.obs.copy()
+        aligned.obs[::3] = np.nan
+        pyramid = build_pyramid(aligned)
+        self.assertEqual(level_rows(pyramid, 'month')['n'].sum(), int(np.isfinite(aligned.obs).sum()))
+
+    def test_only_missing_pyramids_are_skipped(self):
+        storage = MemoryStorage({'pyramid.parquet': b'not parquet'})
+        self.assertIsNone(read_pyramid('missing.parquet', storage))
+        with self.assertRaises(Exception) as raised:
+            read_pyramid('pyramid.parquet', storage)
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+    def test_reader_errors_fail_the_build(self):
+        geojson = {'features': [{'properties': {'USGS_id': SITE, 'NHD_id': self.NHD_id}}]}
+        storage = MemoryStorage({'GeoJSON/StreamStats_UT_4326.geojson': json.dumps(geojson).encode(),
+                                 usgs_key('UT', SITE): b'Datetime,USGS_flow\nyesterday,1.0\n'})
+        with tempfile.TemporaryDirectory(prefix='cses-test-') as output:
+            with self.assertRaises(Exception) as raised:
+                build_pyramids(storage, output, ['UT'], [MODEL])
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Tests of the query validation of the map views and of the clicked stations' properties.
+"""
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+from django.http import QueryDict
+from django.test import RequestFactory
+
+from . import synthetic_bucket
+from ..alignment import align
+from ..metrics import aligned_skill, skill_title
+from ..query import parse_feature, parse_hucs, parse_query, parse_sites, QueryError
+from ..series import read_series, usgs_key, model_key, flow_column, USGS_FLOW
+from ..storage import configure_storage, LocalStorage
+
+
+def params(**values):
+    query = QueryDict(mutable=True)
+    query.update(values)
+    return query
+
+
+class ParseQueryTestCase(unittest.TestCase):
+
+    def test_no_parameters_is_the_default_view(self):
+        self.assertIsNone(parse_query(params(), 'reach_ids'))
+
+    def test_valid_query(self):
+        query = parse_query(params(**{'start-date': '01-01-2019', 'end-date': '2019-06-11', 'model_id': 'NWM_v2.1',
+                                      'reach_ids': '[2450250, 10126000]'}), 'reach_ids')
+        self.assertEqual((query.startdate, query.enddate, query.model_id.value), ('2019-01-01', '2019-06-11',
+                                                                                  'NWM_v2.1'))
+        self.assertEqual(query.selection, ['02450250', '10126000'])
+
+    def test_invalid_queries_name_the_parameter(self):
+        valid = {'start-date': '01-01-2019', 'end-date': '06-11-2019', 'model_id': 'NWM_v2.1', 'state_id': 'UT'}
+        for field, value in (('start-date', '2019-13-01'), ('end-date', '12-31-2018'), ('model_id', 'GR4J'),
+                             ('state_id', 'Utah'), ('end-date', '')):
+            with self.assertRaises(QueryError) as raised:
+                parse_query(params(**dict(valid, **{field: value})), 'state_id')
+            self.assertEqual(raised.exception.field, field)
+            self.assertEqual(raised.exception.status, 400)
+
+    def test_hucs(self):
+        self.assertEqual(parse_hucs('1602, 1603'), ['1602', '1603'])
+        for value in ('160', '1602, 160201', '2301', '16x2'):
+            with self.assertRaises(QueryError):
+                parse_hucs(value)
+
+    def test_sites(self):
+        with self.assertRaises(QueryError):
+            parse_sites('10126000, ../etc')
+
+
+class ParseFeatureTestCase(unittest.TestCase):
+
+    props = {'id': '10126000', 'NHD_id': 1000010, 'state': 'UT', 'startdate': '2010-01-01',
+             'enddate': '12-31-2010', 'model_id': 'NWM_v2.1'}
+
+    def test_valid(self):
+        self.assertEqual(parse_feature(self.props),
+                         ('10126000', 1000010, 'UT', '2010-01-01', '2010-12-31', 'NWM_v2.1'))
+
+    def test_default_layer_props(self):
+        self.assertEqual(parse_feature({'id': '10126000', 'NHD_id': 1000010, 'state': 'ut'}),
+                         ('10126000', 1000010, 'UT', None, None, None))
+
+    def test_invalid(self):
+        for field, value in (('id', '../../secret'), ('state', 'U/T'), ('NHD_id', '1/../2'), ('model_id', 'GR4J'),
+                             ('startdate', 'yesterday'), ('enddate', '2009-01-01'), ('NHD_id', None)):
+            with self.assertRaises(QueryError) as raised:
+                parse_feature(dict(self.props, **{field: value}))
+            self.assertEqual(raised.exception.field, field)
+
+
+class PlotFeatureTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..pyramids import configure_plot_max_points
+        from ..rolling import configure_rolling_windows
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+        from ..artifacts import configure_artifact_dir
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        configure_storage(LocalStorage(cls.tmp.name))
+        configure_plot_max_points(500)
+        configure_rolling_windows([30])
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+        configure_artifact_dir(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def plot(self, view_class, props):
+        request = RequestFactory().post('/', {'layer_name': 'USGS Stations', 'feature_id': str(props.get('id')),
+                                              'feature_props': json.dumps(props)})
+        return view_class().get_plot_data(request, None)
+
+    def test_plot_handlers_validate_props(self):
+        from ..Reach_Controller import Reach_Eval
+        from ..HUC_Controller import HUC_Eval
+        from ..State_Controller import State_Eval
+
+        props = {'id': '10126000', 'NHD_id': 1000010, 'state': 'UT', 'startdate': '2010-01-01',
+                 'enddate': '2010-06-30', 'model_id': 'NWM_v2.1'}
+        obs = read_series(usgs_key('UT', '10126000'), USGS_FLOW)
+        mod = read_series(model_key('NWM_v2.1', 'UT', 1000010), flow_column('NWM_v2.1'))
+        title_skill = skill_title(aligned_skill(align(obs, mod, '2010-01-01', '2010-06-30')))
+        for view_class in (Reach_Eval, HUC_Eval, State_Eval):
+            response = self.plot(view_class, props)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(json.loads(response.content)['data'])
+            #the title skill is the one the API and cses-evaluate compute
+            self.assertTrue(json.loads(response.content)['title'].endswith(f"<br> {title_skill}"))
+
+            response = self.plot(view_class, dict(props, state='../..'))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content)['field'], 'state')
+
+    def test_missing_station_is_not_found(self):
+        from ..Reach_Controller import Reach_Eval
+        response = self.plot(Reach_Eval, {'id': '10126001', 'NHD_id': 1, 'state': 'UT', 'startdate': '2010-01-01',
+                                          'enddate': '2010-06-30', 'model_id': 'NWM_v2.1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_window_without_paired_days_is_not_found(self):
+        from ..Reach_Controller import Reach_Eval
+        from ..HUC_Controller import HUC_Eval
+        from ..State_Controller import State_Eval
+
+        props = {'id': '10126000', 'NHD_id': 1000010, 'state': 'UT', 'startdate': '2030-01-01',
+                 'enddate': '2030-06-30', 'model_id': 'NWM_v2.1'}
+        for view_class in (Reach_Eval, HUC_Eval, State_Eval):
+            response = self.plot(view_class, props)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(json.loads(response.content)['field'], 'startdate')
+
+    def test_huc_without_stations_is_not_found(self):
+        from .. import HUC_Controller
+
+        view = HUC_Controller.HUC_Eval()
+        request = RequestFactory().get('/', {'start-date': '2010-01-01', 'end-date': '2010-06-30',
+                                             'model_id': 'NWM_v2.1', 'huc_ids': '1602'})
+        empty = pd.DataFrame(columns=['NWIS_site_id', 'state_id'])
+        with mock.patch.object(HUC_Controller, 'huc_sites', return_value=empty):
+            self.assertTrue(view.Join_WBD_StreamStats(['1602']).empty)
+            with self.assertRaises(QueryError) as raised:
+                view.compose_layers(request, {'view': {}}, None)
+        self.assertEqual((raised.exception.field, raised.exception.status), ('huc_ids', 404))
+
+    def test_huc_read_errors_are_raised(self):
+        from .. import HUC_Controller
+
+        sites = pd.DataFrame({'NWIS_site_id': ['10126000'], 'state_id': ['UT']})
+        with mock.patch.object(HUC_Controller, 'huc_sites', return_value=sites), \
+                mock.patch.object(HUC_Controller, 'combine_jsons', side_effect=KeyError('GeoJSON')):
+            with self.assertRaises(KeyError):
+                HUC_Controller.HUC_Eval().Join_WBD_StreamStats(['1602'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests of the rolling skill panels under the hydrograph.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ..alignment import Aligned
+from ..metrics import rolling_skill
+from ..rolling import add_rolling, daily_sums, configure_rolling_windows, PANELS
+
+
+def aligned(days=400, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2010-01-01', periods=days, name='Datetime')
+    obs = rng.gamma(2, 50, days)
+    mod = obs * 1.1 + rng.normal(0, 5, days)
+    obs[rng.random(days) < 0.1] = np.nan
+    return Aligned(dates, obs, mod, {})
+
+
+class AddRollingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        configure_rolling_windows([90, 30])
+        self.days, self.sums = daily_sums(aligned())
+
+    def tearDown(self):
+        configure_rolling_windows([30])
+
+    def test_panels(self):
+        data, layout = [], {'yaxis': {'title': 'Streamflow (cfs)'}}
+        add_rolling(data, layout, self.days, self.sums, '2010-06-01', '2010-12-31', max_points=50)
+        metrics = sum(len(m) for _, m in PANELS)
+        self.assertEqual(len(data), 2 * metrics)
+        #shortest window first
+        self.assertTrue(data[0]['name'].startswith('30 day'))
+        self.assertEqual({trace['yaxis'] for trace in data}, {f"y{i + 2}" for i in range(len(PANELS))})
+        x = data[0]['x']
+        self.assertLessEqual(len(x), 50)
+        self.assertGreaterEqual(x[0], '2010-06-01')
+        self.assertLessEqual(x[-1], '2010-12-31')
+        #panels stacked under the hydrograph without overlapping
+        domains = sorted([layout['yaxis']['domain']] + [layout[f"yaxis{i + 2}"]['domain'] for i in range(len(PANELS))])
+        self.assertTrue(all(a[1] <= b[0] for a, b in zip(domains, domains[1:])))
+
+    def test_values_are_the_rolling_skill(self):
+        data, layout = [], {}
+        add_rolling(data, layout, self.days, self.sums, None, None, max_points=10000)
+        expected = rolling_skill(self.days, self.sums, 30)
+        kge = next(trace for trace in data if trace['name'] == '30 day KGE')
+        self.assertEqual(len(kge['y']), len(self.days))
+        for got, want in zip(kge['y'], expected['kge']):
+            if np.isfinite(want):
+                self.assertAlmostEqual(got, round(want, 4))
+            else:
+                self.assertIsNone(got)
+
+    def test_nothing_to_add(self):
+        data, layout = [], {}
+        add_rolling(data, layout, self.days, self.sums, '2030-01-01', '2030-12-31', max_points=50)
+        configure_rolling_windows([])
+        add_rolling(data, layout, self.days, self.sums, None, None, max_points=50)
+        self.assertEqual((data, layout), ([], {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests of the flow series keys and readers.
+"""
+import io
+import unittest
+
+import numpy as np
+
+from ..cache import clear_caches
+from ..series import (parse_series, read_series, flow_values, flow_column, model_key, model_keys, hydrofabric_key,
+                      usgs_key, configure_hydrofabric_models, USGS_FLOW)
+from ..series_store import configure_series_store
+from ..storage import MemoryStorage, is_missing
+
+
+class ParseTestCase(unittest.TestCase):
+
+    def test_sorted_and_unique(self):
+        body = io.BytesIO(b',Datetime,USGS_flow\n0,2010-01-03,3.0\n1,2010-01-01,1.0\n2,2010-01-02,2.0\n'
+                          b'3,2010-01-02,9.0\n')
+        series = parse_series(body, USGS_FLOW)
+        self.assertEqual(series.index.strftime('%Y-%m-%d').tolist(), ['2010-01-01', '2010-01-02', '2010-01-03'])
+        self.assertEqual(series.tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(series.dtype, np.float32)
+        self.assertEqual(series.name, USGS_FLOW)
+
+    def test_only_the_flow_column_is_read(self):
+        body = io.BytesIO(b',Datetime,feature_id,NWM_flow\n0,2010-01-01,not a number,5.5\n')
+        series = parse_series(body, flow_column('NWM_v2.1'))
+        self.assertEqual(series.tolist(), [5.5])
+
+
+class FlowValuesTestCase(unittest.TestCase):
+
+    def test_float32_keeps_its_decimals(self):
+        values = np.array([131.567, 123456.78, 0.25, 0.0, -5.25, 2.5e7], dtype=np.float32)
+        self.assertEqual(flow_values(values), [131.567, 123456.78, 0.25, 0.0, -5.25, 2.5e7])
+
+    def test_matches_the_decimal_form(self):
+        values = np.round(np.random.default_rng(0).gamma(2, 50, 10000), 2).astype(np.float32)
+        self.assertEqual(flow_values(values), values.astype(str).astype(np.float64).tolist())
+
+    def test_nan(self):
+        self.assertTrue(np.isnan(flow_values(np.array([np.nan], dtype=np.float32))[0]))
+
+
+class KeyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        configure_hydrofabric_models(['NextGen'])
+
+    def test_keys(self):
+        self.assertEqual(flow_column('NWM_v3.0'), 'NWM_flow')
+        self.assertEqual(usgs_key('UT', '10126000'), 'NWIS/NWIS_sites_UT.h5/NWIS_10126000.csv')
+        self.assertEqual(model_key('NWM_v2.1', 'UT', 1000010, '10126000'),
+                         'NWM_v2.1/NHD_segments_UT.h5/NWM_v2.1_1000010.csv')
+        self.assertEqual(model_keys('NWM_v2.1', [('UT', 1, 'a'), ('CO', 2, 'b')]),
+                         ['NWM_v2.1/NHD_segments_UT.h5/NWM_v2.1_1.csv', 'NWM_v2.1/NHD_segments_CO.h5/NWM_v2.1_2.csv'])
+        self.assertEqual(hydrofabric_key('NextGen', 'wb-3'), 'NextGen/hydrofabric/NextGen_wb-3.csv')
+
+
+class ReadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        configure_series_store(None)
+        clear_caches()
+
+    def test_cached(self):
+        storage = MemoryStorage({'a.csv': b'Datetime,USGS_flow\n2010-01-01,1.0\n'})
+        first = read_series('a.csv', USGS_FLOW, storage)
+        storage.put_bytes('a.csv', b'Datetime,USGS_flow\n2010-01-01,2.0\n')
+        self.assertIs(read_series('a.csv', USGS_FLOW, storage), first)
+
+    def test_missing(self):
+        with self.assertRaises(Exception) as raised:
+            read_series('missing.csv', USGS_FLOW, MemoryStorage({}))
+        self.assertTrue(is_missing(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests of the shared, memory-mapped series store.
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from . import synthetic_bucket
+from ..cache import clear_caches
+from ..evaluate import select_stations
+from ..series import parse_series, read_series, configure_hydrofabric_models, USGS_FLOW
+from ..series_store import (build_store, configure_series_store, series_store, station_items, SeriesStore, INDEX_FILE,
+                            FORMAT_VERSION)
+from ..storage import LocalStorage, MemoryStorage
+
+
+class SeriesStoreTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        root = os.path.join(cls.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(root, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        cls.storage = LocalStorage(root)
+        configure_hydrofabric_models(['NextGen'])
+        cls.items = station_items(select_stations(cls.storage, states=['UT']), ['NWM_v2.1'])
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_series_store(None)
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.output = os.path.join(tempfile.mkdtemp(dir=self.tmp.name), 'store')
+        clear_caches()
+
+    def test_stored_series_match_the_csvs(self):
+        missing = ('NWIS/NWIS_sites_UT.h5/NWIS_09999999.csv', USGS_FLOW)
+        self.assertEqual(build_store(self.output, self.items + [missing], self.storage), len(self.items))
+        store = SeriesStore(self.output)
+        self.assertNotIn(missing, store)
+        for key, flow_col in self.items:
+            expected = parse_series(self.storage.open(key), flow_col)
+            stored = store.get(key, flow_col)
+            self.assertTrue(stored.index.equals(expected.index))
+            np.testing.assert_array_equal(stored.to_numpy(), expected.to_numpy())
+            self.assertEqual(stored.name, flow_col)
+
+    def test_read_series_resolves_from_the_store(self):
+        build_store(self.output, self.items, self.storage)
+        configure_series_store(self.output)
+        key, flow_col = self.items[0]
+        #nothing is read from storage
+        series = read_series(key, flow_col, MemoryStorage({}))
+        self.assertFalse(series.to_numpy().flags.writeable)
+        configure_series_store(None)
+        with self.assertRaises(KeyError):
+            read_series(key, flow_col, MemoryStorage({}))
+
+    def test_rebuild_is_attached(self):
+        build_store(self.output, self.items[:1], self.storage)
+        configure_series_store(self.output)
+        self.assertEqual(len(series_store()), 1)
+        build_store(self.output, self.items, self.storage)
+        configure_series_store(self.output)
+        self.assertEqual(len(series_store()), len(self.items))
+
+    def test_other_versions_are_not_attached(self):
+        build_store(self.output, self.items, self.storage)
+        path = os.path.join(self.output, INDEX_FILE)
+        with open(path) as f:
+            index = json.load(f)
+        with open(path, 'w') as f:
+            json.dump(dict(index, version=FORMAT_VERSION + 1), f)
+        configure_series_store(self.output)
+        self.assertIsNone(series_store())
+
+    def test_reader_errors_fail_the_build(self):
+        key, _ = self.items[0]
+        storage = MemoryStorage({key: b'Datetime,USGS_flow\nyesterday,1.0\n'})
+        with self.assertRaises(Exception) as raised:
+            build_store(self.output, [(key, USGS_FLOW)], storage)
+        self.assertNotIsInstance(raised.exception, (KeyError, FileNotFoundError))
+
+
+if __name__ == '__main__':
+    unittest.main()
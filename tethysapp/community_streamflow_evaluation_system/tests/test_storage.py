@@ -0,0 +1,89 @@
+"""
+Tests of the storage backends.
+"""
+import os
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+from ..storage import create_storage, is_missing, LocalStorage, MemoryStorage
+
+
+class LocalStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        self.root = os.path.join(self.tmp.name, 'bucket')
+        os.makedirs(os.path.join(self.root, 'NWIS'))
+        with open(os.path.join(self.root, 'NWIS', 'NWIS_1.csv'), 'wb') as f:
+            f.write(b'Datetime,USGS_flow\n')
+        with open(os.path.join(self.tmp.name, 'secret.csv'), 'wb') as f:
+            f.write(b'secret')
+        self.storage = LocalStorage(self.root)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reads(self):
+        self.assertEqual(self.storage.read_bytes('NWIS/NWIS_1.csv'), b'Datetime,USGS_flow\n')
+        self.assertEqual(self.storage.open('/NWIS/NWIS_1.csv').read(), b'Datetime,USGS_flow\n')
+
+    def test_keys_outside_the_root_are_missing(self):
+        for key in ('../secret.csv', 'NWIS/../../secret.csv', 'NWIS/../../bucket2/x.csv'):
+            with self.assertRaises(KeyError):
+                self.storage.read_bytes(key)
+        self.assertEqual(self.storage.path('NWIS/../NWIS/NWIS_1.csv'),
+                         os.path.join(os.path.realpath(self.root), 'NWIS', 'NWIS_1.csv'))
+
+    def test_symlinks_out_of_the_root_are_missing(self):
+        os.symlink(os.path.join(self.tmp.name, 'secret.csv'), os.path.join(self.root, 'NWIS', 'link.csv'))
+        with self.assertRaises(KeyError):
+            self.storage.read_bytes('NWIS/link.csv')
+
+    def test_missing_key(self):
+        with self.assertRaises(FileNotFoundError) as raised:
+            self.storage.read_bytes('NWIS/NWIS_2.csv')
+        self.assertTrue(is_missing(raised.exception))
+
+    def test_fingerprint_changes_on_rewrite(self):
+        before = self.storage.fingerprint('NWIS')
+        with open(os.path.join(self.root, 'NWIS', 'NWIS_2.csv'), 'wb') as f:
+            f.write(b'x')
+        self.assertNotEqual(self.storage.fingerprint('NWIS'), before)
+
+
+class MemoryStorageTestCase(unittest.TestCase):
+
+    def test_read_through(self):
+        source = MemoryStorage({'a/b.csv': b'1'})
+        storage = MemoryStorage(source=source)
+        self.assertEqual(storage.read_bytes('a/b.csv'), b'1')
+        del source.objects['a/b.csv']
+        self.assertEqual(storage.read_bytes('a/b.csv'), b'1')
+        with self.assertRaises(KeyError):
+            storage.read_bytes('a/c.csv')
+
+    def test_uri_spills_a_prefix(self):
+        storage = MemoryStorage({'gdb/a': b'1', 'gdb/b': b'2', 'other': b'3'})
+        path = storage.uri('gdb')
+        self.assertEqual(sorted(os.listdir(path)), ['a', 'b'])
+
+
+class IsMissingTestCase(unittest.TestCase):
+
+    def test_missing_errors(self):
+        self.assertTrue(is_missing(ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')))
+        self.assertTrue(is_missing(ClientError({'Error': {'Code': '404'}}, 'HeadObject')))
+        self.assertFalse(is_missing(ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')))
+        self.assertFalse(is_missing(ValueError('bad csv')))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_storage('ftp')
+        with self.assertRaises(ValueError):
+            create_storage('local')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Tests of the per-request stage timing and the latency histograms.
+"""
+import re
+import unittest
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from ..timing import RequestTimer, Histogram, ServerTimingMixin, span, render_metrics, _current, BUCKETS
+
+
+class View:
+
+    def dispatch(self, request, *args, **kwargs):
+        with span('storage'):
+            pass
+        with span('storage'):
+            pass
+        with span('metrics'):
+            pass
+        return HttpResponse('ok')
+
+    def get_plot_data(self, request):
+        pass
+
+
+class TimedView(ServerTimingMixin, View):
+    pass
+
+
+class TimingTestCase(unittest.TestCase):
+
+    def test_spans_sum_per_stage(self):
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            for _ in range(3):
+                with span('csv_parse'):
+                    pass
+        finally:
+            _current.reset(token)
+        with span('csv_parse'):
+            pass
+        self.assertEqual(timer.stages['csv_parse'][1], 3)
+        self.assertRegex(timer.server_timing(), r'^csv_parse;dur=\d+\.\d;desc="3 calls", total;dur=\d+\.\d$')
+
+    def test_histogram_is_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', 'stage')
+        for seconds in (0.001, 0.02, 0.02, 100.0):
+            histogram.observe('a', seconds)
+        text = histogram.render()
+        counts = [int(n) for n in re.findall(r'test_seconds_bucket\{stage="a",le="[^"]+"\} (\d+)', text)]
+        self.assertEqual(len(counts), len(BUCKETS) + 1)
+        self.assertEqual(counts[0], 1)
+        self.assertEqual(counts[BUCKETS.index(0.025)], 3)
+        self.assertEqual(counts[-2:], [3, 4])
+        self.assertIn('test_seconds_count{stage="a"} 4', text)
+
+    def test_views_send_server_timing(self):
+        response = TimedView().dispatch(RequestFactory().get('/'))
+        self.assertRegex(response['Server-Timing'], r'^storage;dur=[\d.]+;desc="2 calls", metrics;dur=[\d.]+, total;')
+        TimedView().dispatch(RequestFactory().post('/', {'method': 'get-plot-data'}))
+        TimedView().dispatch(RequestFactory().post('/', {'method': 'no-such-handler'}))
+        metrics = render_metrics()
+        for view in ('TimedView.page', 'TimedView.get_plot_data', 'TimedView.unknown'):
+            self.assertIn(f'cses_request_duration_seconds_count{{view="{view}"}}', metrics)
+        self.assertNotIn('no_such_handler', metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Tests of the selection of the gauges inside HUC polygons.
+"""
+import tempfile
+import unittest
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+
+from . import synthetic_bucket
+from ..utils import points_in_polygons, huc_sites, streamstats
+from ..storage import LocalStorage
+
+
+class PointsInPolygonsTestCase(unittest.TestCase):
+
+    def test_matches_shapely(self):
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-10, 10, 5000), rng.uniform(-10, 10, 5000)
+        #points on a boundary and a vertex count as inside, like sjoin's intersects
+        x[:2], y[:2] = [-5.0, 2.0], [0.0, 2.0]
+        ring = Polygon([(-5, -5), (5, -5), (5, 5), (-5, 5)], [[(-1, -1), (1, -1), (1, 1), (-1, 1)]])
+        polygons = [ring, MultiPolygon([box(6, 6, 8, 8), box(-9, 6, -7, 9)]), box(0, 0, 2, 2),
+                    Polygon(), None]
+        expected = np.zeros(len(x), dtype=bool)
+        for polygon in polygons:
+            if polygon is not None:
+                expected |= shapely.intersects_xy(polygon, x, y)
+        inside = points_in_polygons(x, y, polygons)
+        np.testing.assert_array_equal(inside, expected)
+        self.assertTrue(inside[:2].all())
+        self.assertFalse(points_in_polygons(x, y, []).any())
+
+
+class HucSitesTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=40, huc_digits=4, huc_vertices=50)
+        cls.storage = LocalStorage(cls.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_matches_a_spatial_join(self):
+        from ..wbd import configure_wbd_dir
+        #read from the FileGDBs, no extracts
+        configure_wbd_dir(self.tmp.name)
+        try:
+            sites = huc_sites(['1602', '1603'], self.storage)
+        finally:
+            configure_wbd_dir(None)
+        layer = gpd.read_file(self.storage.uri('WBD/WBD_16_HU2_GDB/WBD_16_HU2_GDB.gdb/'), layer='WBDHU4')
+        layer = layer[layer['huc4'].isin(['1602', '1603'])]
+        table = streamstats(self.storage)
+        points = gpd.GeoDataFrame(table, geometry=gpd.points_from_xy(table['dec_long_va'], table['dec_lat_va']),
+                                  crs=layer.crs)
+        joined = gpd.sjoin(points, layer, predicate='intersects')
+        expected = joined[joined['NWIS_sitename'].notna()].drop_duplicates('NWIS_site_id')
+        self.assertTrue(len(sites))
+        self.assertEqual(sorted(sites['NWIS_site_id']), sorted(expected['NWIS_site_id']))
+        self.assertTrue(set(synthetic_bucket.HUC_DEFAULT_SITES) <= set(sites['NWIS_site_id']))
+
+
+if __name__ == '__main__':
+    unittest.main()
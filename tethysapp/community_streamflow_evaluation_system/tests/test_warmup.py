@@ -0,0 +1,86 @@
+"""
+Tests of the background warmup and the readiness it reports.
+"""
+import tempfile
+import unittest
+from unittest import mock
+
+from django.core.signals import request_started
+
+from . import synthetic_bucket
+from .. import warmup
+from ..storage import configure_storage, LocalStorage, MemoryStorage
+
+
+class WarmupTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from ..cache import clear_caches
+        from ..pyramids import configure_plot_max_points
+        from ..rolling import configure_rolling_windows
+        from ..series import configure_hydrofabric_models
+        from ..series_store import configure_series_store
+        from ..artifacts import configure_artifact_dir
+        from ..prefetch import configure_prefetch
+
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        synthetic_bucket.build_bucket(cls.tmp.name, sites_per_state=3, days=400, huc_digits=2, huc_vertices=50)
+        configure_plot_max_points(500)
+        configure_rolling_windows([30])
+        configure_hydrofabric_models(['NextGen'])
+        configure_series_store(None)
+        configure_artifact_dir(None)
+        configure_prefetch(False, 1)
+        clear_caches()
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_storage(None)
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        from ..cache import clear_caches
+        clear_caches()
+        warmup._ready.clear()
+        warmup._status.update(state='idle', started=None, seconds=None, warmed=[], errors=[])
+
+    def test_failed_warmup_is_not_ready_and_restarts(self):
+        configure_storage(MemoryStorage())
+        warmup.start_warmup(states=[], hucs=[], background=False)
+        status = warmup.readiness()
+        self.assertEqual(status['state'], 'failed')
+        self.assertFalse(status['ready'])
+        self.assertTrue(status['errors'])
+
+        configure_storage(LocalStorage(self.tmp.name))
+        warmup.start_warmup(states=[], hucs=[], background=False)
+        status = warmup.readiness()
+        self.assertEqual(status['state'], 'ready')
+        self.assertTrue(status['ready'])
+
+    def test_missing_extra_state_is_recorded(self):
+        configure_storage(LocalStorage(self.tmp.name))
+        warmup.start_warmup(states=['ZZ'], hucs=[], background=False)
+        status = warmup.readiness()
+        self.assertTrue(status['ready'])
+        self.assertEqual([name for name, _ in status['errors']], ['State_Eval[ZZ]'])
+
+    def test_plots_capped(self):
+        configure_storage(LocalStorage(self.tmp.name))
+        from ..State_Controller import State_Eval
+        with mock.patch.object(State_Eval, 'get_plot_for_layer_feature') as plot:
+            stations = warmup.warm_view(State_Eval, plots=2)
+        self.assertGreater(stations, 2)
+        self.assertEqual(plot.call_count, 2)
+
+    def test_started_by_the_first_request(self):
+        with mock.patch.object(warmup, 'start_warmup') as start:
+            warmup.warm_on_first_request()
+            request_started.send(sender=None)
+            request_started.send(sender=None)
+        self.assertEqual(start.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
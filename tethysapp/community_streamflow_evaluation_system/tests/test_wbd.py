@@ -0,0 +1,52 @@
+"""
+Tests of the GeoParquet extracts of the WBD boundaries.
+"""
+import os
+import tempfile
+import unittest
+
+import geopandas as gpd
+
+from . import synthetic_bucket
+from ..storage import LocalStorage
+from ..wbd import extract_region, extract_path, read_huc, read_hucs
+
+
+class ExtractTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory(prefix='cses-test-')
+        cls.root = os.path.join(cls.tmp.name, 'bucket')
+        synthetic_bucket.build_bucket(cls.root, sites_per_state=3, days=40, huc_digits=4, huc_vertices=50)
+        cls.storage = LocalStorage(cls.root)
+        cls.output = os.path.join(cls.tmp.name, 'wbd')
+        cls.written = extract_region(cls.storage, cls.output, '16', levels=(2, 4, 6))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_levels_missing_from_the_gdb_are_skipped(self):
+        self.assertEqual(self.written, 2)
+        self.assertTrue(os.path.exists(extract_path(self.output, 4, '16')))
+        self.assertFalse(os.path.exists(extract_path(self.output, 6, '16')))
+        self.assertIsNone(read_huc('160201', self.output))
+        self.assertIsNone(read_hucs(['1602', '1702'], self.output))
+
+    def test_huc_read_by_key_matches_the_gdb(self):
+        layer = gpd.read_file(self.storage.uri('WBD/WBD_16_HU2_GDB/WBD_16_HU2_GDB.gdb/'), layer='WBDHU4')
+        expected = layer[layer['huc4'] == '1602'].reset_index(drop=True)
+        huc = read_huc('1602', self.output)
+        self.assertEqual(list(huc['huc4']), ['1602'])
+        self.assertTrue(huc.geometry.iloc[0].equals(expected.geometry.iloc[0]))
+        self.assertEqual(huc['name'].iloc[0], expected['name'].iloc[0])
+        self.assertEqual(list(read_hucs(['1602', '1603'], self.output)['huc4']), ['1602', '1603'])
+
+    def test_unreadable_gdb_is_raised(self):
+        with self.assertRaises(Exception):
+            extract_region(self.storage, self.output, '99')
+
+
+if __name__ == '__main__':
+    unittest.main()
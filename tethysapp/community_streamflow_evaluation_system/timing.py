@@ -0,0 +1,129 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+#histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = ContextVar('cses_request_timer', default=None)
+
+
+class RequestTimer:
+    """
+    Stage durations of one request, summed per stage name.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def add(self, name, seconds):
+        total, count = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + seconds, count + 1)
+
+    def server_timing(self):
+        """
+        Server-Timing header value, one metric per stage plus the total, durations in ms.
+        """
+        parts = []
+        for name, (total, count) in self.stages.items():
+            desc = f';desc="{count} calls"' if count > 1 else ''
+            parts.append(f"{name};dur={total * 1000.0:.1f}{desc}")
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000.0:.1f}")
+        return ', '.join(parts)
+
+
+class Histogram:
+    """
+    Cumulative latency histogram per label value, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for label_value in sorted(snapshot):
+            counts, total, count = snapshot[label_value]
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('cses_stage_duration_seconds', 'Time spent per evaluation stage.', 'stage')
+REQUEST_SECONDS = Histogram('cses_request_duration_seconds', 'Time spent per map view request.', 'view')
+
+
+@contextmanager
+def span(name):
+    """
+    Time a stage, adds to the current request's Server-Timing and to the stage histogram.
+
+    Args:
+        name (str): stage name, a Server-Timing token (no spaces), e.g. 'storage', 'csv_parse', 'metrics'.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        timer = _current.get()
+        if timer is not None:
+            timer.add(name, seconds)
+        STAGE_SECONDS.observe(name, seconds)
+
+
+def render_metrics():
+    """
+    All histograms of this process in the Prometheus text exposition format.
+    """
+    return '\n'.join([REQUEST_SECONDS.render(), STAGE_SECONDS.render()]) + '\n'
+
+
+class ServerTimingMixin:
+    """
+    Mixin for the MapLayout views, times every request (page renders and the get-plot-data calls) and adds the
+    spans collected while handling it as a Server-Timing response header.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        finally:
+            _current.reset(token)
+        method = (request.POST.get('method') if request.method == 'POST' else request.GET.get('method')) or 'page'
+        method = method.replace('-', '_')
+        #only known handlers become label values, keeps the metric cardinality bounded
+        if method != 'page' and not hasattr(self, method):
+            method = 'unknown'
+        view = f"{type(self).__name__}.{method}"
+        REQUEST_SECONDS.observe(view, time.perf_counter() - timer.start)
+        response['Server-Timing'] = timer.server_timing()
+        return response
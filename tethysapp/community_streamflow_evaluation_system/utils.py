@@ -1,43 +1,67 @@
+import io
 import json
-from .app import CSES as app
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 
+from .timing import span
+from .cache import TABLES
+from .wbd import read_huc
+
+
+#code for reading an object once per worker, see cache.py
+def read_object(key, storage):
+    return TABLES.get((storage, key, 'bytes'), lambda: storage.read_bytes(key))
+
+#code for reading a json file once per worker
+def read_geojson(json_file, storage):
+    def load():
+        data = read_object(json_file, storage)
+        with span('geojson_read'):
+            return gpd.read_file(io.BytesIO(data), driver='GeoJSON')
+    return TABLES.get((storage, json_file), load)
 
 #code for combining json files
-def combine_jsons(file_list, BUCKET_NAME, s3):
+def combine_jsons(file_list, storage):
     all_data_df = gpd.GeoDataFrame()
     for json_file in file_list:
-        obj = s3.Object(BUCKET_NAME, json_file)
-        stations_geojson = json.load(obj.get()['Body']) 
-        gdf = gpd.read_file(obj.get()['Body'], driver='GeoJSON')
+        gdf = read_geojson(json_file, storage)
         all_data_df = pd.concat([all_data_df, gdf]).set_crs(crs= 'EPSG:4326')
 
     return all_data_df
 
-#code for reach json files
-def reach_json(reach_ids,BUCKET, BUCKET_NAME, S3):
+#code for the streamstats table, parsed once per worker
+def streamstats(storage):
+    def load():
         csv_key = 'Streamstats/Streamstats.csv'
-        obj = BUCKET.Object(csv_key)
-        body = obj.get()['Body']
-        Streamstats = pd.read_csv(body)
+        body = storage.open(csv_key)
+        with span('csv_parse'):
+            Streamstats = pd.read_csv(body)
         Streamstats.pop('Unnamed: 0')
         Streamstats.drop_duplicates(subset = 'NWIS_site_id', inplace = True)
         Streamstats.reset_index(inplace = True, drop = True)
 
-        #Convert to geodataframe
-        StreamStats = gpd.GeoDataFrame(Streamstats, geometry=gpd.points_from_xy(Streamstats.dec_long_va, Streamstats.dec_lat_va))
-
         #the csv loses the 0 in front of USGS ids, fix
         NWIS = list(Streamstats['NWIS_site_id'].astype(str))
-        Streamstats['NWIS_site_id'] = ["0"+str(i) if len(i) <8 else i for i in NWIS]  
+        Streamstats['NWIS_site_id'] = ["0"+str(i) if len(i) <8 else i for i in NWIS]
+        return Streamstats
+    return TABLES.get((storage, 'Streamstats/Streamstats.csv'), load)
+
+#code for reach json files
+def reach_json(reach_ids, storage):
+        Streamstats = streamstats(storage)
 
         #Get streamstats information for each USGS location
         sites = pd.DataFrame()
 
-        for site in reach_ids:
-            s = Streamstats[Streamstats['NWIS_site_id'] ==  str(site)]
-            sites = pd.concat([sites, s])
+        with span('site_select'):
+            for site in reach_ids:
+                s = Streamstats[Streamstats['NWIS_site_id'] ==  str(site)]
+                sites = pd.concat([sites, s])
+
+        if sites.empty:
+            return gpd.GeoDataFrame()
 
         stateids = list(set(list(sites['state_id'])))
 
@@ -47,16 +71,98 @@ def reach_json(reach_ids,BUCKET, BUCKET_NAME, S3):
             stationpaths.append(stations_path)
 
         #combine stations
-        combined = combine_jsons(stationpaths, BUCKET_NAME, S3)
+        combined = combine_jsons(stationpaths, storage)
         
         #get site ids out of DF to make new geojson
         finaldf = gpd.GeoDataFrame()
-        for site in reach_ids:
-            df = combined[combined['USGS_id'] == site]
-            finaldf = pd.concat([finaldf, df])
+        with span('site_select'):
+            for site in reach_ids:
+                df = combined[combined['USGS_id'] == site]
+                finaldf = pd.concat([finaldf, df])
 
         #reset index and drop any duplicates
         finaldf.reset_index(inplace = True, drop = True)
         finaldf.drop_duplicates('USGS_id', inplace = True)        
 
         return finaldf
+
+
+#code for selecting the points inside polygons
+def points_in_polygons(x, y, polygons):
+    """
+    Mask of the points (x, y) intersecting any of the polygons, each point is tested once.
+
+    The points are indexed by sorted x, so a polygon only looks at the points inside its bounding box, which are
+    then tested against the prepared polygon without building point geometries.
+
+    Args:
+        x (np.ndarray): longitudes.
+        y (np.ndarray): latitudes.
+        polygons (list): shapely (multi)polygons in the same crs.
+
+    Returns:
+        np.ndarray: bool per point.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    inside = np.zeros(len(x), dtype=bool)
+    order = np.argsort(x, kind='stable')
+    xs = x[order]
+    for polygon in polygons:
+        if polygon is None or polygon.is_empty:
+            continue
+        minx, miny, maxx, maxy = polygon.bounds
+        #points in the x range of the bounding box, then in its y range, that are not matched yet
+        candidates = order[np.searchsorted(xs, minx, 'left'):np.searchsorted(xs, maxx, 'right')]
+        candidates = candidates[(y[candidates] >= miny) & (y[candidates] <= maxy) & ~inside[candidates]]
+        if not len(candidates):
+            continue
+        shapely.prepare(polygon)
+        inside[candidates] = shapely.intersects_xy(polygon, x[candidates], y[candidates])
+    return inside
+
+
+#code for the StreamStats sites in a list of HUCs
+def huc_sites(HUCid, storage):
+    """
+    StreamStats rows of the named sites inside the HUCs, each site once.
+
+    Args:
+        HUCid (list): HUC codes of the same level, e.g. ['1602', '1603'].
+        storage (Storage): bucket backend, read for the WBD FileGDBs when a HUC has no GeoParquet extract.
+
+    Returns:
+        pd.DataFrame: rows of Streamstats.csv.
+    """
+    #Get HUC level
+    HUC_length = 'huc'+str(len(HUCid[0]))
+
+    #columns to keep
+    HUC_cols = ['areaacres', 'areasqkm', 'states', HUC_length, 'name', 'shape_Length', 'shape_Area', 'geometry']
+    HUC_Geo = gpd.GeoDataFrame(columns = HUC_cols, geometry = 'geometry')
+
+    for h in HUCid:
+        #the HUC by key from the GeoParquet extract, see wbd.py
+        with span('wbd_read'):
+            HUC_G = read_huc(h)
+        if HUC_G is None:
+            HU = h[:2]
+            HUCunit = 'WBDHU'+str(len(h))
+            filepath = storage.uri(f"WBD/WBD_{HU}_HU2_GDB/WBD_{HU}_HU2_GDB.gdb/")
+            with span('wbd_read'):
+                HUC_G = gpd.read_file(filepath, layer=HUCunit)
+
+        #select HUC
+        HUC_G = HUC_G[HUC_G[HUC_length] == h]
+        HUC_G = HUC_G[HUC_cols]
+        HUC_Geo = pd.concat([HUC_Geo,HUC_G])
+
+    #Load streamstats wiht lat long to get geolocational information
+    Streamstats = streamstats(storage)
+
+    # Select the StreamStats sites in the HUC, each site once
+    with span('spatial_join'):
+        inside = points_in_polygons(Streamstats['dec_long_va'], Streamstats['dec_lat_va'], HUC_Geo.geometry)
+    sites = Streamstats[inside]
+    #takes rows with site name
+    return sites[sites['NWIS_sitename'].notna()]
@@ -0,0 +1,181 @@
+"""
+Background warmup of the default views of a worker.
+
+The first request after a deploy used to pay for everything cold: Streamstats.csv, the AL state GeoJSON, the
+Jordan River gauges of the HUC view and the Reach defaults. start_warmup runs the default views once in a daemon
+thread, so the parsed tables and series land in the worker caches (cache.py) without blocking that request, plus
+the states and HUCs of the prewarm_states/prewarm_hucs settings. Only the first prefetch_max_stations stations of
+each default view are plotted, the prefetch reads the others when their map is composed. The warmup starts at the
+first request the worker serves (warm_on_first_request) or the first ready/ probe, not at import, so management
+commands and tests do not read the bucket. readiness() backs the ready/ endpoint, which answers 503 until the
+warmup is done so a load balancer only routes to warm workers; a failed warmup stays at 503 and the next probe
+starts it again.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+from django.core.signals import request_started
+from django.http import QueryDict
+
+from .timing import span
+
+
+#query of the State/HUC views for the extra states and HUCs
+WARM_QUERY = {'start-date': '01-01-2019', 'end-date': '06-11-2019', 'model_id': 'NWM_v2.1'}
+
+_status = {'state': 'idle', 'started': None, 'seconds': None, 'warmed': [], 'errors': []}
+_ready = threading.Event()
+_lock = threading.Lock()
+_thread = None
+
+
+def prewarm_settings():
+    """
+    The prewarm, prewarm_states and prewarm_hucs app settings.
+
+    Returns:
+        bool, list, list: whether to warm, extra state ids and extra HUC ids.
+    """
+    from .app import CSES as app
+    enabled = app.get_custom_setting('prewarm')
+    states = app.get_custom_setting('prewarm_states') or ''
+    hucs = app.get_custom_setting('prewarm_hucs') or ''
+    split = lambda value: [v.strip() for v in value.split(',') if v.strip()]
+    return enabled is not False, split(states), split(hucs)
+
+
+def _request(query):
+    params = QueryDict(mutable=True)
+    params.update(query)
+    return SimpleNamespace(GET=params)
+
+
+def _features(layer_groups):
+    return layer_groups[0]['layers'][0]['options']['features']
+
+
+def warm_view(view_class, query=None, plots=0):
+    """
+    Compose a view as a request with `query` would, and plot its first `plots` stations.
+
+    Returns:
+        int: stations of the view.
+    """
+    request = _request(query or {})
+    view = view_class()
+    features = _features(view.compose_layers(request, {'view': {}}, None))
+    if plots:
+        for feature in features[:plots]:
+            props = feature['properties']
+            view.get_plot_for_layer_feature(request, 'USGS Stations', props.get('id'), {}, props, None)
+    return len(features)
+
+
+def warm(states=(), hucs=(), plots=None):
+    """
+    Warm the default Reach, State and HUC views and the plots of their first stations, then the layers of the extra
+    states and HUCs. A default view that fails raises, an extra state or HUC that fails is recorded.
+
+    Args:
+        plots (int): stations plotted per default view, the prefetch_max_stations setting when None.
+
+    Returns:
+        list: (step, seconds or error) per step.
+    """
+    from .prefetch import prefetch_settings
+    from .storage import get_storage
+    from .utils import streamstats
+    from .Reach_Controller import Reach_Eval
+    from .State_Controller import State_Eval
+    from .HUC_Controller import HUC_Eval
+
+    if plots is None:
+        plots = prefetch_settings()[1]
+    #(name, step, required)
+    steps = [('Streamstats', lambda: streamstats(get_storage()), True)]
+    steps += [(f"{view.__name__}[default]", lambda view=view: warm_view(view, plots=plots), True)
+              for view in (Reach_Eval, State_Eval, HUC_Eval)]
+    steps += [(f"State_Eval[{s}]", lambda s=s: warm_view(State_Eval, dict(WARM_QUERY, state_id=s)), False)
+              for s in states]
+    steps += [(f"HUC_Eval[{h}]", lambda h=h: warm_view(HUC_Eval, dict(WARM_QUERY, huc_ids=h)), False)
+              for h in hucs]
+
+    results = []
+    for name, step, required in steps:
+        t0 = time.perf_counter()
+        try:
+            with span('warmup'):
+                step()
+            results.append((name, round(time.perf_counter() - t0, 3)))
+        except Exception as e:
+            #a missing extra state or HUC should not keep the worker out of rotation
+            if required:
+                raise
+            results.append((name, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def _run(states, hucs):
+    t0 = time.perf_counter()
+    try:
+        if states is None:
+            enabled, states, hucs = prewarm_settings()
+            if not enabled:
+                _status['state'] = 'disabled'
+                _ready.set()
+                return
+        for name, outcome in warm(states, hucs):
+            (_status['warmed'] if isinstance(outcome, float) else _status['errors']).append([name, outcome])
+        _status['state'] = 'ready'
+        _ready.set()
+    except Exception as e:
+        #not ready, ready/ keeps answering 503 and starts the warmup again
+        _status['state'] = 'failed'
+        _status['errors'].append(['warmup', f"{type(e).__name__}: {e}"])
+    finally:
+        _status['seconds'] = round(time.perf_counter() - t0, 3)
+
+
+def start_warmup(states=None, hucs=None, background=True):
+    """
+    Start the warmup once per process, or again after it failed. The prewarm settings are read in the thread when
+    `states` is None.
+
+    Returns:
+        threading.Thread: the warmup thread, None when it runs in the foreground.
+    """
+    global _thread
+    with _lock:
+        if _status['started'] is not None and _status['state'] != 'failed':
+            return _thread
+        _status.update(state='warming', started=time.time(), seconds=None, warmed=[], errors=[])
+    if not background:
+        _run(states, hucs)
+        return None
+    _thread = threading.Thread(target=_run, args=(states, hucs), name='cses-warmup', daemon=True)
+    _thread.start()
+    return _thread
+
+
+def _first_request(sender, **kwargs):
+    request_started.disconnect(dispatch_uid='cses-warmup')
+    start_warmup()
+
+
+def warm_on_first_request():
+    """
+    Start the warmup when the worker serves its first request, of any app of the portal.
+    """
+    request_started.connect(_first_request, dispatch_uid='cses-warmup', weak=False)
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def readiness():
+    """
+    Warmup state of this worker: ready, the steps warmed with their seconds, and the steps that failed.
+    """
+    return dict(_status, ready=is_ready())
@@ -0,0 +1,122 @@
+"""
+GeoParquet extracts of the WBD boundaries in the app workspace.
+
+The HUC view used to read a whole WBDHU layer of a HU2 FileGDB from S3 to select one HUC. The extract writes every
+WBDHU2-WBDHU12 layer once, one GeoParquet per level and HU2 region (``WBDHU8/16.parquet``), sorted by HUC code in
+small row groups and with a bbox covering column. A HUC is then read by key: the row group statistics on the sorted
+code column skip every row group but the one holding it::
+
+    python -m tethysapp.community_streamflow_evaluation_system.wbd --storage-root <bucket mirror>
+"""
+import argparse
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+from .storage import create_storage
+
+
+LEVELS = (2, 4, 6, 8, 10, 12)
+REGIONS = [f"{i:02d}" for i in range(1, 23)]
+ROW_GROUP_SIZE = 64
+#WBD shipped with the app workspace
+DEFAULT_WBD_DIR = os.path.join(os.path.dirname(__file__), 'workspaces', 'app_workspace', 'wbd')
+
+_wbd_dir = None
+
+
+def configure_wbd_dir(path):
+    """
+    Read the extracts from `path` for this process, e.g. from the benchmark suite, instead of the app workspace.
+    """
+    global _wbd_dir
+    _wbd_dir = path
+
+
+def wbd_dir():
+    return _wbd_dir or DEFAULT_WBD_DIR
+
+
+def huc_columns(digits):
+    """
+    Columns kept for a WBDHU level, as selected by the HUC view.
+    """
+    return ['areaacres', 'areasqkm', 'states', f"huc{digits}", 'name', 'shape_Length', 'shape_Area', 'geometry']
+
+
+def extract_path(root, digits, region):
+    return os.path.join(root, f"WBDHU{digits}", f"{region}.parquet")
+
+
+def extract_region(storage, output, region, levels=LEVELS):
+    """
+    Write the WBDHU layers of one HU2 FileGDB as GeoParquet.
+
+    Returns:
+        int: layers written, levels missing from the FileGDB are skipped.
+    """
+    filepath = storage.uri(f"WBD/WBD_{region}_HU2_GDB/WBD_{region}_HU2_GDB.gdb/")
+    layers = set(gpd.list_layers(filepath)['name'])
+    written = 0
+    for digits in levels:
+        if f"WBDHU{digits}" not in layers:
+            print(f"WBD_{region}: no WBDHU{digits} layer")
+            continue
+        layer = gpd.read_file(filepath, layer=f"WBDHU{digits}")
+        col = f"huc{digits}"
+        layer = layer[[c for c in huc_columns(digits) if c in layer.columns]]
+        #sorted by code so every row group covers a narrow range of codes
+        layer = layer.sort_values(col, kind='stable').reset_index(drop=True)
+        path = extract_path(output, digits, region)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        layer.to_parquet(tmp, index=False, row_group_size=ROW_GROUP_SIZE, write_covering_bbox=True)
+        os.replace(tmp, path)
+        written += 1
+    return written
+
+
+def read_huc(huc, root=None):
+    """
+    The WBD polygon of one HUC code from the extracts.
+
+    Returns:
+        gpd.GeoDataFrame: rows of the HUC with huc_columns, None when its level and region were not extracted.
+    """
+    digits = len(huc)
+    path = extract_path(root or wbd_dir(), digits, huc[:2])
+    if not os.path.exists(path):
+        return None
+    col = f"huc{digits}"
+    return gpd.read_parquet(path, columns=huc_columns(digits), filters=[(col, '==', huc)])
+
+
+def read_hucs(hucs, root=None):
+    """
+    The WBD polygons of several HUC codes, see read_huc.
+
+    Returns:
+        gpd.GeoDataFrame: None when any of the codes has no extract.
+    """
+    frames = [read_huc(h, root) for h in hucs]
+    if not frames or any(f is None for f in frames):
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract the WBD FileGDBs to GeoParquet in the app workspace.')
+    parser.add_argument('--output', default=DEFAULT_WBD_DIR, help='directory to write the extracts under')
+    parser.add_argument('--storage-root', help='read from this local bucket mirror instead of S3')
+    parser.add_argument('--regions', nargs='+', default=REGIONS, help='HU2 regions, e.g. 16 17')
+    parser.add_argument('--levels', nargs='+', type=int, default=LEVELS, help='HUC digits, e.g. 2 4 8')
+    args = parser.parse_args(argv)
+
+    storage = create_storage('local', args.storage_root) if args.storage_root else create_storage('s3')
+    count = sum(extract_region(storage, args.output, region, args.levels) for region in args.regions)
+    print(f"{count} WBD layers written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()